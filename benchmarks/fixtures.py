@@ -0,0 +1,91 @@
+import os
+
+import ffmpeg
+
+
+def generate_video(
+    output_path,
+    duration,
+    video_kbps=1000,
+    audio_kbps=128,
+    size="1280x720",
+    fps=25,
+    faststart=True,
+    audio_source=None,
+):
+    """
+    Write a synthetic H.264/AAC MP4 of the given duration (seconds) and
+    bitrates. The picture is ffmpeg's testsrc2 pattern; the audio is a sine
+    tone, or audio_source looped to length (use real speech when the
+    transcription stage is benchmarked). faststart=False leaves moov after
+    mdat, which exercises the streaming fallback path.
+    """
+    video = ffmpeg.input(
+        f"testsrc2=size={size}:rate={fps}:duration={duration}", f="lavfi"
+    )
+    if audio_source:
+        audio = ffmpeg.input(audio_source, stream_loop=-1, t=duration)
+    else:
+        audio = ffmpeg.input(
+            f"sine=frequency=440:sample_rate=44100:duration={duration}", f="lavfi"
+        )
+
+    output_args = {
+        "vcodec": "libx264",
+        "preset": "ultrafast",
+        "b:v": f"{video_kbps}k",
+        "acodec": "aac",
+        "b:a": f"{audio_kbps}k",
+        "t": duration,
+    }
+    if faststart:
+        output_args["movflags"] = "+faststart"
+
+    (
+        ffmpeg.output(video, audio, output_path, **output_args)
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    return output_path
+
+
+def generate_fixtures(
+    fixture_dir,
+    count,
+    duration,
+    video_kbps=1000,
+    audio_kbps=128,
+    faststart_ratio=1.0,
+    audio_source=None,
+):
+    """
+    Generate count videos named "bench-<i>.mp4" in fixture_dir, reusing files
+    that already exist for the same parameters. The first
+    round(count * faststart_ratio) are faststart, the rest are not.
+    Returns the list of paths.
+    """
+    params = f"{duration}s-{video_kbps}k-{audio_kbps}k"
+    if audio_source:
+        params += "-" + os.path.splitext(os.path.basename(audio_source))[0]
+    fixture_dir = os.path.join(fixture_dir, params)
+    if not os.path.exists(fixture_dir):
+        os.makedirs(fixture_dir)
+
+    faststart_count = round(count * faststart_ratio)
+    paths = []
+    for i in range(count):
+        faststart = i < faststart_count
+        layout = "faststart" if faststart else "trailing"
+        path = os.path.join(fixture_dir, f"bench-{i}-{layout}.mp4")
+        if not os.path.exists(path):
+            print(f"Generating fixture {path} ...")
+            generate_video(
+                path,
+                duration,
+                video_kbps=video_kbps,
+                audio_kbps=audio_kbps,
+                faststart=faststart,
+                audio_source=audio_source,
+            )
+        paths.append(path)
+    return paths
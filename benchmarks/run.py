@@ -0,0 +1,348 @@
+import argparse
+import ast
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmarks.fixtures import generate_fixtures
+from benchmarks.s3_standin import (
+    make_client,
+    reset_buckets,
+    seed_videos,
+    standin_env,
+    start_s3_standin,
+)
+
+# Usage, from the repository root:
+#
+#   python -m benchmarks.run --videos 8 --duration 120
+#   python -m benchmarks.run --stages extract --set PIPELINE_ENABLED=True
+#   python -m benchmarks.run --compare benchmarks/results/<old>.json
+#
+# Every stage runs in its own child process with a fresh config and fresh
+# state under --workdir, so peak RSS and transfer totals are per stage.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("extract", "metadata", "transcribe")
+# Manifest stage name written by each entry point
+MANIFEST_STAGES = {
+    "extract": "extracted",
+    "metadata": "metadata",
+    "transcribe": "transcribed",
+}
+
+
+def _peak_rss_mb(who):
+    """ru_maxrss is KB on Linux and bytes on macOS."""
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+    return round(peak / 1e6, 1)
+
+
+def _manifest_counts(manifest_path, stage):
+    counts = {"done": 0, "failed": 0}
+    if not os.path.exists(manifest_path):
+        return counts
+    conn = sqlite3.connect(manifest_path)
+    try:
+        for status, count in conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE stage = ? GROUP BY status", (stage,)
+        ):
+            counts[status] = count
+    finally:
+        conn.close()
+    return counts
+
+
+def _apply_overrides(config, overrides):
+    for name, value in overrides.items():
+        if not hasattr(config, name):
+            raise SystemExit(f"Unknown config setting: {name}")
+        setattr(config, name, value)
+
+
+def run_child(stage, workdir, overrides, result_path):
+    """
+    Body of a stage child process: point config at workdir, run the stage's
+    entry point and write its timings and resource usage to result_path.
+    """
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    # config must be patched before any repo module binds its values
+    import config
+
+    _apply_overrides(
+        config,
+        {
+            "LOCAL_TEMP_DIR": os.path.join(workdir, "tmp"),
+            "LOG_DIR": os.path.join(workdir, "logs"),
+            "MANIFEST_PATH": os.path.join(workdir, "state", "manifest.sqlite3"),
+            "LEASE_SQLITE_PATH": os.path.join(workdir, "state", "leases.sqlite3"),
+            "METRICS_DIR": os.path.join(workdir, "state", "metrics"),
+        },
+    )
+    _apply_overrides(config, overrides)
+    if not os.path.exists(config.LOCAL_TEMP_DIR):
+        os.makedirs(config.LOCAL_TEMP_DIR)
+
+    if stage == "extract":
+        from main import main as entry_point
+    elif stage == "metadata":
+        from metadata import main as entry_point
+    else:
+        from whisperx_trnascript import main as entry_point
+    from utils.metrics import metrics
+    from utils.storage import transfer_stats
+
+    error = None
+    started = time.monotonic()
+    try:
+        entry_point()
+    except BaseException as e:  # SystemExit included; the report records it
+        error = repr(e)
+    seconds = time.monotonic() - started
+
+    result = {
+        "seconds": round(seconds, 3),
+        "error": error,
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        # Largest single child, e.g. one ffmpeg process
+        "peak_child_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "files": _manifest_counts(config.MANIFEST_PATH, MANIFEST_STAGES[stage]),
+        "transfers": transfer_stats.summary(),
+        # Per-stage latency and bytes as recorded by utils/metrics.py
+        "stage_metrics": metrics.snapshot()["stages"],
+    }
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def _git_revision():
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def _bucket_bytes(s3_client, bucket_name, suffix):
+    total = 0
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for item in page.get("Contents", []):
+            if item["Key"].endswith(suffix):
+                total += item["Size"]
+    return total
+
+
+def _run_stage(stage, args, env):
+    stage_dir = os.path.join(args.workdir, "run")
+    result_path = os.path.join(args.workdir, f"{stage}.json")
+    log_path = os.path.join(args.workdir, f"{stage}.log")
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.run",
+        "--child",
+        stage,
+        "--workdir",
+        stage_dir,
+        "--result-path",
+        result_path,
+    ]
+    for setting in args.set:
+        command += ["--set", setting]
+
+    print(f"Running {stage} stage (output in {log_path}) ...")
+    with open(log_path, "w") as log_file:
+        subprocess.run(
+            command,
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            check=False,
+        )
+    if not os.path.exists(result_path):
+        return {"error": f"stage process crashed, see {log_path}"}
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def _add_throughput(result, input_bytes, audio_seconds_per_file):
+    seconds = result.get("seconds")
+    if not seconds:
+        return result
+    done = result["files"]["done"]
+    result["input_bytes"] = input_bytes
+    result["files_per_s"] = round(done / seconds, 3)
+    result["mb_per_s"] = round(input_bytes / seconds / 1e6, 2)
+    result["audio_seconds_per_s"] = round(done * audio_seconds_per_file / seconds, 2)
+    return result
+
+
+def print_summary(report, baseline=None):
+    print(f"{'stage':<12}{'files/s':>10}{'MB/s':>10}{'audio s/s':>12}{'peak RSS MB':>13}  error")
+    for stage, result in report["stages"].items():
+        line = (
+            f"{stage:<12}{result.get('files_per_s', '-'):>10}{result.get('mb_per_s', '-'):>10}"
+            f"{result.get('audio_seconds_per_s', '-'):>12}{result.get('peak_rss_mb', '-'):>13}"
+            f"  {result.get('error') or ''}"
+        )
+        old = (baseline or {}).get("stages", {}).get(stage, {})
+        if old.get("files_per_s") and result.get("files_per_s"):
+            line += f"  ({result['files_per_s'] / old['files_per_s']:.2f}x baseline)"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark on synthetic media")
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=60, help="seconds per video")
+    parser.add_argument("--video-kbps", type=int, default=1000)
+    parser.add_argument("--audio-kbps", type=int, default=128)
+    parser.add_argument(
+        "--faststart-ratio",
+        type=float,
+        default=1.0,
+        help="share of videos with moov before mdat; the rest exercise fallbacks",
+    )
+    parser.add_argument("--audio-source", help="speech recording looped into the fixtures")
+    parser.add_argument("--stages", default="extract,metadata", help=f"comma list of {STAGES}")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="override a config.py setting (Python literal), e.g. PIPELINE_ENABLED=True",
+    )
+    parser.add_argument("--endpoint", help="use this S3 endpoint instead of a moto server")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--workdir", default=os.path.join(REPO_ROOT, "benchmarks", "work"))
+    parser.add_argument("--output", help="report path (default benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--child", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result-path", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for setting in args.set:
+        name, _, value = setting.partition("=")
+        overrides[name] = ast.literal_eval(value)
+
+    if args.child:
+        run_child(args.child, args.workdir, overrides, args.result_path)
+        return
+
+    stages = [s for s in args.stages.split(",") if s]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"Unknown stage: {stage}")
+
+    sys.path.insert(0, REPO_ROOT)
+    import config
+
+    region_name = config.REGION_NAME
+    fixtures = generate_fixtures(
+        os.path.join(args.workdir, "fixtures"),
+        args.videos,
+        args.duration,
+        video_kbps=args.video_kbps,
+        audio_kbps=args.audio_kbps,
+        faststart_ratio=args.faststart_ratio,
+        audio_source=args.audio_source,
+    )
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server, endpoint = start_s3_standin(port=args.port)
+    fake_credentials = server is not None
+    try:
+        s3_client = make_client(endpoint, region_name, fake_credentials)
+        reset_buckets(
+            s3_client,
+            [
+                config.BUCKET_INPUT,
+                config.BUCKET_OUTPUT,
+                config.METADATA_BUCKET,
+                config.TRANSCRIPT_BUCKET,
+            ],
+            region_name,
+        )
+        video_bytes = seed_videos(s3_client, config.BUCKET_INPUT, fixtures)
+
+        # Fresh local state, so no stage skips work from an earlier run
+        shutil.rmtree(os.path.join(args.workdir, "run"), ignore_errors=True)
+        os.makedirs(os.path.join(args.workdir, "run"))
+        env = standin_env(endpoint, region_name, fake_credentials)
+
+        results = {}
+        for stage in stages:
+            if stage == "transcribe":
+                input_bytes = _bucket_bytes(s3_client, config.BUCKET_OUTPUT, ".m4a")
+            else:
+                input_bytes = video_bytes
+            results[stage] = _add_throughput(
+                _run_stage(stage, args, env), input_bytes, args.duration
+            )
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        "revision": _git_revision(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {
+            "videos": args.videos,
+            "duration": args.duration,
+            "video_kbps": args.video_kbps,
+            "audio_kbps": args.audio_kbps,
+            "faststart_ratio": args.faststart_ratio,
+            "audio_source": args.audio_source,
+            "endpoint": "moto" if server is not None else endpoint,
+        },
+        "overrides": overrides,
+        "stages": results,
+    }
+
+    output = args.output
+    if output is None:
+        output = os.path.join(
+            REPO_ROOT,
+            "benchmarks",
+            "results",
+            f"{report['revision']['commit'][:10] or 'unknown'}-{int(time.time())}.json",
+        )
+    if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_summary(report, baseline)
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+
+import boto3
+
+# moto accepts any credentials; these keep boto3 from looking for real ones
+STANDIN_ENV = {
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_SESSION_TOKEN": "benchmark",
+}
+
+
+def start_s3_standin(host="127.0.0.1", port=5005):
+    """
+    Start moto's S3 server in a background thread. Returns (server,
+    endpoint_url); call server.stop() when done.
+    """
+    # Imported here so the rest of the harness works against a real
+    # endpoint without moto installed
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address=host, port=port, verbose=False)
+    server.start()
+    return server, f"http://{host}:{port}"
+
+
+def standin_env(endpoint_url, region_name, fake_credentials=True):
+    """
+    Environment for a child process so every boto3 client it creates,
+    including utils.storage.get_s3_client, talks to endpoint_url.
+    Pass fake_credentials=False for a real endpoint (e.g. MinIO).
+    """
+    env = dict(os.environ)
+    if fake_credentials:
+        env.update(STANDIN_ENV)
+    env["AWS_ENDPOINT_URL_S3"] = endpoint_url
+    env["AWS_DEFAULT_REGION"] = region_name
+    return env
+
+
+def make_client(endpoint_url, region_name, fake_credentials=True):
+    credentials = {}
+    if fake_credentials:
+        credentials = {
+            "aws_access_key_id": STANDIN_ENV["AWS_ACCESS_KEY_ID"],
+            "aws_secret_access_key": STANDIN_ENV["AWS_SECRET_ACCESS_KEY"],
+            "aws_session_token": STANDIN_ENV["AWS_SESSION_TOKEN"],
+        }
+    return boto3.session.Session().client(
+        "s3", endpoint_url=endpoint_url, region_name=region_name, **credentials
+    )
+
+
+def reset_buckets(s3_client, bucket_names, region_name):
+    """Create each bucket, emptying it first if it already exists."""
+    existing = {b["Name"] for b in s3_client.list_buckets().get("Buckets", [])}
+    for bucket_name in bucket_names:
+        if bucket_name in existing:
+            paginator = s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket_name):
+                for item in page.get("Contents", []):
+                    s3_client.delete_object(Bucket=bucket_name, Key=item["Key"])
+            continue
+        if region_name == "us-east-1":
+            s3_client.create_bucket(Bucket=bucket_name)
+        else:
+            s3_client.create_bucket(
+                Bucket=bucket_name,
+                CreateBucketConfiguration={"LocationConstraint": region_name},
+            )
+
+
+def seed_videos(s3_client, bucket_name, paths):
+    """Upload the fixture videos under their file names. Returns total bytes."""
+    total_bytes = 0
+    for path in paths:
+        s3_client.upload_file(path, bucket_name, os.path.basename(path))
+        total_bytes += os.path.getsize(path)
+    return total_bytes
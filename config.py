@@ -1,3 +1,5 @@
+import os
+
 BUCKET_INPUT = "damodaran-youtube-videos"
 BUCKET_OUTPUT = "demodaran-all-audio"
 REGION_NAME = "us-east-1"  # or whichever region your buckets are in
@@ -7,3 +9,292 @@ LOCAL_TEMP_DIR = "/tmp/video_processing"
 
 # Log directory where app log and failed files log will be saved
 LOG_DIR = "logs"
+# "sync": handlers write from the logging thread. "queue": records go through
+# a queue to one listener thread, also from process-pool workers.
+LOG_MODE = "sync"
+LOG_FORMAT = "text"  # "text" or "json" (one JSON object per line)
+
+# Staged pipeline mode for main.py: downloads, ffmpeg and uploads run
+# concurrently with bounded queues between the stages.
+PIPELINE_ENABLED = False
+PIPELINE_DOWNLOAD_WORKERS = 4  # threads fetching videos from BUCKET_INPUT
+PIPELINE_EXTRACT_WORKERS = 2  # ffmpeg processes
+PIPELINE_UPLOAD_WORKERS = 4  # threads pushing audio to BUCKET_OUTPUT
+# Max items waiting between two stages; bounds how many downloaded videos
+# can pile up in LOCAL_TEMP_DIR while ffmpeg catches up.
+PIPELINE_QUEUE_SIZE = 4
+
+# Adaptive concurrency (utils/throttle.py): the pipeline's downloads, ffmpeg
+# processes and uploads run under limits that start at the worker counts
+# above and move by additive increase / multiplicative decrease within
+# (min, max): down by ADAPTIVE_DECREASE_FACTOR after an S3 throttle error,
+# on CPU load above ADAPTIVE_CPU_TARGET (ffmpeg) or with less than
+# ADAPTIVE_MIN_FREE_DISK_BYTES free in LOCAL_TEMP_DIR (downloads, ffmpeg);
+# up by one per ADAPTIVE_INTERVAL_SECONDS while saturated and throughput
+# keeps up. Each stage then runs `max` threads.
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_INTERVAL_SECONDS = 5
+ADAPTIVE_DOWNLOAD_LIMITS = (1, 32)
+ADAPTIVE_UPLOAD_LIMITS = (1, 32)
+ADAPTIVE_EXTRACT_LIMITS = (1, os.cpu_count() or 1)
+ADAPTIVE_DECREASE_FACTOR = 0.5
+ADAPTIVE_CPU_TARGET = 0.9  # 1-minute load average per core
+ADAPTIVE_MIN_FREE_DISK_BYTES = 2 * 1024 ** 3
+# S3 SlowDown/503 errors that outlast botocore's own retries are retried
+# with full-jitter exponential backoff (always, also without the adaptive
+# limits) before a job is recorded as failed.
+THROTTLE_MAX_RETRIES = 6
+THROTTLE_BACKOFF_BASE_SECONDS = 1
+THROTTLE_BACKOFF_MAX_SECONDS = 60
+
+# Size-aware scheduling (video_processor/scheduler.py), using the Size that
+# the bucket listing already returns.
+#   "largest_first": start big files early so they overlap with small ones
+#   "smallest_first": finish the most files soonest
+#   "listing": bucket listing order, and work starts with the first page
+# The other orders buffer SCHEDULE_WINDOW listed jobs before the first job
+# starts; a larger window orders better but starts later.
+SCHEDULE_ORDER = "listing"
+SCHEDULE_WINDOW = 1000  # listed jobs buffered and reordered at a time
+# The pipeline only starts a job while the projected temp-disk and memory use
+# of all running jobs stays within these budgets. None for the disk budget
+# means TEMP_DISK_BUDGET_FRACTION of the free space in LOCAL_TEMP_DIR at
+# start; None for memory means half of physical memory.
+TEMP_DISK_BUDGET_BYTES = None
+TEMP_DISK_BUDGET_FRACTION = 0.8
+MEMORY_BUDGET_BYTES = None
+# Projection inputs: audio written per video byte, and one ffmpeg process
+AUDIO_TO_VIDEO_SIZE_RATIO = 0.15
+EXTRACT_MEMORY_PER_JOB_BYTES = 300 * 1024 ** 2
+
+# Also write a whisper-ready PCM sidecar ("<base>.f32le": 16 kHz mono
+# float32, raw) in the same ffmpeg run as the .m4a and upload it next to it.
+# The transcription stage memory-maps it instead of decoding the .m4a.
+# Streamed and audio-only-fetch jobs have no sidecar; their transcription
+# decodes as before. A sidecar is ~230 MB per hour of audio.
+PCM_SIDECAR_ENABLED = False
+PCM_SIDECAR_EXTENSION = ".f32le"
+
+# Streaming extraction: pipe the S3 body through ffmpeg straight into a
+# multipart upload, without touching LOCAL_TEMP_DIR. Videos whose moov atom
+# sits after the media data cannot be demuxed from a pipe; those fall back to
+# the regular download/extract/upload path.
+STREAMING_ENABLED = False
+STREAMING_PART_SIZE = 8 * 1024 * 1024  # multipart part size (S3 minimum is 5 MB)
+
+# Audio-only fetch: read the moov box with ranged GETs and download only the
+# audio sample chunks, remuxing them into the same .m4a extract_audio would
+# produce. Layouts it cannot handle fall back to a full download.
+AUDIO_ONLY_FETCH_ENABLED = False
+# Audio ranges closer than this are fetched as one GET (the video bytes in
+# between are downloaded and discarded).
+AUDIO_FETCH_MAX_GAP = 128 * 1024
+# Upper bound on ranged GETs per video; the smallest gaps are merged first.
+AUDIO_FETCH_MAX_REQUESTS = 512
+# Fall back to a full download when the merged ranges would fetch more than
+# this fraction of the video anyway (finely interleaved audio and video).
+AUDIO_FETCH_MAX_FRACTION = 0.5
+AUDIO_FETCH_CONCURRENCY = 8  # ranged GETs in flight per video
+
+# Shared S3 client (utils/storage.py). The connection pool must be at least
+# as large as the number of threads issuing S3 requests at the same time.
+S3_MAX_POOL_CONNECTIONS = 50
+S3_MAX_RETRY_ATTEMPTS = 5
+# Small in-memory objects (transcripts) sent at once by storage.put_objects
+S3_PUT_CONCURRENCY = 8
+# Bucket listings (utils/storage.iter_objects) stream page by page. With
+# LIST_WORKERS > 1 the keyspace is split at the first LIST_DELIMITER (one
+# partition per top-level "folder") and partitions are listed in parallel.
+# Flat buckets have a single partition, so this only helps nested layouts.
+LIST_WORKERS = 1
+LIST_DELIMITER = "/"
+# Listed pages (up to 1000 keys each) buffered ahead of the consumer
+LIST_QUEUE_PAGES = 8
+# Multipart settings per kind of object; see boto3.s3.transfer.TransferConfig
+S3_TRANSFER_PROFILES = {
+    # Multi-GB lecture videos: big parts, many parallel part requests
+    "video": {
+        "multipart_threshold": 64 * 1024 * 1024,
+        "multipart_chunksize": 64 * 1024 * 1024,
+        "max_concurrency": 10,
+    },
+    # Extracted audio, tens to hundreds of MB
+    "audio": {
+        "multipart_threshold": 16 * 1024 * 1024,
+        "multipart_chunksize": 16 * 1024 * 1024,
+        "max_concurrency": 4,
+    },
+    # Transcripts and metadata JSON: a single request, no transfer threads
+    "text": {
+        "multipart_threshold": 64 * 1024 * 1024,
+        "multipart_chunksize": 64 * 1024 * 1024,
+        "max_concurrency": 1,
+        "use_threads": False,
+    },
+}
+
+# Local job-state manifest (utils/manifest.py), shared by main.py, metadata.py
+# and whisperx_trnascript.py
+MANIFEST_PATH = "state/manifest.sqlite3"
+
+# Multi-node work distribution (utils/leases.py)
+#   "single": one process handles the whole bucket (default)
+#   "lease":  nodes claim each job with an expiring lease in a shared store
+#   "shard":  each node takes the jobs whose key hash maps to SHARD_INDEX
+WORKER_MODE = os.environ.get("WORKER_MODE", "single")
+WORKER_ID = os.environ.get("WORKER_ID")  # defaults to <hostname>-<pid>
+LEASE_BACKEND = "sqlite"  # "sqlite" (one machine, tests) or "s3" (conditional writes)
+LEASE_SQLITE_PATH = "state/leases.sqlite3"
+LEASE_S3_BUCKET = BUCKET_OUTPUT
+LEASE_S3_PREFIX = "_leases/"
+# A lease is renewed every LEASE_TTL_SECONDS / 3 while its job runs; a node
+# that dies loses its leases after LEASE_TTL_SECONDS.
+LEASE_TTL_SECONDS = 600
+SHARD_INDEX = int(os.environ.get("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+
+# Transcription (whisperx_trnascript.py and transcription_service.py)
+TRANSCRIBE_MODEL = "base.en"
+TRANSCRIBE_DEVICE = "cuda"  # falls back to "cpu" without CUDA
+TRANSCRIPT_BUCKET = "transcript-demodaran-all"
+TRANSCRIPT_PREFIX = "output"  # transcripts go under "<prefix>/transcripts/"
+# Alignment models kept in memory, keyed by (language, device). Eviction is
+# least-recently-used once either limit is exceeded.
+ALIGN_CACHE_MAX_MODELS = 3
+ALIGN_CACHE_MAX_BYTES = 3 * 1024 ** 3
+# Files decoded and passed to one model.transcribe call. 1 transcribes each
+# file on its own; larger values keep the batch full for short clips.
+TRANSCRIBE_BATCH_FILES = 1
+TRANSCRIBE_BATCH_SIZE = 8  # VAD segments per forward pass (whisperx default)
+# Language of the batched files; None detects it from the first file.
+TRANSCRIBE_LANGUAGE = None
+# Prefetch/async-upload driver: download the next files while the current
+# one transcribes and upload transcripts in the background. 0 disables it.
+PREFETCH_DEPTH = 0
+PREFETCH_MAX_BYTES = 2 * 1024 ** 3  # cap on downloaded audio waiting on disk
+PREFETCH_WORKERS = 2  # download threads
+UPLOAD_WORKERS = 4  # transcript upload threads
+UPLOAD_MAX_PENDING = 8  # files whose uploads may be queued at once
+# Parallel transcription of long files on CPU (transcriber/parallel.py).
+# Files longer than PARALLEL_MIN_AUDIO_SECONDS are split at quiet points into
+# spans of about PARALLEL_SEGMENT_SECONDS, which PARALLEL_TRANSCRIBE_WORKERS
+# processes (each with its own model) transcribe and align. 0 disables it.
+# Only used when the model runs on CPU.
+PARALLEL_TRANSCRIBE_WORKERS = 0
+PARALLEL_MIN_AUDIO_SECONDS = 20 * 60
+PARALLEL_SEGMENT_SECONDS = 5 * 60
+# A cut is placed at the quietest point within this many seconds of its target
+PARALLEL_SPLIT_SEARCH_SECONDS = 15
+PARALLEL_COMPUTE_TYPE = "int8"
+PARALLEL_THREADS_PER_WORKER = None  # None splits the CPU cores evenly
+
+# CPU inference profile (transcriber/cpu_profile.py), used whenever the
+# model runs on CPU. "python tune_cpu_profile.py CLIP" times candidate
+# settings on a short clip and saves the fastest one whose word error rate
+# against a float32 reference run is at most CPU_TUNE_WER_TOLERANCE to
+# CPU_PROFILE_PATH; it then replaces these defaults (and the
+# PARALLEL_TRANSCRIBE_WORKERS/PARALLEL_THREADS_PER_WORKER settings above).
+CPU_PROFILE_PATH = "state/cpu_profile.json"
+CPU_COMPUTE_TYPE = "int8"  # "int8" or "float32"
+CPU_THREADS = None  # intra-op threads of the main model; None uses every core
+CPU_BATCH_SIZE = TRANSCRIBE_BATCH_SIZE
+# VAD speech probability thresholds (whisperx defaults)
+CPU_VAD_ONSET = 0.500
+CPU_VAD_OFFSET = 0.363
+# Candidates tried by the tuning command: every combination of these
+CPU_TUNE_COMPUTE_TYPES = ("int8", "float32")
+CPU_TUNE_WORKERS = (1, 2, 4)  # processes sharing the cores
+CPU_TUNE_BATCH_SIZES = (4, 8, 16)
+CPU_TUNE_VAD_ONSETS = (CPU_VAD_ONSET,)
+CPU_TUNE_CLIP_SECONDS = 120  # the clip is cut to this length
+CPU_TUNE_WER_TOLERANCE = 0.02
+
+# Chunked timestamp files written per transcript ("<base>_<N>sec_timestamps.txt").
+# Other sizes can be rebuilt later from the "<base>_words.npz" sidecar.
+TRANSCRIPT_CHUNK_SIZES = (30, 60)
+
+# Transcript artifacts are rendered in memory and uploaded with concurrent
+# put_object calls. TRANSCRIPT_GZIP stores the text artifacts with
+# Content-Encoding: gzip under the same keys: browsers and HTTP clients
+# decompress them transparently, boto3 get_object returns the gzip bytes.
+TRANSCRIPT_GZIP = False
+# One "<base>_transcripts.tar" per file instead of separate objects. The
+# search index (search_index.py) reads the separate "_words.npz" objects.
+TRANSCRIPT_BUNDLE = False
+
+# Inverted index over transcript words (transcriber/search_index.py), built
+# by "python search_index.py build" from the "<base>_words.npz" sidecars in
+# TRANSCRIPT_BUCKET and queried with "python search_index.py query".
+# Videos are buffered and written as a segment every SEARCH_INDEX_SEGMENT_WORDS
+# words; above SEARCH_INDEX_MAX_SEGMENTS segments the smallest
+# SEARCH_INDEX_MERGE_FACTOR are merged, so a lookup reads a bounded number of
+# segments however many hours of lectures are indexed.
+SEARCH_INDEX_DIR = "state/search_index"
+SEARCH_INDEX_SEGMENT_WORDS = 2_000_000
+SEARCH_INDEX_MAX_SEGMENTS = 8
+SEARCH_INDEX_MERGE_FACTOR = 4
+
+# Crash-safe transcription (transcriber/checkpoint.py): files longer than
+# CHECKPOINT_MIN_AUDIO_SECONDS are transcribed in spans of about
+# CHECKPOINT_SPAN_SECONDS, and each finished span is appended to a file in
+# CHECKPOINT_DIR (and copied to CHECKPOINT_S3_BUCKET if set). A rerun after
+# a crash or preemption resumes after the last finished span. With the
+# parallel transcriber its spans are checkpointed instead.
+CHECKPOINT_ENABLED = False
+CHECKPOINT_DIR = "state/checkpoints"
+CHECKPOINT_MIN_AUDIO_SECONDS = 20 * 60
+CHECKPOINT_SPAN_SECONDS = 5 * 60
+CHECKPOINT_S3_BUCKET = None
+CHECKPOINT_S3_PREFIX = "_checkpoints/"
+
+# Resident transcription worker (transcription_service.py): jobs are taken
+# from a SQLite queue, polled every TRANSCRIBE_QUEUE_POLL_SECONDS. A running
+# job whose worker has not sent a heartbeat for TRANSCRIBE_QUEUE_STALE_SECONDS
+# is handed to another worker.
+TRANSCRIBE_QUEUE_PATH = "state/transcribe_queue.sqlite3"
+TRANSCRIBE_QUEUE_POLL_SECONDS = 0.2
+TRANSCRIBE_QUEUE_STALE_SECONDS = 300
+# Health and throughput of the worker, rewritten every few seconds
+TRANSCRIBE_SERVICE_HEALTH_PATH = "state/transcription_service.json"
+TRANSCRIBE_SERVICE_HEALTH_SECONDS = 5
+# Transcripts of local-file jobs are written here
+TRANSCRIBE_SERVICE_OUTPUT_DIR = "transcripts"
+# main.py queues each newly extracted audio file for the resident worker
+TRANSCRIBE_QUEUE_SUBMIT = False
+
+# Media metadata (video_processor/media_metadata.py). With EXTRACT_METADATA
+# main.py also writes "<base>_metadata.json" to METADATA_BUCKET, reusing the
+# video it already downloads; metadata.py runs the same stage on its own.
+EXTRACT_METADATA = False
+METADATA_BUCKET = "damodaran-vidoes-metadata"
+METADATA_TOOL = "mediainfo"  # "mediainfo" (pymediainfo) or "ffprobe"
+# "header" probes only the container boxes with ranged GETs into a sparse
+# temp file; "download" fetches the whole video first (metadata.py only).
+METADATA_PROBE = "header"
+METADATA_PROBE_WORKERS = 16  # concurrent probes in metadata.py
+# Non-MP4 or heavily fragmented files: probe this much of the head and tail
+METADATA_PROBE_HEAD_BYTES = 4 * 1024 * 1024
+METADATA_PROBE_TAIL_BYTES = 4 * 1024 * 1024
+# "objects": one "<base>_metadata.json" per video. "index": compact JSONL
+# shards under METADATA_INDEX_PREFIX, each run appending new shards.
+METADATA_OUTPUT = "objects"
+METADATA_INDEX_PREFIX = "index/"
+METADATA_INDEX_SHARD_RECORDS = 1000
+
+# Per-stage metrics (utils/metrics.py): "<METRICS_DIR>/<job>.json" is
+# rewritten every METRICS_FLUSH_SECONDS. Set METRICS_PROMETHEUS_DIR to the
+# node exporter's textfile collector directory to export them as well.
+METRICS_DIR = "state/metrics"
+METRICS_PROMETHEUS_DIR = None
+METRICS_FLUSH_SECONDS = 15
+
+# Content-addressed dedup (utils/content_cache.py). Outputs are recorded in
+# the manifest under the source's content id (ETag + size); a re-uploaded or
+# renamed copy of a processed video or audio file gets a server-side S3 copy
+# of the earlier output instead of being processed again. Costs a HEAD per
+# file and suffixes new audio keys with a content hash.
+DEDUP_ENABLED = False
+# Optional local cache of downloaded/extracted audio keyed by content id,
+# evicted least-recently-used above ARTIFACT_CACHE_MAX_BYTES. None disables it.
+ARTIFACT_CACHE_DIR = None
+ARTIFACT_CACHE_MAX_BYTES = 20 * 1024 ** 3
@@ -1,127 +1,382 @@
 
 import os
-import boto3
-from botocore.exceptions import ClientError
 
 # Local imports
-from config import BUCKET_INPUT, BUCKET_OUTPUT, LOCAL_TEMP_DIR, REGION_NAME
+from config import (
+    AUDIO_ONLY_FETCH_ENABLED,
+    BUCKET_INPUT,
+    BUCKET_OUTPUT,
+    DEDUP_ENABLED,
+    EXTRACT_METADATA,
+    LOCAL_TEMP_DIR,
+    METADATA_OUTPUT,
+    PCM_SIDECAR_ENABLED,
+    PIPELINE_ENABLED,
+    STREAMING_ENABLED,
+    TRANSCRIBE_QUEUE_SUBMIT,
+)
+from utils.content_cache import (
+    KIND_AUDIO,
+    KIND_PCM,
+    cache_local_file,
+    content_id,
+    content_id_metadata,
+    reuse_artifact,
+    short_hash,
+)
+from utils.job_queue import submit_transcription
+from utils.leases import WorkCoordinator, job_id
 from utils.logger import setup_loggers
+from utils.manifest import STAGE_EXTRACTED, JobManifest
+from utils.metrics import metrics
+from utils.pcm import pcm_sidecar_path
+from utils.storage import ListedKeys, get_s3_client, iter_objects, transfer_stats
 from video_processor.audio_extractor import extract_audio
+from video_processor.audio_fetcher import fetch_audio_track
 from video_processor.downloader import download_video_from_s3
-from video_processor.uploader import upload_audio_to_s3
+from video_processor.media_metadata import run_metadata_stage
+from video_processor.metadata_index import MetadataIndexWriter
+from video_processor.pipeline import ExtractionPipeline
+from video_processor.scheduler import order_jobs
+from video_processor.streaming import try_stream_audio_to_s3
+from video_processor.uploader import upload_audio_to_s3, upload_pcm_sidecar
 
 
-def main():
-    # Set up loggers
-    app_logger, failures_logger = setup_loggers()
+def iter_pending_videos(manifest, processed_audio_keys, app_logger):
+    """
+    Yield (object_key, audio_object_key, etag, size) for every MP4 in
+    BUCKET_INPUT that the manifest has not recorded as extracted at its
+    current ETag.
 
-    # Ensure local temp directory exists
-    if not os.path.exists(LOCAL_TEMP_DIR):
-        os.makedirs(LOCAL_TEMP_DIR)
+    processed_audio_keys is the legacy name-based skip set; it is only filled
+    on the first run with a manifest, and its matches are recorded in the
+    manifest so later runs no longer need to list BUCKET_OUTPUT.
+    """
+    # audio key (lower case) -> source key, for keys handed out this run
+    # (with DEDUP_ENABLED)
+    assigned_audio_keys = {}
 
-    # Create an S3 client
-    s3_client = boto3.client("s3", region_name=REGION_NAME)
+    # Streamed page by page, so the first job starts on the first page
+    for item in iter_objects(BUCKET_INPUT, suffixes=(".mp4",)):
+        object_key = item["Key"]
+        etag = item["ETag"]
 
-    # ----------------------------------------------------------------------------
-    # 1. Gather all already-processed audio keys from the BUCKET_OUTPUT.
-    #    We'll store them in a set so we can skip re-processing.
-    # ----------------------------------------------------------------------------
-    processed_audio_keys = set()
-    try:
-        paginator_out = s3_client.get_paginator("list_objects_v2")
-        page_iterator_out = paginator_out.paginate(Bucket=BUCKET_OUTPUT)
-        for page_out in page_iterator_out:
-            # If the bucket is empty or page is empty, skip
-            if "Contents" not in page_out:
-                continue
-            for obj_out in page_out["Contents"]:
-                # Add the existing audio file name (in lower case) to the set
-                processed_audio_keys.add(obj_out["Key"].lower())
+        base_name = os.path.splitext(os.path.basename(object_key))[0]
+        audio_object_key = base_name + ".m4a"  # The key we'll use in BUCKET_OUTPUT
 
-        app_logger.info(
-            f"Found {len(processed_audio_keys)} files already in {BUCKET_OUTPUT}."
-        )
-    except ClientError as e:
-        app_logger.error(f"Error listing objects in output bucket: {e}")
-    # ----------------------------------------------------------------------------
-
-    # Use a paginator to list objects in pages from the input bucket
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=BUCKET_INPUT)
-
-    page_count = 0
-    for page in page_iterator:
-        page_count += 1
-        app_logger.info(f"Processing page #{page_count}")
-
-        # If there are no objects (or this page is empty), skip
-        if "Contents" not in page:
-            app_logger.info(f"No objects found in page #{page_count}. Skipping...")
+        if DEDUP_ENABLED:
+            # Two different videos with the same basename (in different
+            # folders) get distinct audio keys instead of overwriting each other
+            owner = assigned_audio_keys.get(audio_object_key.lower()) or manifest.get_source_key(
+                BUCKET_INPUT, STAGE_EXTRACTED, audio_object_key
+            )
+            if owner is not None and owner != object_key:
+                audio_object_key = f"{base_name}-{short_hash(object_key)}.m4a"
+            assigned_audio_keys[audio_object_key.lower()] = object_key
+
+        # Check if this video has already been processed at this version
+        if manifest.is_done(BUCKET_INPUT, object_key, etag, STAGE_EXTRACTED):
+            app_logger.info(
+                "Audio for %s already extracted to '%s'. Skipping...",
+                object_key,
+                audio_object_key,
+            )
+            continue
+
+        # Check if this audio file has already been processed (exists in BUCKET_OUTPUT)
+        if audio_object_key in processed_audio_keys:
+            app_logger.info(
+                "Audio for %s (would be '%s') already exists in %s. Skipping...",
+                object_key,
+                audio_object_key,
+                BUCKET_OUTPUT,
+            )
+            manifest.mark_done(
+                BUCKET_INPUT, object_key, etag, STAGE_EXTRACTED, audio_object_key
+            )
             continue
 
-        # Iterate over all objects in the current page
-        for item in page["Contents"]:
-            object_key = item["Key"]
+        yield object_key, audio_object_key, etag, item["Size"]
 
-            # Skip if the file is not an MP4
-            if not object_key.lower().endswith(".mp4"):
-                app_logger.info(f"Skipping non-MP4 file: {object_key}")
-                continue
 
-            base_name = os.path.splitext(os.path.basename(object_key))[0]
-            local_audio_filename = base_name + ".m4a"
-            audio_object_key = local_audio_filename  # The key we'll use in BUCKET_OUTPUT
-
-            # ----------------------------------------------------------------------------
-            # 2. Check if this audio file has already been processed (exists in BUCKET_OUTPUT)
-            # ----------------------------------------------------------------------------
-            if audio_object_key.lower() in processed_audio_keys:
-                app_logger.info(
-                    f"Audio for {object_key} (would be '{audio_object_key}') "
-                    f"already exists in {BUCKET_OUTPUT}. Skipping..."
-                )
-                continue
+def record_success(
+    manifest, object_key, audio_object_key, etag, processed_audio_keys, cid=None
+):
+    """
+    Remember a finished job in the manifest and in this run's skip set, and
+    the audio as the artifact for the video's content.
+    """
+    manifest.mark_done(BUCKET_INPUT, object_key, etag, STAGE_EXTRACTED, audio_object_key)
+    if cid is not None:
+        manifest.put_artifact(cid, KIND_AUDIO, BUCKET_OUTPUT, audio_object_key)
+    processed_audio_keys.add(audio_object_key.lower())
+    if TRANSCRIBE_QUEUE_SUBMIT:
+        # The resident worker (transcription_service.py) picks it up right away
+        submit_transcription(BUCKET_OUTPUT, audio_object_key)
 
-            app_logger.info(f"Processing video file: {object_key}")
 
-            # 1) Download the file
-            local_video_path = download_video_from_s3(BUCKET_INPUT, object_key, app_logger)
-            if not local_video_path:
-                # download_video_from_s3 already logged the error
-                failures_logger.error(f"DOWNLOAD_FAILED: {object_key}")
-                continue
+def reuse_extracted_audio(manifest, cid, audio_object_key, app_logger):
+    """
+    True if audio for the same video content already exists, and is now
+    (server-side copied) at audio_object_key as well.
+    """
+    return DEDUP_ENABLED and reuse_artifact(
+        manifest,
+        cid,
+        KIND_AUDIO,
+        BUCKET_OUTPUT,
+        audio_object_key,
+        app_logger,
+        extra_args=content_id_metadata(cid, copy=True),
+    )
+
+
+def cache_extracted_audio(cid, local_audio_path):
+    """Keep local copies for a transcription run on this node, if enabled."""
+    cache_local_file(cid, KIND_AUDIO, local_audio_path)
+    cache_local_file(cid, KIND_PCM, pcm_sidecar_path(local_audio_path))
 
-            # 2) Extract audio
-            local_audio_path = os.path.join(LOCAL_TEMP_DIR, local_audio_filename)
-            try:
-                extract_audio(local_video_path, local_audio_path, app_logger)
-            except Exception as e:
-                app_logger.exception(f"Audio extraction failed for {object_key}")
-                failures_logger.error(f"EXTRACTION_FAILED: {object_key}")
-                # Clean up the downloaded video before continuing
-                if os.path.exists(local_video_path):
-                    os.remove(local_video_path)
-                continue
 
-            # 3) Upload audio to output S3 bucket
-            uploaded = upload_audio_to_s3(
-                local_audio_path, BUCKET_OUTPUT, audio_object_key, app_logger
+def record_failure(manifest, object_key, etag, reason, failures_logger):
+    """Log a failed job to failed_files.log and the manifest."""
+    failures_logger.error("%s: %s", reason, object_key)
+    manifest.mark_failed(BUCKET_INPUT, object_key, etag, STAGE_EXTRACTED, reason)
+
+
+def process_video(
+    object_key,
+    audio_object_key,
+    etag,
+    size,
+    manifest,
+    processed_audio_keys,
+    app_logger,
+    failures_logger,
+    metadata_index=None,
+):
+    """
+    Download, extract and upload a single video, one step after the other.
+    Returns True if the audio ended up in BUCKET_OUTPUT.
+    """
+    app_logger.info("Processing video file: %s", object_key)
+    cid = content_id(etag, size)
+
+    # A copy of a video that was already extracted: reuse its audio
+    if reuse_extracted_audio(manifest, cid, audio_object_key, app_logger):
+        if EXTRACT_METADATA:
+            run_metadata_stage(
+                object_key,
+                etag,
+                None,
+                manifest,
+                app_logger,
+                failures_logger,
+                index_writer=metadata_index,
             )
-            if not uploaded:
-                failures_logger.error(f"UPLOAD_FAILED: {object_key}")
+        record_success(
+            manifest, object_key, audio_object_key, etag, processed_audio_keys, cid
+        )
+        return True
+
+    # 0) Stream straight from S3 through ffmpeg to S3 when the layout allows it
+    if STREAMING_ENABLED:
+        streamed = try_stream_audio_to_s3(
+            BUCKET_INPUT,
+            object_key,
+            BUCKET_OUTPUT,
+            audio_object_key,
+            app_logger,
+            metadata=content_id_metadata(cid)["Metadata"],
+        )
+        if streamed is not None:
+            if EXTRACT_METADATA:
+                run_metadata_stage(
+                    object_key,
+                    etag,
+                    None,
+                    manifest,
+                    app_logger,
+                    failures_logger,
+                    index_writer=metadata_index,
+                )
+            if streamed:
+                record_success(
+                    manifest, object_key, audio_object_key, etag, processed_audio_keys, cid
+                )
             else:
-                # If uploaded successfully, add it to processed_audio_keys so we
-                # won't process it again if the script runs multiple times.
-                processed_audio_keys.add(audio_object_key.lower())
+                record_failure(
+                    manifest, object_key, etag, "STREAMING_FAILED", failures_logger
+                )
+            return streamed
+
+    local_audio_path = os.path.join(LOCAL_TEMP_DIR, audio_object_key)
+    local_pcm_path = pcm_sidecar_path(local_audio_path)
+    local_video_path = None
+
+    # Fetch only the audio chunks when the MP4 layout allows it; that needs
+    # neither the video download nor ffmpeg.
+    fetched_audio = AUDIO_ONLY_FETCH_ENABLED and fetch_audio_track(
+        BUCKET_INPUT, object_key, local_audio_path, app_logger
+    )
+    if fetched_audio and EXTRACT_METADATA:
+        # No local video in this mode; probe the headers over HTTP instead
+        run_metadata_stage(
+            object_key,
+            etag,
+            None,
+            manifest,
+            app_logger,
+            failures_logger,
+            index_writer=metadata_index,
+        )
+    if not fetched_audio:
+        # 1) Download the file
+        local_video_path = download_video_from_s3(BUCKET_INPUT, object_key, app_logger)
+        if not local_video_path:
+            # download_video_from_s3 already logged the error
+            record_failure(manifest, object_key, etag, "DOWNLOAD_FAILED", failures_logger)
+            return False
+
+        # 1b) Metadata from the same local copy, so the video is read from S3 once
+        if EXTRACT_METADATA:
+            run_metadata_stage(
+                object_key,
+                etag,
+                local_video_path,
+                manifest,
+                app_logger,
+                failures_logger,
+                index_writer=metadata_index,
+            )
 
-            # 4) Clean up local files to free space
+        # 2) Extract audio
+        try:
+            with metrics.timed("extract") as op:
+                extract_audio(
+                    local_video_path,
+                    local_audio_path,
+                    app_logger,
+                    pcm_output_path=local_pcm_path if PCM_SIDECAR_ENABLED else None,
+                )
+                op.bytes = os.path.getsize(local_audio_path)
+        except Exception as e:
+            app_logger.exception("Audio extraction failed for %s", object_key)
+            record_failure(manifest, object_key, etag, "EXTRACTION_FAILED", failures_logger)
+            # Clean up the downloaded video before continuing
             if os.path.exists(local_video_path):
                 os.remove(local_video_path)
-            if os.path.exists(local_audio_path):
-                os.remove(local_audio_path)
+            if os.path.exists(local_pcm_path):
+                os.remove(local_pcm_path)
+            return False
+
+    # 3) Upload audio to output S3 bucket
+    uploaded = upload_audio_to_s3(
+        local_audio_path,
+        BUCKET_OUTPUT,
+        audio_object_key,
+        app_logger,
+        extra_args=content_id_metadata(cid),
+    )
+    if not uploaded:
+        record_failure(manifest, object_key, etag, "UPLOAD_FAILED", failures_logger)
+    else:
+        upload_pcm_sidecar(
+            local_audio_path,
+            BUCKET_OUTPUT,
+            audio_object_key,
+            app_logger,
+            extra_args=content_id_metadata(cid),
+        )
+        # If uploaded successfully, record it so we won't process it again
+        # if the script runs multiple times.
+        record_success(
+            manifest, object_key, audio_object_key, etag, processed_audio_keys, cid
+        )
+        cache_extracted_audio(cid, local_audio_path)
+
+    # 4) Clean up local files to free space
+    if local_video_path and os.path.exists(local_video_path):
+        os.remove(local_video_path)
+    if os.path.exists(local_audio_path):
+        os.remove(local_audio_path)
+    if os.path.exists(local_pcm_path):
+        os.remove(local_pcm_path)
+
+    return uploaded
+
+
+def main():
+    # Set up loggers
+    app_logger, failures_logger = setup_loggers()
+
+    # Ensure local temp directory exists
+    if not os.path.exists(LOCAL_TEMP_DIR):
+        os.makedirs(LOCAL_TEMP_DIR)
+
+    # Shared S3 client, also used by the downloader and uploader
+    get_s3_client()
+
+    metrics.start("extract")
+    manifest = JobManifest()
+    # Decides which videos this node runs when several nodes share the bucket
+    coordinator = WorkCoordinator(log=app_logger.warning)
+    coordinator.start()
+    metadata_index = None
+    if EXTRACT_METADATA and METADATA_OUTPUT == "index":
+        metadata_index = MetadataIndexWriter(manifest, app_logger, failures_logger)
+    processed_audio_keys = set()
+    if manifest.get_checkpoint(STAGE_EXTRACTED, BUCKET_INPUT) is None:
+        # No completed pass recorded yet: seed the manifest from what is
+        # already in the output bucket. Later runs skip this listing. It
+        # fills in the background while the first jobs already run.
+        processed_audio_keys = ListedKeys(BUCKET_OUTPUT, log=app_logger.info)
+    # Ordered by the listed Size (see SCHEDULE_ORDER)
+    pending_videos = order_jobs(
+        iter_pending_videos(manifest, processed_audio_keys, app_logger),
+        size_of=lambda job: job[3],
+    )
+
+    if PIPELINE_ENABLED:
+        # Overlap downloads, ffmpeg and uploads across files
+        pipeline = ExtractionPipeline(
+            app_logger,
+            failures_logger,
+            manifest,
+            processed_audio_keys,
+            coordinator,
+            metadata_index=metadata_index,
+        )
+        pipeline.run(pending_videos)
+    else:
+        for object_key, audio_object_key, etag, size in pending_videos:
+            job = job_id(STAGE_EXTRACTED, BUCKET_INPUT, object_key, etag)
+            if not coordinator.claim(job):
+                app_logger.info("%s is handled by another worker. Skipping...", object_key)
+                continue
+            succeeded = process_video(
+                object_key,
+                audio_object_key,
+                etag,
+                size,
+                manifest,
+                processed_audio_keys,
+                app_logger,
+                failures_logger,
+                metadata_index,
+            )
+            coordinator.release(job, succeeded)
+
+    if metadata_index is not None:
+        metadata_index.close()
+    coordinator.stop()
+    manifest.set_checkpoint(STAGE_EXTRACTED, BUCKET_INPUT)
+    manifest.close()
 
+    metrics.stop()
+    transfer_stats.log_summary(app_logger.info)
+    metrics.log_summary(app_logger.info)
     app_logger.info("Processing complete.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
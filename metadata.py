@@ -1,107 +1,158 @@
 import os
-import json
-import boto3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from botocore.exceptions import ClientError
-from pymediainfo import MediaInfo
+
+from config import (
+    BUCKET_INPUT,
+    LOCAL_TEMP_DIR as PROBE_TEMP_DIR,
+    METADATA_BUCKET,
+    METADATA_OUTPUT,
+    METADATA_PROBE,
+    METADATA_PROBE_WORKERS,
+)
+from utils.logger import setup_loggers
+from utils.manifest import STAGE_METADATA, JobManifest
+from utils.metrics import metrics
+from utils.storage import download_file, iter_objects, transfer_stats
+from video_processor.media_metadata import run_metadata_stage
+from video_processor.metadata_index import MetadataIndexWriter
+
+# The metadata stage normally runs inside main.py (EXTRACT_METADATA), on the
+# video it already downloads for audio extraction. This script runs the same
+# stage on its own, e.g. to backfill videos whose audio already exists.
+# With METADATA_PROBE = "header" only the container headers are fetched, so
+# many videos are probed concurrently and nothing is fully downloaded.
 
 # Existing input bucket name
-INPUT_BUCKET_NAME = "damodaran-youtube-videos"  # Keep as-is
-REGION_NAME = "us-east-1"
+INPUT_BUCKET_NAME = BUCKET_INPUT
 
 # This is just a local temp folder for downloading videos before processing
 LOCAL_TEMP_DIR = "/tmp/video_metadata"
 
-# New output bucket for storing metadata
-METADATA_BUCKET_NAME = "damodaran-vidoes-metadata"
+# Output bucket for storing metadata
+METADATA_BUCKET_NAME = METADATA_BUCKET
 
 def download_video_from_s3(bucket_name, object_key, local_dir):
     """
     Download a video file from S3 to a local directory.
     Return the local file path if successful, None if failed.
     """
-    s3_client = boto3.client("s3", region_name=REGION_NAME)
     local_filename = os.path.basename(object_key)
     local_path = os.path.join(local_dir, local_filename)
 
-    try:
-        print(f"Downloading {object_key} from bucket {bucket_name}...")
-        s3_client.download_file(bucket_name, object_key, local_path)
-        print(f"Successfully downloaded {object_key} to {local_path}")
-        return local_path
-    except ClientError as e:
-        print(f"Failed to download {object_key}: {e}")
-        return None
-
-def extract_metadata(local_video_path):
+    with metrics.timed("download") as op:
+        try:
+            print(f"Downloading {object_key} from bucket {bucket_name}...")
+            download_file(bucket_name, object_key, local_path, profile="video")
+            op.bytes = os.path.getsize(local_path)
+            print(f"Successfully downloaded {object_key} to {local_path}")
+            return local_path
+        except ClientError as e:
+            op.error = True
+            print(f"Failed to download {object_key}: {e}")
+            return None
+
+def process_video(object_key, etag, size, manifest, app_logger, failures_logger, index_writer):
     """
-    Extract metadata from a video file using pymediainfo.
-    Returns a dictionary containing metadata.
+    Extract and store the metadata of one video, probing its headers or
+    downloading it first depending on METADATA_PROBE.
     """
-    media_info = MediaInfo.parse(local_video_path)
-    return media_info.to_data()
-
-def main():
-    # Ensure our local temp directory exists
-    if not os.path.exists(LOCAL_TEMP_DIR):
-        os.makedirs(LOCAL_TEMP_DIR)
+    print(f"Processing video file: {object_key}")
+
+    if METADATA_PROBE == "header":
+        run_metadata_stage(
+            object_key,
+            etag,
+            None,
+            manifest,
+            app_logger,
+            failures_logger,
+            object_size=size,
+            index_writer=index_writer,
+        )
+        return
+
+    # 1) Download the file locally
+    local_video_path = download_video_from_s3(
+        INPUT_BUCKET_NAME, object_key, LOCAL_TEMP_DIR
+    )
+    if not local_video_path:
+        print(f"DOWNLOAD_FAILED: {object_key}")
+        manifest.mark_failed(
+            INPUT_BUCKET_NAME, object_key, etag, STAGE_METADATA, "DOWNLOAD_FAILED"
+        )
+        return
 
-    s3_client = boto3.client("s3", region_name=REGION_NAME)
-
-    # Paginate through all objects in the input bucket
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=INPUT_BUCKET_NAME)
-
-    page_count = 0
-    for page in page_iterator:
-        page_count += 1
-        print(f"Processing page #{page_count}")
+    try:
+        # 2) Extract metadata and upload the JSON to the metadata bucket
+        run_metadata_stage(
+            object_key,
+            etag,
+            local_video_path,
+            manifest,
+            app_logger,
+            failures_logger,
+            index_writer=index_writer,
+        )
+    finally:
+        # Clean up local video file to save space
+        if os.path.exists(local_video_path):
+            os.remove(local_video_path)
 
-        if "Contents" not in page:
-            print(f"No objects found in page #{page_count}. Skipping...")
+def main():
+    app_logger, failures_logger = setup_loggers()
+
+    # Ensure our local temp directories exist
+    for directory in (LOCAL_TEMP_DIR, PROBE_TEMP_DIR):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    metrics.start("metadata")
+    manifest = JobManifest()
+    index_writer = None
+    if METADATA_OUTPUT == "index":
+        index_writer = MetadataIndexWriter(manifest, app_logger, failures_logger)
+
+    # Header probes are a few small GETs each, so run many at once; full
+    # downloads go one at a time as before.
+    workers = METADATA_PROBE_WORKERS if METADATA_PROBE == "header" else 1
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight = set()
+
+    # Streamed page by page; only MP4 files are listed
+    for item in iter_objects(INPUT_BUCKET_NAME, suffixes=(".mp4",)):
+        object_key = item["Key"]
+        etag = item["ETag"]
+
+        # Skip videos whose metadata is already uploaded for this version
+        if manifest.is_done(INPUT_BUCKET_NAME, object_key, etag, STAGE_METADATA):
+            print(f"Metadata for {object_key} already extracted. Skipping...")
             continue
 
-        for item in page["Contents"]:
-            object_key = item["Key"]
-            # Only process MP4 files
-            if not object_key.lower().endswith(".mp4"):
-                print(f"Skipping non-MP4 file: {object_key}")
-                continue
-
-            print(f"Processing video file: {object_key}")
-
-            # 1) Download the file locally
-            local_video_path = download_video_from_s3(
-                INPUT_BUCKET_NAME, object_key, LOCAL_TEMP_DIR
+        # Keep the listing at most a couple of probes ahead of the workers
+        if len(in_flight) >= 2 * workers:
+            _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        in_flight.add(
+            executor.submit(
+                process_video,
+                object_key,
+                etag,
+                item["Size"],
+                manifest,
+                app_logger,
+                failures_logger,
+                index_writer,
             )
-            if not local_video_path:
-                print(f"DOWNLOAD_FAILED: {object_key}")
-                continue
-
-            try:
-                # 2) Extract metadata
-                video_metadata = extract_metadata(local_video_path)
-
-                # 3) Upload metadata JSON to the new “Metadata” bucket
-                file_base_name = os.path.splitext(os.path.basename(object_key))[0]
-                metadata_key = f"{file_base_name}_metadata.json"
-
-                serialized_metadata = json.dumps(video_metadata, indent=2, ensure_ascii=False)
-
-                s3_client.put_object(
-                    Bucket=METADATA_BUCKET_NAME,
-                    Key=metadata_key,
-                    Body=serialized_metadata,
-                    ContentType='application/json'
-                )
-
-                print(f"Metadata uploaded to s3://{METADATA_BUCKET_NAME}/{metadata_key}")
+        )
 
-            except Exception as e:
-                print(f"ERROR extracting or uploading metadata for {object_key}: {e}")
-            finally:
-                # Clean up local video file to save space
-                if os.path.exists(local_video_path):
-                    os.remove(local_video_path)
+    executor.shutdown(wait=True)
+    if index_writer is not None:
+        index_writer.close()
+    manifest.set_checkpoint(STAGE_METADATA, INPUT_BUCKET_NAME)
+    manifest.close()
+    metrics.stop()
+    transfer_stats.log_summary(print)
+    metrics.log_summary(print)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
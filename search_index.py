@@ -0,0 +1,93 @@
+import argparse
+import io
+import json
+import sys
+
+from config import TRANSCRIPT_BUCKET, TRANSCRIPT_PREFIX, TRANSCRIPT_CHUNK_SIZES
+from transcriber.search_index import SearchIndex
+from transcriber.word_store import WordStore
+from utils.manifest import STAGE_INDEXED, JobManifest
+from utils.storage import get_s3_client, iter_objects
+
+# Index-building stage and query tool for the transcript search index
+# (transcriber/search_index.py). Usage, from the repository root:
+#
+#   python search_index.py build
+#   python search_index.py query "fourier transform" --chunk-size 60
+#   python search_index.py merge
+#
+# "build" indexes every "<base>_words.npz" sidecar in TRANSCRIPT_BUCKET that
+# the manifest has not recorded as indexed at its current ETag, so reruns
+# only add new (or re-transcribed) lectures.
+
+WORDS_SIDECAR_SUFFIX = "_words.npz"
+
+
+def build(index, manifest):
+    """Add new word sidecars to the index. Returns the number of videos added."""
+    s3_client = get_s3_client()
+    prefix = f"{TRANSCRIPT_PREFIX}/transcripts/"
+    # Sidecars in the index buffer, recorded in the manifest once written
+    buffered = []
+    added = 0
+    for item in iter_objects(TRANSCRIPT_BUCKET, prefix, suffixes=(WORDS_SIDECAR_SUFFIX,)):
+        key = item["Key"]
+        etag = item["ETag"]
+        if manifest.is_done(TRANSCRIPT_BUCKET, key, etag, STAGE_INDEXED):
+            continue
+        try:
+            response = s3_client.get_object(Bucket=TRANSCRIPT_BUCKET, Key=key)
+            word_store = WordStore.load(io.BytesIO(response["Body"].read()))
+        except Exception as e:
+            print(f"Could not read {key}: {e}")
+            manifest.mark_failed(TRANSCRIPT_BUCKET, key, etag, STAGE_INDEXED, str(e))
+            continue
+        # Queries return the transcript base key, e.g. "output/transcripts/lecture1"
+        video = key[: -len(WORDS_SIDECAR_SUFFIX)]
+        buffered.append((key, etag))
+        added += 1
+        if index.add(video, word_store):
+            _mark_indexed(manifest, buffered)
+    index.flush()
+    _mark_indexed(manifest, buffered)
+    return added
+
+
+def _mark_indexed(manifest, buffered):
+    for key, etag in buffered:
+        manifest.mark_done(TRANSCRIPT_BUCKET, key, etag, STAGE_INDEXED)
+    buffered.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcript search index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="index new transcripts")
+    query = commands.add_parser("query", help="find where a word or phrase was said")
+    query.add_argument("text")
+    query.add_argument(
+        "--chunk-size", type=int, default=TRANSCRIPT_CHUNK_SIZES[0], help="window in seconds"
+    )
+    query.add_argument("--limit", type=int, default=20)
+    commands.add_parser("merge", help="merge all segments into one")
+    args = parser.parse_args(argv)
+
+    index = SearchIndex()
+    if args.command == "query":
+        print(json.dumps(index.search(args.text, args.chunk_size, args.limit), indent=2))
+        return 0
+    if args.command == "merge":
+        index.merge()
+        return 0
+
+    manifest = JobManifest()
+    try:
+        added = build(index, manifest)
+    finally:
+        manifest.close()
+    print(f"Indexed {added} new transcript(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
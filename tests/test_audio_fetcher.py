@@ -0,0 +1,115 @@
+import io
+import logging
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from video_processor.audio_fetcher import (
+    UnsupportedLayoutError,
+    fetch_audio_track,
+    merge_ranges,
+    rewrite_chunk_offsets,
+)
+
+
+def box(box_type, *payload):
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def audio_only_mp4(audio_chunks, video_gap):
+    """An MP4 whose audio chunks sit between video_gap bytes of video, moov last."""
+    ftyp = box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomiso2mp41")
+    mdat_payload = b""
+    offsets = []
+    for chunk in audio_chunks:
+        mdat_payload += b"\xff" * video_gap
+        offsets.append(len(ftyp) + 8 + len(mdat_payload))
+        mdat_payload += chunk
+    hdlr = box(b"hdlr", bytes(8), b"soun", bytes(12), b"\0")
+    count = len(audio_chunks)
+    stsz = box(b"stsz", bytes(4), struct.pack(f">II{count}I", 0, count, *map(len, audio_chunks)))
+    stsc = box(b"stsc", bytes(4), struct.pack(">IIII", 1, 1, 1, 1))
+    stco = box(b"stco", bytes(4), struct.pack(f">I{count}I", count, *offsets))
+    stbl = box(b"stbl", stsz, stsc, stco)
+    moov = box(b"moov", box(b"trak", box(b"mdia", hdlr, box(b"minf", stbl))))
+    return ftyp + box(b"mdat", mdat_payload) + moov
+
+
+class FakeS3Client:
+    def __init__(self, data):
+        self.data = data
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = map(int, Range[len("bytes="):].split("-"))
+        return {"Body": io.BytesIO(self.data[start:end + 1])}
+
+
+class MergeRangesTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(merge_ranges([]), [])
+
+    def test_close_spans_are_merged(self):
+        spans = [(0, 10), (15, 5), (100, 10)]
+        self.assertEqual(merge_ranges(spans, max_gap=5, max_requests=10), [(0, 20), (100, 110)])
+
+    def test_far_spans_stay_apart(self):
+        spans = [(0, 10), (50, 10)]
+        self.assertEqual(merge_ranges(spans, max_gap=0, max_requests=10), [(0, 10), (50, 60)])
+
+    def test_smallest_gaps_are_merged_to_fit_max_requests(self):
+        # Gaps: 10, 100, 20
+        spans = [(0, 10), (20, 10), (130, 10), (160, 10)]
+        self.assertEqual(
+            merge_ranges(spans, max_gap=0, max_requests=2), [(0, 30), (130, 170)]
+        )
+
+    def test_overlapping_spans(self):
+        spans = [(0, 20), (10, 5)]
+        self.assertEqual(merge_ranges(spans, max_gap=0, max_requests=10), [(0, 20)])
+
+
+class RewriteChunkOffsetsTest(unittest.TestCase):
+    def test_stco_entries_follow_the_given_order(self):
+        moov = bytearray(4 + 3 * 4)
+        # Chunk 2 comes first in the file, then 0, then 1
+        rewrite_chunk_offsets(moov, 4, 4, [2, 0, 1], [100, 200, 50], 1000)
+        self.assertEqual(struct.unpack_from(">3I", moov, 4), (1050, 1150, 1000))
+        self.assertEqual(moov[:4], bytes(4))
+
+    def test_co64_entries(self):
+        moov = bytearray(2 * 8)
+        rewrite_chunk_offsets(moov, 0, 8, [0, 1], [2 ** 32, 10], 2 ** 32)
+        self.assertEqual(struct.unpack_from(">2Q", moov, 0), (2 ** 32, 2 ** 33))
+
+    def test_offsets_past_stco_range_are_rejected(self):
+        moov = bytearray(2 * 4)
+        with self.assertRaises(UnsupportedLayoutError):
+            rewrite_chunk_offsets(moov, 0, 4, [0, 1], [2 ** 32, 10], 16)
+
+
+class FetchAudioTrackTest(unittest.TestCase):
+    def test_writes_the_audio_chunks_and_records_the_elapsed_time(self):
+        chunks = [b"a" * 100, b"b" * 100]
+        client = FakeS3Client(audio_only_mp4(chunks, video_gap=256 * 1024))
+        # Only this module's clock: the range reader keeps the real one
+        clock = mock.Mock(monotonic=mock.Mock(side_effect=[1000.0, 1002.5]))
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch("video_processor.audio_fetcher.get_s3_client", lambda: client), \
+                mock.patch("video_processor.audio_fetcher.time", clock), \
+                mock.patch("video_processor.audio_fetcher.metrics") as metrics:
+            output_path = os.path.join(tmp_dir, "lecture.m4a")
+            result = fetch_audio_track("bucket", "lecture.mp4", output_path, logging.getLogger())
+            self.assertEqual(result, output_path)
+            with open(output_path, "rb") as f:
+                self.assertTrue(f.read().endswith(b"a" * 100 + b"b" * 100))
+        metrics.record.assert_called_once_with("fetch_audio", 2.5, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import tempfile
+import unittest
+
+from transcriber.checkpoint import SpanCheckpoint, run_spans
+
+SPANS = [(0, 10), (10, 20), (20, 30), (30, 40)]
+
+
+class Crash(Exception):
+    pass
+
+
+class SpanCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.directory = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def checkpoint(self):
+        return SpanCheckpoint("s3://bucket/lecture.m4a", 40, self.directory, s3_bucket=None)
+
+    def run_until(self, crash_at):
+        """run_spans that crashes before transcribing span crash_at; returns the spans computed."""
+        computed = []
+
+        def transcribe_span(start, end):
+            if start == crash_at:
+                raise Crash()
+            computed.append(start)
+            return {"text": f"{start}-{end}"}
+
+        try:
+            results = run_spans(SPANS, transcribe_span, self.checkpoint())
+        except Crash:
+            results = None
+        return computed, results
+
+    def tear_last_line(self):
+        """Simulate a kill during a write: half a span line without its newline."""
+        with open(self.checkpoint().path, "a", encoding="utf-8") as f:
+            f.write('{"start": 99, "end"')
+
+    def test_resume_after_repeated_torn_writes(self):
+        computed, _ = self.run_until(crash_at=10)
+        self.assertEqual(computed, [0])
+        self.tear_last_line()
+
+        computed, _ = self.run_until(crash_at=30)
+        self.assertEqual(computed, [10, 20])
+        self.tear_last_line()
+
+        computed, results = self.run_until(crash_at=None)
+        self.assertEqual(computed, [30])
+        self.assertEqual([r["text"] for r in results], ["0-10", "10-20", "20-30", "30-40"])
+
+    def test_checkpoint_for_other_audio_is_discarded(self):
+        self.run_until(crash_at=20)
+        other = SpanCheckpoint("s3://bucket/lecture.m4a", 80, self.directory, s3_bucket=None)
+        self.assertEqual(other.load(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+from config import BUCKET_INPUT
+from utils.leases import job_id
+from utils.manifest import STAGE_EXTRACTED
+from video_processor.pipeline import ExtractionPipeline
+from video_processor.scheduler import ResourceBudget
+
+
+class StageErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.manifest = mock.Mock()
+        self.coordinator = mock.Mock()
+        self.failures_logger = mock.Mock()
+        self.pipeline = ExtractionPipeline(
+            mock.Mock(),
+            self.failures_logger,
+            self.manifest,
+            set(),
+            self.coordinator,
+            budget=ResourceBudget(10 ** 9, 10 ** 9),
+        )
+
+    def test_unrecorded_job_is_failed_and_its_lease_released(self):
+        self.pipeline._open_jobs.add("a.mp4")
+        self.pipeline._on_stage_error("a.mp4", "a.m4a", '"etag"', "cid", 100)
+        self.failures_logger.error.assert_called_once_with("%s: %s", "UNEXPECTED_ERROR", "a.mp4")
+        self.manifest.mark_failed.assert_called_once_with(
+            BUCKET_INPUT, "a.mp4", '"etag"', STAGE_EXTRACTED, "UNEXPECTED_ERROR"
+        )
+        self.coordinator.release.assert_called_once_with(
+            job_id(STAGE_EXTRACTED, BUCKET_INPUT, "a.mp4", '"etag"'), False
+        )
+
+    def test_recorded_job_is_not_failed_again(self):
+        self.pipeline._open_jobs.add("a.mp4")
+        self.pipeline._record_success("a.mp4", "a.m4a", '"etag"', "cid")
+        self.coordinator.reset_mock()
+        self.pipeline._on_stage_error("a.mp4", "a.m4a", '"etag"', "cid")
+        self.manifest.mark_failed.assert_not_called()
+        self.coordinator.release.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+from transcriber.prefetch import AudioPrefetcher, BackgroundUploader
+
+
+def run_batches(prefetcher, batch_files):
+    """Consume the prefetcher the way run_prefetched does; returns the items seen."""
+    seen = []
+    batch = []
+    for item, local_path, error in prefetcher:
+        batch.append(item)
+        if len(batch) >= batch_files:
+            seen.extend(batch)
+            for held in batch:
+                prefetcher.release(held)
+            batch = []
+    seen.extend(batch)
+    return seen
+
+
+class AudioPrefetcherTest(unittest.TestCase):
+    def test_batches_larger_than_the_byte_budget_lose_no_items(self):
+        items = [f"k{i}" for i in range(6)]
+        prefetcher = AudioPrefetcher(
+            items, fetch=lambda item: f"/tmp/{item}", size_of=lambda item: 10,
+            depth=2, max_bytes=15, workers=2,
+        )
+        self.assertEqual(run_batches(prefetcher, 2), items)
+
+    def test_bytes_on_disk_stay_under_max_bytes(self):
+        peaks = []
+        prefetcher = AudioPrefetcher(
+            range(10), fetch=lambda item: item, size_of=lambda item: 10,
+            depth=4, max_bytes=25, workers=2,
+        )
+        seen = []
+        for item, local_path, error in prefetcher:
+            peaks.append(prefetcher.bytes_on_disk)
+            seen.append(item)
+            prefetcher.release(item)
+        self.assertEqual(seen, list(range(10)))
+        self.assertLessEqual(max(peaks), 25)
+
+    def test_size_of_is_called_once_per_item(self):
+        calls = []
+
+        def size_of(item):
+            calls.append(item)
+            return 10
+
+        prefetcher = AudioPrefetcher(
+            range(6), fetch=lambda item: item, size_of=size_of, depth=3, max_bytes=15,
+        )
+        self.assertEqual(run_batches(prefetcher, 1), list(range(6)))
+        self.assertEqual(calls, list(range(6)))
+        self.assertEqual(prefetcher.bytes_on_disk, 0)
+
+    def test_fetch_errors_are_yielded_and_released(self):
+        def fetch(item):
+            if item == 1:
+                raise OSError("gone")
+            return item
+
+        prefetcher = AudioPrefetcher(range(3), fetch=fetch, size_of=lambda item: 1, depth=2)
+        results = [(item, error is not None) for item, _, error in prefetcher]
+        self.assertEqual(results, [(0, False), (1, True), (2, False)])
+        self.assertEqual(prefetcher.bytes_on_disk, 2)
+
+
+class BackgroundUploaderTest(unittest.TestCase):
+    def test_counts_pending_and_failed_jobs(self):
+        uploader = BackgroundUploader(workers=2, max_pending=2)
+        done = []
+        failed = []
+
+        def upload(i):
+            if i % 3 == 0:
+                raise OSError("upload failed")
+
+        for i in range(10):
+            uploader.submit(
+                lambda i=i: upload(i),
+                on_success=lambda i=i: done.append(i),
+                on_failure=lambda error, i=i: failed.append(i),
+            )
+            self.assertLessEqual(uploader.pending, 2)
+        self.assertEqual(uploader.wait(), 4)
+        self.assertEqual(uploader.pending, 0)
+        self.assertEqual(sorted(done + failed), list(range(10)))
+        self.assertEqual(sorted(failed), [0, 3, 6, 9])
+
+    def test_callback_errors_are_raised_by_wait(self):
+        uploader = BackgroundUploader(workers=1, max_pending=1)
+
+        def on_success():
+            raise RuntimeError("manifest is gone")
+
+        uploader.submit(lambda: None, on_success=on_success)
+        with self.assertRaises(RuntimeError):
+            uploader.wait()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from utils.storage import ListedKeys
+
+
+class FakeClient:
+    """head_object for a bucket holding exactly these keys."""
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.heads = []
+
+    def head_object(self, Bucket, Key):
+        self.heads.append(Key)
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {}
+
+
+class ListedKeysTest(unittest.TestCase):
+    def listed_keys(self, listing, client):
+        with mock.patch("utils.storage.iter_objects", listing), \
+                mock.patch("utils.storage.get_s3_client", lambda: client):
+            keys = ListedKeys("bucket", log=lambda message: None)
+            keys._thread.join()
+        return keys
+
+    def test_failed_listing_falls_back_to_head(self):
+        def listing(bucket_name):
+            yield {"Key": "a.m4a"}
+            raise EndpointConnectionError(endpoint_url="https://s3.amazonaws.com")
+
+        client = FakeClient(["a.m4a", "b.m4a"])
+        keys = self.listed_keys(listing, client)
+        with mock.patch("utils.storage.get_s3_client", lambda: client):
+            self.assertIn("a.m4a", keys)
+            self.assertIn("b.m4a", keys)
+            self.assertNotIn("c.m4a", keys)
+        self.assertEqual(client.heads, ["b.m4a", "c.m4a"])
+
+    def test_complete_listing_answers_without_head(self):
+        client = FakeClient(["a.m4a"])
+        keys = self.listed_keys(lambda bucket_name: iter([{"Key": "a.m4a"}]), client)
+        with mock.patch("utils.storage.get_s3_client", lambda: client):
+            self.assertIn("A.M4A", keys)
+            self.assertNotIn("b.m4a", keys)
+        self.assertEqual(client.heads, [])
+
+    def test_head_miss_does_not_wait_for_the_listing(self):
+        listed = threading.Event()
+
+        def listing(bucket_name):
+            yield {"Key": "Other.m4a"}
+            listed.wait()
+            yield {"Key": "Lecture.m4a"}
+
+        client = FakeClient(["Lecture.m4a", "Other.m4a"])
+        with mock.patch("utils.storage.iter_objects", listing), \
+                mock.patch("utils.storage.get_s3_client", lambda: client):
+            keys = ListedKeys("bucket", log=lambda message: None)
+            while "other.m4a" not in keys._keys:
+                time.sleep(0.01)
+            # Not listed yet and no exact-case match: a miss, right away
+            self.assertNotIn("lecture.m4a", keys)
+            # Listed in another case
+            self.assertIn("other.M4A", keys)
+            listed.set()
+            keys._thread.join()
+        self.assertEqual(client.heads, ["lecture.m4a"])
+
+    def test_head_errors_are_logged_as_misses(self):
+        client = FakeClient([])
+        client.head_object = mock.Mock(side_effect=ClientError(
+            {"Error": {"Code": "403", "Message": "Forbidden"}}, "HeadObject"
+        ))
+        listed = threading.Event()
+
+        def listing(bucket_name):
+            listed.wait()
+            return iter(())
+
+        messages = []
+        with mock.patch("utils.storage.iter_objects", listing), \
+                mock.patch("utils.storage.get_s3_client", lambda: client):
+            keys = ListedKeys("bucket", log=messages.append)
+            self.assertNotIn("a.m4a", keys)
+            listed.set()
+            keys._thread.join()
+        self.assertIn("Forbidden", messages[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import io
+import logging
+import unittest
+from unittest import mock
+
+from botocore.exceptions import IncompleteReadError
+
+from video_processor.streaming import is_streamable_video, stream_audio_to_s3
+
+
+class FakeS3Client:
+    def __init__(self, data):
+        self.data = data
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range is not None:
+            start, end = map(int, Range[len("bytes="):].split("-"))
+            return {"Body": io.BytesIO(self.data[start:end + 1])}
+        return {"Body": io.BytesIO(self.data)}
+
+
+class StreamAudioTest(unittest.TestCase):
+    def test_incomplete_read_aborts_the_multipart_upload(self):
+        def extract_audio_stream(body, writer, logger):
+            raise IncompleteReadError(actual_bytes=10, expected_bytes=100)
+
+        with mock.patch("video_processor.streaming.get_s3_client", lambda: FakeS3Client(b"")), \
+                mock.patch("video_processor.streaming.extract_audio_stream", extract_audio_stream), \
+                mock.patch("video_processor.streaming.MultipartUploadWriter") as writer_class:
+            streamed = stream_audio_to_s3(
+                "in", "lecture.mp4", "out", "lecture.m4a", logging.getLogger()
+            )
+        self.assertFalse(streamed)
+        writer_class.return_value.abort.assert_called_once_with()
+
+    def test_truncated_box_header_is_not_streamable(self):
+        # A 64-bit box size whose 8 size bytes are cut off
+        client = FakeS3Client(b"\x00\x00\x00\x01ftypis")
+        with mock.patch("video_processor.streaming.get_s3_client", lambda: client):
+            self.assertFalse(is_streamable_video("in", "lecture.mp4", logging.getLogger()))
+
+
+if __name__ == "__main__":
+    unittest.main()
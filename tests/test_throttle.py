@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+
+from utils.throttle import AdaptiveLimiter, call_with_throttle_retry, is_throttle_error
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": "..."}}, "PutObject")
+
+
+def upload_failed(code):
+    """S3UploadFailedError as boto3 raises it, while handling the ClientError."""
+    try:
+        try:
+            raise client_error(code)
+        except ClientError as e:
+            raise S3UploadFailedError(f"Failed to upload lecture_503.m4a: {e}")
+    except S3UploadFailedError as e:
+        return e
+
+
+class IsThrottleErrorTest(unittest.TestCase):
+    def test_client_error_codes(self):
+        self.assertTrue(is_throttle_error(client_error("SlowDown")))
+        self.assertTrue(is_throttle_error(client_error("503")))
+        self.assertFalse(is_throttle_error(client_error("AccessDenied")))
+
+    def test_wrapped_client_error(self):
+        self.assertTrue(is_throttle_error(upload_failed("SlowDown")))
+        self.assertFalse(is_throttle_error(upload_failed("AccessDenied")))
+
+    def test_messages_are_not_codes(self):
+        self.assertFalse(is_throttle_error(FileNotFoundError("/tmp/x/week2503.mp4")))
+        self.assertFalse(is_throttle_error(RuntimeError("SlowDown")))
+
+
+class CallWithThrottleRetryTest(unittest.TestCase):
+    def test_retries_throttles_without_holding_a_slot(self):
+        limiter = AdaptiveLimiter("test", 1, 1, 1, enabled=True)
+        in_flight_while_sleeping = []
+        attempts = []
+
+        def fn():
+            attempts.append(limiter.in_flight)
+            if len(attempts) < 3:
+                raise client_error("SlowDown")
+            return "ok"
+
+        def sleep(_):
+            in_flight_while_sleeping.append(limiter.in_flight)
+
+        with mock.patch("utils.throttle.time.sleep", sleep):
+            self.assertEqual(call_with_throttle_retry(fn, limiter), "ok")
+        self.assertEqual(attempts, [1, 1, 1])
+        self.assertEqual(in_flight_while_sleeping, [0, 0])
+
+    def test_other_errors_are_raised_at_once(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            raise client_error("AccessDenied")
+
+        with self.assertRaises(ClientError):
+            call_with_throttle_retry(fn)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
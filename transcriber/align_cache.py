@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+import torch
+import whisperx
+
+from config import ALIGN_CACHE_MAX_BYTES, ALIGN_CACHE_MAX_MODELS
+
+
+def _model_size_bytes(model):
+    """Approximate memory held by a torch model's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class AlignModelCache:
+    """
+    LRU cache of whisperx alignment models keyed by (language, device).
+
+    Almost every file has the same detected language, so the wav2vec2 weights
+    are loaded once instead of once per file. Models are evicted oldest-first
+    when more than max_models are cached or their combined size exceeds
+    max_bytes; the most recently used model is always kept.
+    """
+
+    def __init__(self, max_models=ALIGN_CACHE_MAX_MODELS, max_bytes=ALIGN_CACHE_MAX_BYTES):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, language, device):
+        """Return (model_a, metadata) for the language, loading it on a miss."""
+        key = (language, device)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                model_a, metadata, _ = self._models[key]
+                return model_a, metadata
+
+            print(f"Loading alignment model for language '{language}' on device '{device}' ...")
+            model_a, metadata = whisperx.load_align_model(
+                language_code=language,
+                device=device
+            )
+            self._models[key] = (model_a, metadata, _model_size_bytes(model_a))
+            self._evict()
+            return model_a, metadata
+
+    def total_bytes(self):
+        return sum(size for _, _, size in self._models.values())
+
+    def _evict(self):
+        evicted = False
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models or self.total_bytes() > self.max_bytes
+        ):
+            (language, device), _ = self._models.popitem(last=False)
+            print(f"Evicting alignment model for language '{language}' on device '{device}'")
+            evicted = True
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
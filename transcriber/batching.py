@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import whisperx
+from whisperx.audio import SAMPLE_RATE
+
+from config import PCM_SIDECAR_EXTENSION
+
+# whisperx merges VAD segments into windows of up to this many seconds
+VAD_CHUNK_SECONDS = 30
+
+
+def transcribe_batch(model, audios, batch_size, language=None):
+    """
+    Transcribe several decoded audio arrays with one model.transcribe call so
+    short clips fill the batch together.
+
+    The arrays are joined with more than VAD_CHUNK_SECONDS of silence between
+    them, which keeps any VAD window from spanning two files. The resulting
+    segments are split back per file and shifted to file-local timestamps.
+    All files are assumed to share a language; if language is None it is
+    detected from the first file.
+
+    Returns one {"segments": [...], "language": ...} dict per input array.
+    """
+    gap = np.zeros(SAMPLE_RATE * (VAD_CHUNK_SECONDS + 1), dtype=np.float32)
+    pieces = []
+    offsets = []
+    position = 0
+    for audio in audios:
+        if pieces:
+            pieces.append(gap)
+            position += len(gap)
+        offsets.append(position / SAMPLE_RATE)
+        pieces.append(audio.astype(np.float32, copy=False))
+        position += len(audio)
+
+    result = model.transcribe(
+        np.concatenate(pieces),
+        batch_size=batch_size,
+        language=language,
+        chunk_size=VAD_CHUNK_SECONDS,
+    )
+
+    results = [{"segments": [], "language": result["language"]} for _ in audios]
+    for segment in result["segments"]:
+        index = int(np.searchsorted(offsets, segment["start"], side="right")) - 1
+        index = max(index, 0)
+        offset = offsets[index]
+        segment = dict(segment)
+        segment["start"] -= offset
+        segment["end"] -= offset
+        results[index]["segments"].append(segment)
+    return results
+
+
+def load_pcm(path):
+    """
+    Memory-map a PCM sidecar (utils/pcm.py). It already is what
+    whisperx.load_audio would return, so nothing is decoded. The map is
+    still read in full: transcribe_batch copies it into the batch array,
+    and whisperx computes features over the whole file.
+    """
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(path, dtype="<f4", mode="r")
+
+
+def load_audios(paths):
+    """
+    Decode audio files to 16 kHz mono float arrays; PCM sidecars are
+    memory-mapped instead.
+    """
+    return [
+        load_pcm(path) if path.endswith(PCM_SIDECAR_EXTENSION) else whisperx.load_audio(path)
+        for path in paths
+    ]
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from config import CHECKPOINT_DIR, CHECKPOINT_S3_BUCKET, CHECKPOINT_S3_PREFIX
+from utils.storage import get_s3_client, put_object
+
+
+def _checkpoint_name(job):
+    return hashlib.sha256(job.encode("utf-8")).hexdigest()[:32] + ".jsonl"
+
+
+def _to_json(value):
+    # Timestamps and scores from whisperx can be numpy scalars
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class SpanCheckpoint:
+    """
+    Append-only record of the transcribed spans of one file, so a run that
+    is killed part way (OOM, spot preemption) resumes after the last
+    finished span instead of from zero.
+
+    One JSON line per span, "{start, end, result}" with sample offsets,
+    after a header line naming the job and the audio length. Each line is
+    fsynced when written. With CHECKPOINT_S3_BUCKET set, the file is also
+    copied to S3 after every span, and a node that has lost its local disk
+    picks it up from there.
+    """
+
+    def __init__(self, job, num_samples, directory=CHECKPOINT_DIR, s3_bucket=CHECKPOINT_S3_BUCKET):
+        name = _checkpoint_name(job)
+        self.job = job
+        self.num_samples = num_samples
+        self.path = os.path.join(directory, name)
+        self.s3_bucket = s3_bucket
+        self.s3_key = CHECKPOINT_S3_PREFIX + name
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _header(self):
+        return {"job": self.job, "samples": self.num_samples}
+
+    def _fetch_from_s3(self):
+        try:
+            response = get_s3_client().get_object(Bucket=self.s3_bucket, Key=self.s3_key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return
+            raise
+        with open(self.path, "wb") as f:
+            f.write(response["Body"].read())
+
+    def load(self):
+        """
+        Spans finished by an earlier run, as {(start, end): result}. A
+        checkpoint for other audio (same key, new content) is discarded.
+        """
+        if not os.path.exists(self.path) and self.s3_bucket:
+            self._fetch_from_s3()
+        if not os.path.exists(self.path):
+            return {}
+
+        spans = {}
+        with open(self.path, "rb") as f:
+            lines = f.read().split(b"\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = None
+        if len(lines) < 2 or header != self._header():
+            self.discard()
+            return {}
+        # Bytes up to the end of the last complete line
+        good_size = len(lines[0]) + 1
+        try:
+            # The text after the last newline is empty, or a cut-off line
+            for line in lines[1:-1]:
+                entry = json.loads(line)
+                spans[(entry["start"], entry["end"])] = entry["result"]
+                good_size += len(line) + 1
+        except ValueError:
+            # A line was cut off mid-write; everything before it is good
+            pass
+        if good_size < os.path.getsize(self.path):
+            # Drop the torn tail so add() starts on a fresh line
+            with open(self.path, "r+b") as f:
+                f.truncate(good_size)
+        if spans:
+            print(f"Resuming {self.job} from checkpoint: {len(spans)} span(s) already done")
+        return spans
+
+    def add(self, start, end, result):
+        """Record one finished span."""
+        new_file = not os.path.exists(self.path)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write(json.dumps(self._header()) + "\n")
+            f.write(json.dumps({"start": start, "end": end, "result": result}, default=_to_json))
+            f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self.s3_bucket:
+            with open(self.path, "rb") as f:
+                put_object(self.s3_bucket, self.s3_key, f.read())
+
+    def discard(self):
+        """Remove the checkpoint once the transcripts are safely stored."""
+        discard_checkpoint(self.job, os.path.dirname(self.path), self.s3_bucket)
+
+
+def discard_checkpoint(job, directory=CHECKPOINT_DIR, s3_bucket=CHECKPOINT_S3_BUCKET):
+    name = _checkpoint_name(job)
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        os.remove(path)
+    if s3_bucket:
+        get_s3_client().delete_object(Bucket=s3_bucket, Key=CHECKPOINT_S3_PREFIX + name)
+
+
+def run_spans(spans, transcribe_span, checkpoint=None):
+    """
+    transcribe_span(start, end) for every span, in order, skipping spans the
+    checkpoint already has and recording each new one as soon as it is done.
+    Returns the results in span order.
+    """
+    done = checkpoint.load() if checkpoint is not None else {}
+    results = []
+    for start, end in spans:
+        result = done.get((start, end))
+        if result is None:
+            result = transcribe_span(start, end)
+            if checkpoint is not None:
+                checkpoint.add(start, end, result)
+        results.append(result)
+    return results
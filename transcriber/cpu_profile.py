@@ -0,0 +1,187 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+import whisperx
+from whisperx.audio import SAMPLE_RATE
+
+from config import (
+    CPU_BATCH_SIZE,
+    CPU_COMPUTE_TYPE,
+    CPU_PROFILE_PATH,
+    CPU_THREADS,
+    CPU_VAD_OFFSET,
+    CPU_VAD_ONSET,
+    PARALLEL_THREADS_PER_WORKER,
+    PARALLEL_TRANSCRIBE_WORKERS,
+    TRANSCRIBE_LANGUAGE,
+)
+from transcriber.search_index import normalize_term
+
+# Reference settings for tuning: full precision, whisperx defaults
+REFERENCE_COMPUTE_TYPE = "float32"
+REFERENCE_BATCH_SIZE = 8
+
+# Per tuning process, set by _init_tune_worker
+_tune_model = None
+_tune_batch_size = None
+
+
+def default_cpu_profile(model_name):
+    """The CPU settings from config.py, used until a tuned profile is saved."""
+    return {
+        "model": model_name,
+        "compute_type": CPU_COMPUTE_TYPE,
+        "threads": CPU_THREADS,
+        "workers": PARALLEL_TRANSCRIBE_WORKERS,
+        "threads_per_worker": PARALLEL_THREADS_PER_WORKER,
+        "batch_size": CPU_BATCH_SIZE,
+        "vad_onset": CPU_VAD_ONSET,
+        "vad_offset": CPU_VAD_OFFSET,
+    }
+
+
+def load_cpu_profile(model_name, path=CPU_PROFILE_PATH):
+    """
+    The profile saved by tune_cpu_profile.py for model_name on a machine
+    with this many cores, or the defaults. A profile tuned for another
+    model or core count is ignored.
+    """
+    profile = default_cpu_profile(model_name)
+    if not os.path.exists(path):
+        return profile
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)
+    if saved.get("model") != model_name or saved.get("cpu_count") != os.cpu_count():
+        print(f"Ignoring CPU profile {path}: tuned for another model or machine")
+        return profile
+    profile.update({key: saved[key] for key in profile if key in saved})
+    return profile
+
+
+def save_cpu_profile(profile, path=CPU_PROFILE_PATH):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_cpu_model(profile, threads=None):
+    """
+    whisperx model for CPU inference with the profile's compute type and
+    VAD options, running on threads (default: the profile's, or every core)
+    intra-op threads.
+    """
+    threads = threads or profile["threads"] or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    return whisperx.load_model(
+        profile["model"],
+        device="cpu",
+        compute_type=profile["compute_type"],
+        threads=threads,
+        vad_options={"vad_onset": profile["vad_onset"], "vad_offset": profile["vad_offset"]},
+    )
+
+
+def word_error_rate(reference, hypothesis):
+    """
+    Word-level edit distance between two transcripts divided by the
+    reference length, after normalize_term (case and punctuation ignored).
+    """
+    ref = [t for t in (normalize_term(w) for w in reference.split()) if t]
+    hyp = [t for t in (normalize_term(w) for w in hypothesis.split()) if t]
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    # One row of the Levenshtein table at a time
+    previous = list(range(len(hyp) + 1))
+    for i, word in enumerate(ref, start=1):
+        current = [i]
+        for j, other in enumerate(hyp, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (word != other),
+            ))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def _init_tune_worker(profile, threads):
+    global _tune_model, _tune_batch_size
+
+    _tune_model = load_cpu_model(profile, threads)
+    _tune_batch_size = profile["batch_size"]
+
+
+def _tune_transcribe(audio):
+    result = _tune_model.transcribe(
+        audio, batch_size=_tune_batch_size, language=TRANSCRIBE_LANGUAGE
+    )
+    return " ".join(segment["text"].strip() for segment in result["segments"])
+
+
+def measure_profile(profile, audio):
+    """
+    Run the clip through `workers` processes at once, as the parallel
+    transcriber would, after one warm-up pass. Returns (transcript of the
+    first worker, audio seconds transcribed per wall-clock second).
+    """
+    workers = max(profile["workers"], 1)
+    threads = profile["threads_per_worker"] or max((os.cpu_count() or 1) // workers, 1)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        # spawn: torch's thread pools do not survive a fork
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_tune_worker,
+        initargs=(profile, threads),
+    ) as executor:
+        # Model loading and first-call setup are not part of the timing
+        warm_up = audio[: len(audio) // 4]
+        for future in [executor.submit(_tune_transcribe, warm_up) for _ in range(workers)]:
+            future.result()
+        started = time.monotonic()
+        futures = [executor.submit(_tune_transcribe, audio) for _ in range(workers)]
+        texts = [future.result() for future in futures]
+        elapsed = time.monotonic() - started
+    audio_seconds = workers * len(audio) / SAMPLE_RATE
+    return texts[0], audio_seconds / elapsed
+
+
+def tune(model_name, audio, candidates, wer_tolerance, log=print):
+    """
+    Time every candidate profile on the decoded clip and return the fastest
+    one whose transcript is within wer_tolerance of a float32 reference
+    run, with its measured "speed" (x real time) and "wer" added. Returns
+    None if no candidate is within the tolerance.
+    """
+    reference_profile = dict(
+        default_cpu_profile(model_name),
+        compute_type=REFERENCE_COMPUTE_TYPE,
+        batch_size=REFERENCE_BATCH_SIZE,
+        workers=1,
+        threads_per_worker=None,
+    )
+    log("Reference run (float32) ...")
+    reference, reference_speed = measure_profile(reference_profile, audio)
+    log(f"  {reference_speed:.2f}x real time")
+
+    best = None
+    for candidate in candidates:
+        profile = dict(default_cpu_profile(model_name), **candidate)
+        try:
+            text, speed = measure_profile(profile, audio)
+        except Exception as e:
+            log(f"  {candidate}: failed ({e})")
+            continue
+        wer = word_error_rate(reference, text)
+        within = wer <= wer_tolerance
+        log(f"  {candidate}: {speed:.2f}x real time, WER {wer:.3f}{'' if within else ' (over tolerance)'}")
+        if within and (best is None or speed > best["speed"]):
+            best = dict(profile, speed=round(speed, 3), wer=round(wer, 4))
+    return best
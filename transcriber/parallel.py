@@ -0,0 +1,217 @@
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+import whisperx
+from whisperx.audio import SAMPLE_RATE
+
+from config import (
+    PARALLEL_COMPUTE_TYPE,
+    PARALLEL_SEGMENT_SECONDS,
+    PARALLEL_SPLIT_SEARCH_SECONDS,
+    PARALLEL_THREADS_PER_WORKER,
+    PARALLEL_TRANSCRIBE_WORKERS,
+    TRANSCRIBE_BATCH_SIZE,
+    TRANSCRIBE_LANGUAGE,
+)
+from transcriber.align_cache import AlignModelCache
+from transcriber.batching import load_pcm
+
+# Energy is measured over windows of this many seconds when looking for a cut
+ENERGY_WINDOW_SECONDS = 0.1
+
+# Per worker process, set by _init_worker
+_worker_model = None
+_worker_align_cache = None
+_worker_batch_size = TRANSCRIBE_BATCH_SIZE
+
+
+def find_split_points(
+    audio,
+    segment_seconds=PARALLEL_SEGMENT_SECONDS,
+    search_seconds=PARALLEL_SPLIT_SEARCH_SECONDS,
+    sample_rate=SAMPLE_RATE,
+):
+    """
+    Split audio into spans of roughly segment_seconds, cutting at the
+    quietest ENERGY_WINDOW_SECONDS window within search_seconds of each
+    target point, so the cuts fall in pauses rather than inside words.
+    Returns [(start_sample, end_sample), ...] covering the whole array.
+    """
+    window = max(int(ENERGY_WINDOW_SECONDS * sample_rate), 1)
+    segment = int(segment_seconds * sample_rate)
+    search = int(search_seconds * sample_rate)
+
+    spans = []
+    start = 0
+    while len(audio) - start > segment + search:
+        target = start + segment
+        lo = max(target - search, start + window)
+        hi = min(target + search, len(audio) - window)
+        # Mean square per window; read in one pass from the (possibly
+        # memory-mapped) array
+        region = np.asarray(audio[lo:hi], dtype=np.float32)
+        usable = len(region) // window * window
+        energy = np.square(region[:usable]).reshape(-1, window).mean(axis=1)
+        cut = lo + int(np.argmin(energy)) * window + window // 2
+        spans.append((start, cut))
+        start = cut
+    spans.append((start, len(audio)))
+    return spans
+
+
+def _init_worker(model_name, device, compute_type, threads, batch_size, vad_options):
+    """Pool initializer: every worker loads its own model once."""
+    global _worker_model, _worker_align_cache, _worker_batch_size
+
+    torch.set_num_threads(threads)
+    _worker_model = whisperx.load_model(
+        model_name,
+        device=device,
+        compute_type=compute_type,
+        threads=threads,
+        vad_options=vad_options,
+    )
+    _worker_align_cache = AlignModelCache()
+    _worker_batch_size = batch_size
+
+
+def _transcribe_span(pcm_path, start, end, language, device):
+    """
+    Transcribe and align audio[start:end] of a raw PCM file in a worker.
+    Timestamps in the result are relative to start.
+    """
+    audio = np.array(load_pcm(pcm_path)[start:end])
+    result = _worker_model.transcribe(
+        audio, batch_size=_worker_batch_size, language=language
+    )
+    if not result["segments"]:
+        return {"segments": [], "word_segments": [], "language": result["language"]}
+    model_a, metadata = _worker_align_cache.get(result["language"], device)
+    aligned = whisperx.align(
+        result["segments"],
+        model_a,
+        metadata,
+        audio,
+        device=device,
+        return_char_alignments=False
+    )
+    aligned["language"] = result["language"]
+    return aligned
+
+
+def _shift(item, offset):
+    """Copy of a segment or word dict with its start/end moved by offset."""
+    item = dict(item)
+    for field in ("start", "end"):
+        # Unaligned words have no timestamps; merge_missing_timestamps fills them
+        if item.get(field) is not None:
+            item[field] = round(item[field] + offset, 3)
+    return item
+
+
+def merge_span_results(results, offsets):
+    """
+    Join per-span aligned results into one, moving every segment and word
+    by its span's offset in seconds. The result has the same shape as
+    whisperx.align output, so write_transcripts and its helpers take it
+    unchanged.
+    """
+    segments = []
+    word_segments = []
+    for result, offset in zip(results, offsets):
+        for segment in result["segments"]:
+            shifted = _shift(segment, offset)
+            if "words" in segment:
+                shifted["words"] = [_shift(word, offset) for word in segment["words"]]
+            segments.append(shifted)
+        word_segments.extend(_shift(word, offset) for word in result.get("word_segments", []))
+
+    languages = Counter(result["language"] for result in results if result.get("language"))
+    merged = {"segments": segments, "word_segments": word_segments}
+    if languages:
+        merged["language"] = languages.most_common(1)[0][0]
+    return merged
+
+
+class ParallelTranscriber:
+    """
+    CPU transcription of long files across a process pool. A file is split
+    at quiet points into spans of about PARALLEL_SEGMENT_SECONDS; each worker
+    holds its own whisperx and alignment models and handles whole spans.
+    Workers read their span from a raw PCM file on local disk (the PCM
+    sidecar, or a decoded copy), so the audio is never pickled.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        workers=PARALLEL_TRANSCRIBE_WORKERS,
+        compute_type=PARALLEL_COMPUTE_TYPE,
+        threads_per_worker=PARALLEL_THREADS_PER_WORKER,
+        device="cpu",
+        batch_size=TRANSCRIBE_BATCH_SIZE,
+        vad_options=None,
+    ):
+        self.workers = workers
+        self.device = device
+        threads = threads_per_worker or max((os.cpu_count() or 1) // workers, 1)
+        print(
+            f"Starting {workers} transcription workers ('{model_name}', "
+            f"{compute_type}, {threads} threads each) ..."
+        )
+        # spawn: torch's thread pools do not survive a fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, device, compute_type, threads, batch_size, vad_options),
+        )
+
+    def transcribe(self, audio_path, audio, checkpoint=None):
+        """
+        Transcribe and align one decoded file (audio as returned by
+        load_audios for audio_path). Returns one whisperx.align-shaped dict.
+        With a SpanCheckpoint, spans finished by an earlier run are reused
+        and each new span is recorded as soon as its worker returns it.
+        """
+        spans = find_split_points(audio)
+        done = checkpoint.load() if checkpoint is not None else {}
+        missing = [span for span in spans if span not in done]
+        if not missing:
+            return merge_span_results(
+                [done[span] for span in spans], [start / SAMPLE_RATE for start, _ in spans]
+            )
+        pcm_path = audio_path
+        if not isinstance(audio, np.memmap):
+            # Decoded in memory: give the workers a file to map instead
+            pcm_path = f"{audio_path}.spans.f32le"
+            audio.astype("<f4", copy=False).tofile(pcm_path)
+        try:
+            print(
+                f"Transcribing {audio_path} as {len(missing)} of {len(spans)} spans "
+                f"on {self.workers} workers ..."
+            )
+            futures = {
+                self._executor.submit(
+                    _transcribe_span, pcm_path, start, end, TRANSCRIBE_LANGUAGE, self.device
+                ): (start, end)
+                for start, end in missing
+            }
+            for future in as_completed(futures):
+                span = futures[future]
+                done[span] = future.result()
+                if checkpoint is not None:
+                    checkpoint.add(span[0], span[1], done[span])
+        finally:
+            if pcm_path != audio_path:
+                os.remove(pcm_path)
+        return merge_span_results(
+            [done[span] for span in spans], [start / SAMPLE_RATE for start, _ in spans]
+        )
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,162 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    PREFETCH_DEPTH,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_WORKERS,
+    UPLOAD_MAX_PENDING,
+    UPLOAD_WORKERS,
+)
+
+
+class AudioPrefetcher:
+    """
+    Iterates over work items while downloading the next ones in background
+    threads.
+
+    fetch(item) downloads one item and returns its local path; size_of(item)
+    gives its size in bytes, and is called once per item, so it may ask S3.
+    Items must be hashable. At most depth items are fetched ahead, and the
+    bytes of fetched-but-not-released items stay under max_bytes. Call
+    release(item) once its local file is deleted.
+
+    When nothing is queued ahead, the next item is fetched even over
+    max_bytes: the items the caller still holds (a batch being collected,
+    or one item larger than max_bytes) are only released after it gets
+    more, so waiting for room would stall it for good.
+
+    Yields (item, local_path, error) in input order; error is the exception
+    raised by fetch, in which case local_path is None.
+    """
+
+    def __init__(
+        self,
+        items,
+        fetch,
+        size_of,
+        depth=PREFETCH_DEPTH,
+        max_bytes=PREFETCH_MAX_BYTES,
+        workers=PREFETCH_WORKERS,
+    ):
+        self._items = iter(items)
+        self._fetch = fetch
+        self._size_of = size_of
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.workers = workers
+
+        self._pending = deque()
+        self._next_item = None
+        self._next_size = None
+        # Size of every item fetched and not yet released
+        self._sizes = {}
+        self._exhausted = False
+        self._bytes_on_disk = 0
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_on_disk(self):
+        return self._bytes_on_disk
+
+    @property
+    def queued(self):
+        """Items fetched or being fetched, not yet handed to the caller."""
+        return len(self._pending)
+
+    def release(self, item):
+        """The local file of item is gone; its bytes no longer count."""
+        with self._lock:
+            self._bytes_on_disk -= self._sizes.pop(item)
+
+    def __iter__(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self._fill(executor)
+            while self._pending:
+                item, future = self._pending.popleft()
+                try:
+                    local_path, error = future.result(), None
+                except Exception as e:
+                    local_path, error = None, e
+                    self.release(item)
+                # Start the next downloads before handing this item over
+                self._fill(executor)
+                yield item, local_path, error
+                self._fill(executor)
+
+    def _fill(self, executor):
+        while not self._exhausted and len(self._pending) < self.depth:
+            if self._next_item is None:
+                self._next_item = next(self._items, None)
+                if self._next_item is None:
+                    self._exhausted = True
+                    return
+            if self._next_size is None:
+                self._next_size = self._size_of(self._next_item)
+            with self._lock:
+                if self._pending and self._bytes_on_disk + self._next_size > self.max_bytes:
+                    return
+                self._bytes_on_disk += self._next_size
+                self._sizes[self._next_item] = self._next_size
+            item, self._next_item, self._next_size = self._next_item, None, None
+            self._pending.append((item, executor.submit(self._fetch, item)))
+
+
+class BackgroundUploader:
+    """
+    Runs upload jobs in a thread pool so the caller never waits on the
+    network. At most max_pending jobs are queued; submit() blocks beyond
+    that, which caps the memory held by artifacts waiting to upload.
+
+    Each job reports through on_success() or on_failure(error) callbacks,
+    called from the upload thread. wait() blocks until every job finished
+    and returns the number of failed jobs.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, max_pending=UPLOAD_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._failures = 0
+        # First exception raised by a callback, re-raised by wait()
+        self._error = None
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Upload jobs queued or running."""
+        return self._pending
+
+    def submit(self, upload, on_success=None, on_failure=None):
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, upload, on_success, on_failure)
+
+    def _run(self, upload, on_success, on_failure):
+        try:
+            try:
+                upload()
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                if on_failure is not None:
+                    on_failure(e)
+            else:
+                if on_success is not None:
+                    on_success()
+        except Exception as e:
+            with self._lock:
+                self._error = self._error or e
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+
+    def wait(self):
+        # Returns once every submitted job has run
+        self._executor.shutdown()
+        if self._error is not None:
+            raise self._error
+        return self._failures
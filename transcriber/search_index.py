@@ -0,0 +1,379 @@
+import json
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+from config import (
+    SEARCH_INDEX_DIR,
+    SEARCH_INDEX_MAX_SEGMENTS,
+    SEARCH_INDEX_MERGE_FACTOR,
+    SEARCH_INDEX_SEGMENT_WORDS,
+)
+
+MANIFEST_NAME = "index.json"
+
+_WORD_CHARS = re.compile(r"\w+")
+
+
+def normalize_term(word):
+    """
+    Index term of one transcript word: lower case, punctuation dropped, so
+    "Fourier," and "fourier" match and "don't" is "dont". May be empty.
+    """
+    return "".join(_WORD_CHARS.findall(word.lower()))
+
+
+def query_terms(query):
+    """Terms of a query string, in order."""
+    return [term for term in (normalize_term(w) for w in query.split()) if term]
+
+
+def _write_segment(path, terms, doc_ids, positions, starts, docs):
+    """
+    Write one immutable segment from per-posting arrays (terms is a numpy
+    unicode array). Postings are stored grouped by term, and by (doc,
+    position) within a term; the term dictionary is sorted so lookups are
+    a binary search over it.
+    """
+    os.makedirs(path)
+    unique_terms, term_ids = np.unique(terms, return_inverse=True)
+    order = np.lexsort((positions, doc_ids, term_ids))
+    postings_offsets = np.searchsorted(
+        term_ids[order], np.arange(len(unique_terms) + 1), side="left"
+    ).astype(np.int64)
+
+    encoded = [term.encode("utf-8") for term in unique_terms.tolist()]
+    term_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=term_offsets[1:])
+
+    # Code point order of np.unique is also the byte order of UTF-8
+    np.frombuffer(b"".join(encoded), dtype=np.uint8).tofile(os.path.join(path, "terms.bin"))
+    np.save(os.path.join(path, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(path, "postings_offsets.npy"), postings_offsets)
+    np.save(os.path.join(path, "doc_ids.npy"), doc_ids[order].astype(np.int32))
+    np.save(os.path.join(path, "positions.npy"), positions[order].astype(np.int32))
+    np.save(os.path.join(path, "starts.npy"), starts[order].astype(np.float32))
+    with open(os.path.join(path, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f)
+
+
+class Segment:
+    """
+    Read-only view of one segment directory. All arrays are memory-mapped,
+    so opening a segment costs the same however large it is, and a lookup
+    touches only the pages of the terms it reads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        terms_path = os.path.join(path, "terms.bin")
+        # An empty file cannot be mapped
+        self.terms = np.zeros(0, dtype=np.uint8)
+        if os.path.getsize(terms_path):
+            self.terms = np.memmap(terms_path, dtype=np.uint8, mode="r")
+        self.term_offsets = np.load(os.path.join(path, "term_offsets.npy"), mmap_mode="r")
+        self.postings_offsets = np.load(os.path.join(path, "postings_offsets.npy"), mmap_mode="r")
+        self.doc_ids = np.load(os.path.join(path, "doc_ids.npy"), mmap_mode="r")
+        self.positions = np.load(os.path.join(path, "positions.npy"), mmap_mode="r")
+        self.starts = np.load(os.path.join(path, "starts.npy"), mmap_mode="r")
+        with open(os.path.join(path, "docs.json"), encoding="utf-8") as f:
+            self.docs = json.load(f)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def term(self, i):
+        return bytes(self.terms[self.term_offsets[i]:self.term_offsets[i + 1]])
+
+    def find(self, term):
+        """Index of term in the dictionary, or -1."""
+        target = term.encode("utf-8")
+        lo, hi = 0, len(self.term_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.term_offsets) - 1 and self.term(lo) == target:
+            return lo
+        return -1
+
+    def postings(self, term):
+        """(doc_ids, positions, starts) of one term, empty if it is absent."""
+        i = self.find(term)
+        if i < 0:
+            return (np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros(0, np.float32))
+        lo, hi = int(self.postings_offsets[i]), int(self.postings_offsets[i + 1])
+        return (self.doc_ids[lo:hi], self.positions[lo:hi], self.starts[lo:hi])
+
+    def all_postings(self):
+        """Every posting as (terms, doc_ids, positions, starts), for merging."""
+        counts = np.diff(np.asarray(self.postings_offsets))
+        words = [
+            self.term(i).decode("utf-8") for i in range(len(self.term_offsets) - 1)
+        ]
+        terms = np.repeat(np.array(words, dtype=str), counts) if words else np.zeros(0, dtype=str)
+        return terms, np.asarray(self.doc_ids), np.asarray(self.positions), np.asarray(self.starts)
+
+
+class SearchIndex:
+    """
+    Inverted index over transcript words: term -> (video, word offset,
+    start time). Used to find where in the lectures something was said
+    without downloading and scanning the transcripts.
+
+    Videos are added incrementally. Added videos are buffered and written
+    as a new immutable segment every SEARCH_INDEX_SEGMENT_WORDS words (or
+    on flush); when there are more than SEARCH_INDEX_MAX_SEGMENTS segments
+    the smallest SEARCH_INDEX_MERGE_FACTOR are merged into one, so their
+    number stays bounded. index.json lists the live segments and is
+    replaced atomically, so readers never see a half-written index.
+
+    A video added again (e.g. re-transcribed) replaces its earlier entry;
+    the old postings are skipped by queries and dropped by the next merge.
+    """
+
+    def __init__(self, directory=SEARCH_INDEX_DIR):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_words = 0
+        self._segments = {}
+        self._load_manifest()
+
+    # ------------------------------------------------------------------
+    # Manifest
+    # ------------------------------------------------------------------
+    def _load_manifest(self):
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"next_segment": 0, "segments": [], "docs": {}, "deleted": {}}
+        self.next_segment = manifest["next_segment"]
+        # video -> [segment name, doc id in that segment]
+        self.docs = manifest["docs"]
+        # segment name -> doc ids that were replaced by a later add
+        self.deleted = {name: set(ids) for name, ids in manifest["deleted"].items()}
+        live = set(manifest["segments"])
+        for name in list(self._segments):
+            if name not in live:
+                del self._segments[name]
+        for name in manifest["segments"]:
+            if name not in self._segments:
+                self._segments[name] = Segment(os.path.join(self.directory, name))
+
+    def _save_manifest(self):
+        manifest = {
+            "next_segment": self.next_segment,
+            "segments": sorted(self._segments),
+            "docs": self.docs,
+            "deleted": {name: sorted(ids) for name, ids in self.deleted.items() if ids},
+        }
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def reload(self):
+        """Pick up segments written by another process since opening."""
+        with self._lock:
+            self._load_manifest()
+
+    def _new_segment_path(self):
+        name = f"seg-{self.next_segment:06d}"
+        self.next_segment += 1
+        return os.path.join(self.directory, name)
+
+    def __contains__(self, video):
+        return video in self.docs or video in self._pending
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def add(self, video, word_store):
+        """
+        Index the words of one video (a WordStore). video is the name
+        queries return; the transcript base key is a good choice. Returns
+        True if this wrote the buffered videos to disk.
+        """
+        with self._lock:
+            previous = self._pending.pop(video, None)
+            if previous is not None:
+                self._pending_words -= len(previous)
+            self._pending[video] = word_store
+            self._pending_words += len(word_store)
+            if self._pending_words >= SEARCH_INDEX_SEGMENT_WORDS:
+                self._flush()
+                return True
+            return False
+
+    def flush(self):
+        """Write the buffered videos as a segment, merging if there are too many."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        terms, doc_ids, positions, starts, docs = [], [], [], [], []
+        for doc, (video, word_store) in enumerate(self._pending.items()):
+            words = [normalize_term(word) for word in word_store.words()]
+            keep = np.array([bool(word) for word in words], dtype=bool)
+            terms.append(np.array(words, dtype=str)[keep] if words else np.zeros(0, dtype=str))
+            positions.append(np.flatnonzero(keep))
+            starts.append(word_store.starts[keep])
+            doc_ids.append(np.full(int(keep.sum()), doc, dtype=np.int64))
+            docs.append({"video": video, "words": len(word_store)})
+
+        path = self._new_segment_path()
+        _write_segment(
+            path,
+            np.concatenate(terms),
+            np.concatenate(doc_ids),
+            np.concatenate(positions),
+            np.concatenate(starts),
+            docs,
+        )
+        name = os.path.basename(path)
+        self._segments[name] = Segment(path)
+        for doc, entry in enumerate(docs):
+            self._forget(entry["video"])
+            self.docs[entry["video"]] = [name, doc]
+        self._pending = {}
+        self._pending_words = 0
+        self._save_manifest()
+        print(f"Search index: wrote {name} with {len(docs)} video(s)")
+
+        if len(self._segments) > SEARCH_INDEX_MAX_SEGMENTS:
+            by_size = sorted(self._segments, key=lambda n: len(self._segments[n]))
+            self._merge(by_size[:SEARCH_INDEX_MERGE_FACTOR])
+
+    def _forget(self, video):
+        """Mark the indexed copy of a video (if any) as replaced."""
+        if video in self.docs:
+            name, doc = self.docs.pop(video)
+            self.deleted.setdefault(name, set()).add(doc)
+
+    def merge(self, names=None):
+        """Merge the given segments (default: all of them) into one."""
+        with self._lock:
+            self._flush()
+            self._merge(sorted(self._segments) if names is None else names)
+
+    def _merge(self, names):
+        if len(names) < 2 and not any(self.deleted.get(name) for name in names):
+            return
+        terms, doc_ids, positions, starts, docs = [], [], [], [], []
+        # Old (segment, doc) -> doc id in the merged segment
+        remap = {}
+        for name in names:
+            segment = self._segments[name]
+            deleted = self.deleted.get(name, set())
+            seg_terms, seg_docs, seg_positions, seg_starts = segment.all_postings()
+            new_ids = np.full(len(segment.docs), -1, dtype=np.int64)
+            for doc, entry in enumerate(segment.docs):
+                if doc not in deleted:
+                    new_ids[doc] = len(docs)
+                    remap[(name, doc)] = len(docs)
+                    docs.append(entry)
+            keep = new_ids[seg_docs] >= 0 if len(seg_docs) else np.zeros(0, dtype=bool)
+            terms.append(seg_terms[keep])
+            doc_ids.append(new_ids[seg_docs[keep]])
+            positions.append(seg_positions[keep])
+            starts.append(seg_starts[keep])
+
+        path = self._new_segment_path()
+        merged_name = os.path.basename(path)
+        _write_segment(
+            path,
+            np.concatenate(terms),
+            np.concatenate(doc_ids),
+            np.concatenate(positions),
+            np.concatenate(starts),
+            docs,
+        )
+        self._segments[merged_name] = Segment(path)
+        for video, (name, doc) in list(self.docs.items()):
+            if (name, doc) in remap:
+                self.docs[video] = [merged_name, remap[(name, doc)]]
+        for name in names:
+            del self._segments[name]
+            self.deleted.pop(name, None)
+        # Readers that still map the old segments keep working until they reload
+        self._save_manifest()
+        for name in names:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        print(f"Search index: merged {len(names)} segments into {merged_name}")
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def _matches(self, segment, terms):
+        """
+        (doc_ids, positions, starts) of the first word of every occurrence
+        of the phrase terms in one segment.
+        """
+        doc_ids, positions, starts = (np.asarray(a) for a in segment.postings(terms[0]))
+        keys = doc_ids.astype(np.int64) << 32 | positions.astype(np.int64)
+        for offset, term in enumerate(terms[1:], start=1):
+            if not len(keys):
+                break
+            next_docs, next_positions, _ = segment.postings(term)
+            next_keys = (
+                np.asarray(next_docs).astype(np.int64) << 32
+                | np.asarray(next_positions).astype(np.int64) - offset
+            )
+            keep = np.isin(keys, next_keys)
+            keys, doc_ids, positions, starts = keys[keep], doc_ids[keep], positions[keep], starts[keep]
+        return doc_ids, positions, starts
+
+    def search(self, query, chunk_size=30, limit=20):
+        """
+        Chunk windows where query (a word or a phrase) was said, best first:
+        [{"video", "chunk", "start", "end", "hits", "times"}, ...]. chunk is
+        the index into the video's "<N>sec_timestamps" file for chunk_size,
+        start/end its window in seconds, and times the start of each hit.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        windows = {}
+        with self._lock:
+            segments = list(self._segments.values())
+            deleted = {name: set(ids) for name, ids in self.deleted.items()}
+        for segment in segments:
+            doc_ids, _, starts = self._matches(segment, terms)
+            gone = deleted.get(segment.name, ())
+            chunks = np.floor_divide(starts, chunk_size).astype(np.int64)
+            for doc, chunk, start in zip(doc_ids.tolist(), chunks.tolist(), starts.tolist()):
+                if doc in gone:
+                    continue
+                video = segment.docs[doc]["video"]
+                window = windows.setdefault((video, chunk), [])
+                window.append(round(start, 2))
+
+        ranked = sorted(windows.items(), key=lambda item: (-len(item[1]), item[0]))
+        return [
+            {
+                "video": video,
+                "chunk": chunk,
+                "start": chunk * chunk_size,
+                "end": (chunk + 1) * chunk_size,
+                "hits": len(times),
+                "times": sorted(times),
+            }
+            for (video, chunk), times in ranked[:limit]
+        ]
+
+    def close(self):
+        self.flush()
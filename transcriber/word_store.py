@@ -0,0 +1,126 @@
+import io
+
+import numpy as np
+
+
+class WordStore:
+    """
+    Word-level timestamps in columnar form: parallel float64 start/end
+    arrays and one packed UTF-8 text buffer, where the text of word i is
+    text[text_offsets[i]:text_offsets[i + 1]].
+
+    Saved as a .npz sidecar next to the transcripts, so chunk views of any
+    size can be rebuilt later without re-running transcription.
+    """
+
+    def __init__(self, starts, ends, text_offsets, text):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.text_offsets = np.asarray(text_offsets, dtype=np.int64)
+        self.text = bytes(text)
+
+    @classmethod
+    def from_segments(cls, word_segments):
+        """
+        Build a store from whisperx word segments that all have start and end
+        (i.e. after merge_missing_timestamps).
+        """
+        count = len(word_segments)
+        starts = np.empty(count, dtype=np.float64)
+        ends = np.empty(count, dtype=np.float64)
+        encoded = []
+        for i, seg in enumerate(word_segments):
+            starts[i] = seg["start"]
+            ends[i] = seg["end"]
+            text = seg.get("text") or seg.get("word") or "<NO_TEXT_FIELD>"
+            encoded.append(text.encode("utf-8"))
+        text_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=text_offsets[1:])
+        return cls(starts, ends, text_offsets, b"".join(encoded))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def word(self, i):
+        return self.text[self.text_offsets[i]:self.text_offsets[i + 1]].decode("utf-8")
+
+    def words(self):
+        offsets = self.text_offsets.tolist()
+        text = self.text
+        return [
+            text[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(self))
+        ]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path_or_file):
+        np.savez(
+            path_or_file,
+            starts=self.starts,
+            ends=self.ends,
+            text_offsets=self.text_offsets,
+            text=np.frombuffer(self.text, dtype=np.uint8),
+        )
+
+    @classmethod
+    def load(cls, path_or_file):
+        with np.load(path_or_file) as data:
+            return cls(
+                data["starts"], data["ends"], data["text_offsets"], data["text"].tobytes()
+            )
+
+    # ------------------------------------------------------------------
+    # Chunk views
+    # ------------------------------------------------------------------
+    def chunk_ids(self, chunk_size):
+        """
+        Chunk index of every word: floor(start / chunk_size), never moving
+        backwards, which matches chunk_word_segments for out-of-order words.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        ids = np.floor_divide(self.starts, chunk_size).astype(np.int64)
+        np.maximum(ids, 0, out=ids)
+        return np.maximum.accumulate(ids)
+
+    def chunk_bounds(self, chunk_size):
+        """
+        Return bounds with bounds[c]:bounds[c + 1] the word index range of
+        chunk c, for chunks 0 up to the last non-empty one.
+        """
+        ids = self.chunk_ids(chunk_size)
+        chunk_count = int(ids[-1]) + 1 if len(ids) else 1
+        return np.searchsorted(ids, np.arange(chunk_count + 1), side="left")
+
+    def word_lines(self):
+        """'start --> end: text' for every word, formatted once."""
+        return [
+            f"{start:.2f} --> {end:.2f}: {text}"
+            for start, end, text in zip(self.starts.tolist(), self.ends.tolist(), self.words())
+        ]
+
+    def write_chunks(self, f, chunk_size, word_lines=None):
+        """
+        Write chunk_word_segments(word_segments, chunk_size) to the text
+        stream f line by line. Pass word_lines from word_lines() to reuse
+        formatting across chunk sizes.
+        """
+        if word_lines is None:
+            word_lines = self.word_lines()
+        bounds = self.chunk_bounds(chunk_size).tolist()
+        for index in range(len(bounds) - 1):
+            if index:
+                f.write("\n\n")
+            f.write(
+                f"Chunk {index} ({index * chunk_size if index else 0} - {(index + 1) * chunk_size} seconds):"
+            )
+            for line in word_lines[bounds[index]:bounds[index + 1]]:
+                f.write("\n")
+                f.write(line)
+
+    def render_chunks(self, chunk_size, word_lines=None):
+        """Same text as chunk_word_segments(word_segments, chunk_size)."""
+        buffer = io.StringIO()
+        self.write_chunks(buffer, chunk_size, word_lines)
+        return buffer.getvalue()
@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from config import (
+    DEDUP_ENABLED,
+    TRANSCRIBE_MODEL,
+    TRANSCRIBE_QUEUE_POLL_SECONDS,
+    TRANSCRIBE_SERVICE_HEALTH_PATH,
+    TRANSCRIBE_SERVICE_HEALTH_SECONDS,
+    TRANSCRIBE_SERVICE_OUTPUT_DIR,
+    TRANSCRIPT_BUCKET,
+    TRANSCRIPT_PREFIX,
+    WORKER_MODE,
+)
+from utils.content_cache import CONTENT_ID_METADATA, content_id
+from utils.job_queue import STATUS_DONE, TranscriptionQueue
+from utils.leases import WorkCoordinator, job_id
+from utils.manifest import STAGE_TRANSCRIBED, JobManifest
+from utils.metrics import metrics
+from utils.storage import get_s3_client
+
+# Resident transcription worker: loads the model once and takes jobs from
+# the local queue in utils/job_queue.py. Usage, from the repository root:
+#
+#   python transcription_service.py serve
+#   python transcription_service.py submit s3://demodaran-all-audio/talk.m4a --wait
+#   python transcription_service.py submit /data/lecture.m4a
+#   python transcription_service.py status [JOB_ID]
+#   python transcription_service.py health
+#
+# main.py submits every extracted file when TRANSCRIBE_QUEUE_SUBMIT is set.
+# Only "serve" imports torch and whisperx, so the other commands are quick.
+
+# Downloaded audio waits here while it is transcribed
+LOCAL_AUDIO_DIR = "audio"
+
+
+class ServiceHealth:
+    """
+    Health and throughput of a running worker, rewritten to
+    TRANSCRIBE_SERVICE_HEALTH_PATH every TRANSCRIBE_SERVICE_HEALTH_SECONDS.
+    Also keeps the heartbeat of the job in progress alive in the queue.
+    """
+
+    def __init__(self, worker, model_name, device, job_queue):
+        self.worker = worker
+        self.model_name = model_name
+        self.device = device
+        self.job_queue = job_queue
+        self.started_at = time.time()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.busy_seconds = 0.0
+        self.current_job = None
+        self._job_started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def begin(self, job, source):
+        with self._lock:
+            self.current_job = {"id": job, "source": source}
+            self._job_started = time.monotonic()
+
+    def end(self, succeeded):
+        with self._lock:
+            self.busy_seconds += time.monotonic() - self._job_started
+            if succeeded:
+                self.jobs_done += 1
+            else:
+                self.jobs_failed += 1
+            self.current_job = None
+
+    def snapshot(self):
+        # Decoded audio is float32 at 16 kHz: 64000 bytes per second
+        stages = metrics.snapshot()["stages"]
+        audio_seconds = stages.get("decode", {}).get("bytes", 0) / 64000
+        with self._lock:
+            busy_seconds = self.busy_seconds
+            if self._job_started is not None and self.current_job is not None:
+                busy_seconds += time.monotonic() - self._job_started
+            return {
+                "worker": self.worker,
+                "pid": os.getpid(),
+                "model": self.model_name,
+                "device": self.device,
+                "started_at": self.started_at,
+                "updated_at": time.time(),
+                "state": "busy" if self.current_job else "idle",
+                "current_job": self.current_job,
+                "jobs_done": self.jobs_done,
+                "jobs_failed": self.jobs_failed,
+                "queue": self.job_queue.counts(),
+                "busy_seconds": round(busy_seconds, 1),
+                "audio_seconds": round(audio_seconds, 1),
+                "audio_seconds_per_busy_second": (
+                    round(audio_seconds / busy_seconds, 2) if busy_seconds else None
+                ),
+            }
+
+    def write(self):
+        snapshot = self.snapshot()
+        directory = os.path.dirname(TRANSCRIBE_SERVICE_HEALTH_PATH)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = f"{TRANSCRIBE_SERVICE_HEALTH_PATH}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, TRANSCRIBE_SERVICE_HEALTH_PATH)
+        if snapshot["current_job"] is not None:
+            self.job_queue.heartbeat(snapshot["current_job"]["id"], self.worker)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="service-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def _loop(self):
+        while not self._stop.wait(TRANSCRIBE_SERVICE_HEALTH_SECONDS):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"Could not write service health: {e}")
+
+
+def parse_source(source):
+    """(bucket, key) for "s3://bucket/key", (None, path) for a local file."""
+    if source.startswith("s3://"):
+        bucket, _, key = source[len("s3://"):].partition("/")
+        return bucket, key
+    return None, source
+
+
+def transcribe_s3_object(transcription, model, device, bucket, key, manifest, coordinator):
+    """
+    Transcribe one audio object into TRANSCRIPT_BUCKET the same way a batch
+    run would, recording it in the manifest. Returns the transcript URLs.
+    """
+    head = get_s3_client().head_object(Bucket=bucket, Key=key)
+    etag = head["ETag"]
+    size = head["ContentLength"]
+    cid = head.get("Metadata", {}).get(CONTENT_ID_METADATA) or content_id(etag, size)
+
+    base_name = os.path.splitext(os.path.basename(key))[0]
+    transcripts_subfolder = os.path.join(TRANSCRIPT_PREFIX, "transcripts")
+    transcript_key = os.path.join(transcripts_subfolder, f"{base_name}_transcript.txt")
+    locations = [
+        f"s3://{TRANSCRIPT_BUCKET}/{os.path.join(transcripts_subfolder, name)}"
+        for name in transcription.transcript_filenames(base_name)
+    ]
+
+    if manifest.is_done(bucket, key, etag, STAGE_TRANSCRIBED):
+        print(f"{key} is already transcribed.")
+        return locations
+
+    job = job_id(STAGE_TRANSCRIBED, bucket, key, etag)
+    if not coordinator.claim(job):
+        raise RuntimeError(f"{key} is being transcribed by another worker")
+    pending = (key, etag, job, transcript_key, size, cid)
+    try:
+        reused = DEDUP_ENABLED and transcription.reuse_transcripts(
+            manifest, cid, base_name, TRANSCRIPT_BUCKET, transcripts_subfolder
+        )
+        if not reused:
+            local_audio_path = transcription.download_audio(bucket, key, LOCAL_AUDIO_DIR, cid=cid)
+            try:
+                aligned = transcription.transcribe_and_align(
+                    model, [local_audio_path], device=device, job_ids=[job]
+                )[0]
+            finally:
+                transcription.remove_local_file(local_audio_path)
+            transcription.save_and_upload_transcripts(
+                aligned, base_name, TRANSCRIPT_BUCKET, TRANSCRIPT_PREFIX
+            )
+    except Exception as e:
+        manifest.mark_failed(bucket, key, etag, STAGE_TRANSCRIBED, str(e))
+        coordinator.release(job, False)
+        raise
+    transcription.record_transcribed(manifest, bucket, pending, TRANSCRIPT_BUCKET)
+    coordinator.release(job, True)
+    return locations
+
+
+def transcribe_local_file(transcription, model, device, path):
+    """Transcribe a local audio file into TRANSCRIBE_SERVICE_OUTPUT_DIR."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    aligned = transcription.transcribe_and_align(model, [path], device=device)[0]
+    os.makedirs(TRANSCRIBE_SERVICE_OUTPUT_DIR, exist_ok=True)
+    local_paths = transcription.write_transcripts(aligned, base_name, TRANSCRIBE_SERVICE_OUTPUT_DIR)
+    return [os.path.abspath(p) for p in local_paths]
+
+
+def serve():
+    """Load the model once, then run queued jobs until SIGTERM or Ctrl-C."""
+    # Only the worker pays for importing torch and whisperx
+    import whisperx_trnascript as transcription
+
+    model, device = transcription.load_transcription_model()
+    job_queue = TranscriptionQueue()
+    manifest = JobManifest()
+    # Submitted jobs are always run here; leases still keep a batch run on
+    # another node from transcribing the same file at the same time.
+    coordinator = WorkCoordinator(mode="lease" if WORKER_MODE == "lease" else "single")
+    coordinator.start()
+    worker = coordinator.worker_id
+    # A restart under the same WORKER_ID takes its interrupted job back at once
+    job_queue.requeue_worker(worker)
+
+    metrics.start("transcription_service")
+    health = ServiceHealth(worker, TRANSCRIBE_MODEL, device, job_queue)
+    health.start()
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    print(f"Worker {worker} ready; waiting for jobs ...")
+
+    try:
+        while not stop.is_set():
+            claimed = job_queue.claim_next(worker)
+            if claimed is None:
+                stop.wait(TRANSCRIBE_QUEUE_POLL_SECONDS)
+                continue
+            job, source = claimed
+            print(f"Job {job}: {source}")
+            health.begin(job, source)
+            try:
+                bucket, key = parse_source(source)
+                if bucket is None:
+                    result = transcribe_local_file(transcription, model, device, key)
+                else:
+                    result = transcribe_s3_object(
+                        transcription, model, device, bucket, key, manifest, coordinator
+                    )
+            except Exception as e:
+                print(f"Job {job} FAILED: {e}")
+                job_queue.fail(job, e)
+                health.end(False)
+                continue
+            job_queue.complete(job, result)
+            health.end(True)
+            print(f"Job {job} done")
+    finally:
+        health.stop()
+        if transcription.parallel_transcriber is not None:
+            transcription.parallel_transcriber.close()
+        coordinator.stop()
+        job_queue.close()
+        manifest.close()
+        metrics.stop()
+        metrics.log_summary(print)
+
+
+def print_health():
+    """Print the worker's health file; exit status 1 if it is missing or stale."""
+    try:
+        with open(TRANSCRIBE_SERVICE_HEALTH_PATH) as f:
+            health = json.load(f)
+    except (OSError, ValueError):
+        print("No worker health found")
+        return 1
+    age = time.time() - health["updated_at"]
+    print(json.dumps(health, indent=2))
+    if age > 3 * TRANSCRIBE_SERVICE_HEALTH_SECONDS:
+        print(f"Stale: last update {age:.0f} s ago")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident transcription worker")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="run the worker")
+    submit = commands.add_parser("submit", help="queue s3://bucket/key or a local path")
+    submit.add_argument("source")
+    submit.add_argument("--wait", action="store_true", help="block until the job finishes")
+    submit.add_argument("--timeout", type=float)
+    status = commands.add_parser("status", help="show a job, or queue counts")
+    status.add_argument("job", type=int, nargs="?")
+    commands.add_parser("health", help="show worker health and throughput")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve()
+        return 0
+    if args.command == "health":
+        return print_health()
+
+    job_queue = TranscriptionQueue()
+    if args.command == "status":
+        if args.job is None:
+            print(json.dumps(job_queue.counts(), indent=2))
+            return 0
+        entry = job_queue.get(args.job)
+        print(json.dumps(entry, indent=2))
+        return 0 if entry is not None else 1
+
+    source = args.source
+    if not source.startswith("s3://"):
+        # The worker may run from another directory
+        source = os.path.abspath(source)
+    job = job_queue.submit(source)
+    print(f"Submitted job {job}")
+    if not args.wait:
+        return 0
+    entry = job_queue.wait(job, timeout=args.timeout)
+    if entry is None:
+        print("Timed out waiting for the job")
+        return 1
+    print(json.dumps(entry, indent=2))
+    return 0 if entry["status"] == STATUS_DONE else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+from config import (
+    CPU_PROFILE_PATH,
+    CPU_TUNE_BATCH_SIZES,
+    CPU_TUNE_CLIP_SECONDS,
+    CPU_TUNE_COMPUTE_TYPES,
+    CPU_TUNE_VAD_ONSETS,
+    CPU_TUNE_WER_TOLERANCE,
+    CPU_TUNE_WORKERS,
+    TRANSCRIBE_MODEL,
+)
+from transcription_service import parse_source
+from utils.pcm import PCM_SAMPLE_RATE
+from utils.storage import download_file
+
+# Finds the fastest CPU settings for transcription on this machine. Usage,
+# from the repository root:
+#
+#   python tune_cpu_profile.py s3://demodaran-all-audio/talk.m4a
+#   python tune_cpu_profile.py /data/lecture.m4a --offset 600 --tolerance 0.03
+#
+# The clip (CPU_TUNE_CLIP_SECONDS of it, from --offset) goes through every
+# combination of CPU_TUNE_COMPUTE_TYPES, CPU_TUNE_WORKERS, CPU_TUNE_BATCH_SIZES
+# and CPU_TUNE_VAD_ONSETS. The fastest one within the word error tolerance of
+# a float32 reference run is saved to CPU_PROFILE_PATH, where the transcription
+# entry points pick it up on CPU nodes.
+
+
+def candidate_settings(cpu_count=None):
+    """Every combination of the CPU_TUNE_* settings that fits the cores."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return [
+        {
+            "compute_type": compute_type,
+            "workers": workers,
+            "batch_size": batch_size,
+            "vad_onset": vad_onset,
+        }
+        for compute_type, workers, batch_size, vad_onset in itertools.product(
+            CPU_TUNE_COMPUTE_TYPES, CPU_TUNE_WORKERS, CPU_TUNE_BATCH_SIZES, CPU_TUNE_VAD_ONSETS
+        )
+        if workers <= cpu_count
+    ]
+
+
+def load_clip(source, offset, seconds):
+    """Decoded 16 kHz audio of source (s3://bucket/key or a local path)."""
+    # Imported here so --help does not pay for torch
+    import whisperx
+
+    bucket, key = parse_source(source)
+    if bucket is None:
+        audio = whisperx.load_audio(key)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_path = os.path.join(tmp_dir, os.path.basename(key))
+            download_file(bucket, key, local_path, profile="audio")
+            audio = whisperx.load_audio(local_path)
+    return audio[int(offset * PCM_SAMPLE_RATE):int((offset + seconds) * PCM_SAMPLE_RATE)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune CPU transcription settings")
+    parser.add_argument("clip", help="s3://bucket/key or a local audio file")
+    parser.add_argument("--model", default=TRANSCRIBE_MODEL)
+    parser.add_argument("--offset", type=float, default=0, help="seconds into the file")
+    parser.add_argument("--seconds", type=float, default=CPU_TUNE_CLIP_SECONDS)
+    parser.add_argument("--tolerance", type=float, default=CPU_TUNE_WER_TOLERANCE)
+    parser.add_argument("--output", default=CPU_PROFILE_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="print the result, do not save it")
+    args = parser.parse_args(argv)
+
+    from transcriber.cpu_profile import save_cpu_profile, tune
+
+    audio = load_clip(args.clip, args.offset, args.seconds)
+    if not len(audio):
+        print("The clip is empty; check --offset")
+        return 1
+    candidates = candidate_settings()
+    print(
+        f"Tuning '{args.model}' on {len(audio) / PCM_SAMPLE_RATE:.0f} s of {args.clip}: "
+        f"{len(candidates)} candidates, WER tolerance {args.tolerance}"
+    )
+    best = tune(args.model, audio, candidates, args.tolerance)
+    if best is None:
+        print("No candidate stayed within the WER tolerance; keeping the current settings")
+        return 1
+
+    if best["workers"] == 1:
+        # One worker process is the main model with extra steps
+        best["workers"] = 0
+    best["cpu_count"] = os.cpu_count()
+    best["tuned_at"] = time.time()
+    print(f"Fastest within tolerance: {best}")
+    if not args.dry_run:
+        save_cpu_profile(best, args.output)
+        print(f"Saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from botocore.exceptions import ClientError
+
+from config import ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES
+from utils.manifest import normalize_etag
+from utils.storage import copy_object, get_s3_client
+
+# Artifact kinds recorded in the manifest's artifacts table
+KIND_AUDIO = "audio"
+KIND_TRANSCRIPTS = "transcripts"
+# Local cache only: the PCM sidecar of extracted audio (utils/pcm.py)
+KIND_PCM = "pcm"
+
+# User metadata key (x-amz-meta-content-id) that carries the content id of
+# the source video on extracted audio, so copies and re-extractions of the
+# same video share one transcript.
+CONTENT_ID_METADATA = "content-id"
+
+
+def content_id(etag, size):
+    """
+    Identity of an object's content. ETags of multipart uploads depend on the
+    part size as well as the bytes, so the same file uploaded with different
+    tools can still miss; it never gives a false hit in practice.
+    """
+    return f"etag:{normalize_etag(etag)}:{size}"
+
+
+def content_id_metadata(cid, copy=False):
+    """
+    ExtraArgs that tag an uploaded artifact with its content id. For a copy
+    the source's metadata must be replaced explicitly.
+    """
+    extra_args = {"Metadata": {CONTENT_ID_METADATA: cid}}
+    if copy:
+        extra_args["MetadataDirective"] = "REPLACE"
+    return extra_args
+
+
+def read_content_id(bucket_name, object_key, etag, size):
+    """
+    Content id of an artifact in S3: the source content id it was tagged
+    with, or its own ETag and size.
+    """
+    try:
+        response = get_s3_client().head_object(Bucket=bucket_name, Key=object_key)
+    except ClientError:
+        return content_id(etag, size)
+    return response.get("Metadata", {}).get(CONTENT_ID_METADATA) or content_id(etag, size)
+
+
+def short_hash(text, length=8):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:length]
+
+
+def _is_missing(error):
+    return error.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound")
+
+
+def reuse_artifact(manifest, cid, kind, bucket_name, object_key, logger, extra_args=None):
+    """
+    If the manifest has a kind artifact for cid, make it available at
+    bucket_name/object_key: nothing to do if it is already there, otherwise
+    a server-side copy. Returns True on a hit. An artifact that no longer
+    exists in S3 is forgotten and reported as a miss.
+    """
+    artifact = manifest.get_artifact(cid, kind)
+    if artifact is None:
+        return False
+    source_bucket, source_key = artifact
+
+    try:
+        if (source_bucket, source_key) == (bucket_name, object_key):
+            get_s3_client().head_object(Bucket=bucket_name, Key=object_key)
+        else:
+            logger.info(
+                "Content of %s already processed as s3://%s/%s; copying",
+                object_key,
+                source_bucket,
+                source_key,
+            )
+            copy_object(
+                source_bucket, source_key, bucket_name, object_key, extra_args=extra_args
+            )
+    except ClientError as e:
+        if not _is_missing(e):
+            raise
+        logger.info("Cached %s artifact s3://%s/%s is gone", kind, source_bucket, source_key)
+        manifest.forget_artifact(cid, kind)
+        return False
+    return True
+
+
+class LocalArtifactCache:
+    """
+    Files keyed by (content id, kind) in a local directory, evicted
+    least-recently-used once they add up to more than max_bytes. A hit is
+    hard-linked (or copied, across filesystems) to the requested path.
+    Thread-safe within a process.
+    """
+
+    def __init__(self, directory, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _path(self, cid, kind):
+        return os.path.join(self.directory, f"{kind}-{short_hash(cid, 40)}")
+
+    def get(self, cid, kind, dest_path):
+        """Place the cached file at dest_path. Returns True on a hit."""
+        path = self._path(cid, kind)
+        with self._lock:
+            if not os.path.exists(path):
+                return False
+            # mtime is the recency used by eviction
+            os.utime(path)
+            _link_or_copy(path, dest_path)
+        return True
+
+    def put(self, cid, kind, source_path):
+        path = self._path(cid, kind)
+        with self._lock:
+            if not os.path.exists(path):
+                tmp_path = f"{path}.tmp"
+                _link_or_copy(source_path, tmp_path)
+                os.replace(tmp_path, path)
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+def _link_or_copy(source_path, dest_path):
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        shutil.copyfile(source_path, dest_path)
+
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+
+def get_local_cache():
+    """The process-wide LocalArtifactCache, or None if ARTIFACT_CACHE_DIR is unset."""
+    global _local_cache
+
+    if ARTIFACT_CACHE_DIR is None:
+        return None
+    with _local_cache_lock:
+        if _local_cache is None:
+            _local_cache = LocalArtifactCache(ARTIFACT_CACHE_DIR)
+    return _local_cache
+
+
+def cache_local_file(cid, kind, path):
+    """Keep a copy of path in the local cache, if it is enabled and path exists."""
+    local_cache = get_local_cache()
+    if local_cache is not None and os.path.exists(path):
+        local_cache.put(cid, kind, path)
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import (
+    TRANSCRIBE_QUEUE_PATH,
+    TRANSCRIBE_QUEUE_POLL_SECONDS,
+    TRANSCRIBE_QUEUE_STALE_SECONDS,
+)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class TranscriptionQueue:
+    """
+    SQLite-backed queue of transcription jobs for the resident worker
+    (transcription_service.py). A job's source is "s3://bucket/key" or a
+    local file path; its result is the list of transcript locations.
+
+    Any process on the machine can submit; workers claim jobs atomically
+    and keep a heartbeat on the job they run, so the job of a worker that
+    died goes back to the queue after TRANSCRIBE_QUEUE_STALE_SECONDS.
+    """
+
+    def __init__(self, path=TRANSCRIBE_QUEUE_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode, so BEGIN IMMEDIATE below takes the write lock
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    submitted_at REAL NOT NULL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    def submit(self, source):
+        """Queue a job and return its id."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (source, status, submitted_at) VALUES (?, ?, ?)",
+                (source, STATUS_QUEUED, time.time()),
+            )
+        return cursor.lastrowid
+
+    def claim_next(self, worker):
+        """
+        Take the oldest queued job (or one whose worker stopped sending
+        heartbeats). Returns (job id, source) or None if the queue is empty.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, source FROM jobs WHERE status = ? "
+                    "OR (status = ? AND heartbeat_at < ?) ORDER BY id LIMIT 1",
+                    (STATUS_QUEUED, STATUS_RUNNING, now - TRANSCRIBE_QUEUE_STALE_SECONDS),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, started_at = ?, "
+                        "heartbeat_at = ? WHERE id = ?",
+                        (STATUS_RUNNING, worker, now, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def heartbeat(self, job, worker):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time(), job, worker, STATUS_RUNNING),
+            )
+
+    def complete(self, job, result):
+        self._finish(job, STATUS_DONE, json.dumps(result), None)
+
+    def fail(self, job, error):
+        self._finish(job, STATUS_FAILED, None, str(error))
+
+    def _finish(self, job, status, result, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), result, error, job),
+            )
+
+    def requeue_worker(self, worker):
+        """Put back the running jobs of a worker that is restarting."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE worker = ? AND status = ?",
+                (STATUS_QUEUED, worker, STATUS_RUNNING),
+            )
+
+    def get(self, job):
+        """The job as a dict, or None if there is no such job."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job,))
+            row = cursor.fetchone()
+            columns = [c[0] for c in cursor.description]
+        if row is None:
+            return None
+        entry = dict(zip(columns, row))
+        entry["result"] = json.loads(entry["result"]) if entry["result"] else None
+        return entry
+
+    def wait(self, job, timeout=None, poll=TRANSCRIBE_QUEUE_POLL_SECONDS):
+        """Block until the job is done or failed; returns it, or None on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            entry = self.get(job)
+            if entry is None or entry["status"] in (STATUS_DONE, STATUS_FAILED):
+                return entry
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def counts(self):
+        """Number of jobs per status."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def submit_transcription(bucket_name, object_key):
+    """
+    Hand newly extracted audio to the resident transcription worker. Used
+    by the extraction entry points when TRANSCRIBE_QUEUE_SUBMIT is set.
+    """
+    global _queue
+
+    with _queue_lock:
+        if _queue is None:
+            _queue = TranscriptionQueue()
+    return _queue.submit(f"s3://{bucket_name}/{object_key}")
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from config import (
+    LEASE_BACKEND,
+    LEASE_S3_BUCKET,
+    LEASE_S3_PREFIX,
+    LEASE_SQLITE_PATH,
+    LEASE_TTL_SECONDS,
+    SHARD_COUNT,
+    SHARD_INDEX,
+    WORKER_ID,
+    WORKER_MODE,
+)
+from utils.manifest import normalize_etag
+from utils.storage import get_s3_client
+
+
+def job_id(stage, bucket, object_key, etag):
+    """Identifier of one unit of work, shared by every node."""
+    return f"{stage}:{bucket}/{object_key}@{normalize_etag(etag)}"
+
+
+def shard_of(key, shard_count):
+    """Deterministic shard for a key; the same on every node and Python run."""
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+class SQLiteLeaseBackend:
+    """
+    Leases in a SQLite file. SQLite's file locking makes claims atomic across
+    processes on one machine, which is enough for tests and single-host runs.
+    """
+
+    def __init__(self, path=LEASE_SQLITE_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        # Autocommit mode, so BEGIN IMMEDIATE below takes the write lock
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    job_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+
+    def claim(self, job, owner, ttl):
+        """Take the lease if nobody holds a live one and the job is not done."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT owner, expires_at, done FROM leases WHERE job_id = ?", (job,)
+                ).fetchone()
+                if row is not None and (row[2] or (row[1] > now and row[0] != owner)):
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO leases (job_id, owner, expires_at, done) "
+                    "VALUES (?, ?, ?, 0)",
+                    (job, owner, now + ttl),
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def renew(self, job, owner, ttl):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE job_id = ? AND owner = ? AND done = 0",
+                (time.time() + ttl, job, owner),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job, owner, done):
+        """Mark the job done, or give it back so another node can retry it."""
+        with self._lock:
+            if done:
+                self._conn.execute(
+                    "UPDATE leases SET done = 1 WHERE job_id = ? AND owner = ?", (job, owner)
+                )
+            else:
+                self._conn.execute(
+                    "DELETE FROM leases WHERE job_id = ? AND owner = ?", (job, owner)
+                )
+
+
+class S3LeaseBackend:
+    """
+    Leases as small JSON objects in S3, made atomic with conditional writes:
+    a new lease is created with If-None-Match: *, an expired one is taken over
+    with If-Match on its ETag. Expiry uses each node's wall clock, so keep the
+    TTL well above the expected clock skew between nodes.
+    """
+
+    def __init__(self, bucket=LEASE_S3_BUCKET, prefix=LEASE_S3_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, job):
+        return self.prefix + hashlib.sha256(job.encode("utf-8")).hexdigest() + ".json"
+
+    def _read(self, job):
+        """Return (lease dict, etag) or (None, None) if there is no lease."""
+        try:
+            response = get_s3_client().get_object(Bucket=self.bucket, Key=self._key(job))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None, None
+            raise
+        return json.loads(response["Body"].read()), response["ETag"]
+
+    def _write(self, job, lease, **condition):
+        """put_object with a precondition; False if another node won the race."""
+        try:
+            get_s3_client().put_object(
+                Bucket=self.bucket,
+                Key=self._key(job),
+                Body=json.dumps(lease, separators=(",", ":")),
+                ContentType="application/json",
+                **condition,
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return False
+            raise
+
+    def claim(self, job, owner, ttl):
+        lease = {"job": job, "owner": owner, "expires_at": time.time() + ttl, "done": False}
+        if self._write(job, lease, IfNoneMatch="*"):
+            return True
+        current, etag = self._read(job)
+        if current is None:
+            # Released between our write and read; try once more
+            return self._write(job, lease, IfNoneMatch="*")
+        if current["done"]:
+            return False
+        if current["expires_at"] > time.time() and current["owner"] != owner:
+            return False
+        return self._write(job, lease, IfMatch=etag)
+
+    def renew(self, job, owner, ttl):
+        current, etag = self._read(job)
+        if current is None or current["owner"] != owner or current["done"]:
+            return False
+        current["expires_at"] = time.time() + ttl
+        return self._write(job, current, IfMatch=etag)
+
+    def release(self, job, owner, done):
+        current, etag = self._read(job)
+        if current is None or current["owner"] != owner:
+            return
+        if done:
+            current["done"] = True
+        else:
+            # An already-expired lease: free for any node to claim
+            current["expires_at"] = 0
+        self._write(job, current, IfMatch=etag)
+
+
+def create_lease_backend(name=LEASE_BACKEND):
+    if name == "sqlite":
+        return SQLiteLeaseBackend()
+    if name == "s3":
+        return S3LeaseBackend()
+    raise ValueError(f"Unknown lease backend: {name}")
+
+
+class WorkCoordinator:
+    """
+    Decides which jobs this node may run.
+
+    In "single" mode every job is ours. In "shard" mode a job is ours when
+    its id hashes to SHARD_INDEX. In "lease" mode jobs are claimed from a
+    shared backend, and a heartbeat thread renews held leases until they are
+    released, so a crashed node's jobs become claimable after the TTL.
+    """
+
+    def __init__(
+        self,
+        mode=WORKER_MODE,
+        backend=None,
+        worker_id=WORKER_ID,
+        ttl=LEASE_TTL_SECONDS,
+        shard_index=SHARD_INDEX,
+        shard_count=SHARD_COUNT,
+        log=print,
+    ):
+        if mode not in ("single", "lease", "shard"):
+            raise ValueError(f"Unknown worker mode: {mode}")
+        self.mode = mode
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = ttl
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.backend = backend
+        self.log = log
+        if mode == "lease" and backend is None:
+            self.backend = create_lease_backend()
+
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        if self.mode == "lease":
+            self._heartbeat = threading.Thread(
+                target=self._renew_loop, name="lease-heartbeat", daemon=True
+            )
+            self._heartbeat.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+
+    def claim(self, job):
+        """True if this node should run job now."""
+        if self.mode == "single":
+            return True
+        if self.mode == "shard":
+            return shard_of(job, self.shard_count) == self.shard_index
+        if not self.backend.claim(job, self.worker_id, self.ttl):
+            return False
+        with self._held_lock:
+            self._held.add(job)
+        return True
+
+    def release(self, job, done):
+        """Report the outcome of a claimed job. Failed jobs can be retried by any node."""
+        if self.mode != "lease":
+            return
+        with self._held_lock:
+            self._held.discard(job)
+        self.backend.release(job, self.worker_id, done)
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            with self._held_lock:
+                held = list(self._held)
+            for job in held:
+                try:
+                    if not self.backend.renew(job, self.worker_id, self.ttl):
+                        self.log(f"Lost lease on {job}")
+                except Exception as e:
+                    self.log(f"Failed to renew lease on {job}: {e}")
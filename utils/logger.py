@@ -1,55 +1,196 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import threading
 
-from config import LOG_DIR
+from config import LOG_DIR, LOG_FORMAT, LOG_MODE
 
+# Structured fields that callers pass with extra={...} (see log_fields)
+STRUCTURED_FIELDS = ("job", "stage", "duration", "bytes")
 
-def setup_loggers():
+_setup_lock = threading.Lock()
+_configured_pid = None
+_log_queue = None
+_listener = None
+
+
+class JsonLinesFormatter(logging.Formatter):
     """
-    Configures two loggers:
-      1) app_logger: general application logging
-      2) failures_logger: logs the filenames that fail to process
-    Returns (app_logger, failures_logger) so they can be used in the rest of the app.
+    One JSON object per line: time, level, logger, message, plus the
+    structured fields and exception text when present.
     """
 
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def log_fields(job=None, stage=None, duration=None, num_bytes=None):
+    """
+    extra= dict for a log call, e.g.
+    logger.info("Downloaded %s", key, extra=log_fields(key, "download", 1.2, size)).
+    The JSON formatter writes these as fields; the text format ignores them.
+    """
+    fields = {"job": job, "stage": stage, "bytes": num_bytes}
+    if duration is not None:
+        fields["duration"] = round(duration, 3)
+    return fields
+
+
+def _make_formatter():
+    if LOG_FORMAT == "json":
+        return JsonLinesFormatter()
+    return logging.Formatter("%(asctime)s [%(levelname)s] %(name)s - %(message)s")
+
+
+def _make_handlers():
+    """
+    The actual output handlers: (app handlers, failures handlers).
+    """
     # Ensure the log directory exists
     if not os.path.exists(LOG_DIR):
         os.makedirs(LOG_DIR)
 
-    # Create the general application logger
-    app_logger = logging.getLogger("app_logger")
-    app_logger.setLevel(logging.INFO)
+    formatter = _make_formatter()
 
     # Create the file handler for the main application log
-    app_log_file = os.path.join(LOG_DIR, "app.log")
-    fh_app = logging.FileHandler(app_log_file)
+    fh_app = logging.FileHandler(os.path.join(LOG_DIR, "app.log"))
     fh_app.setLevel(logging.INFO)
+    fh_app.setFormatter(formatter)
 
     # Create console handler for convenience (optional)
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)
-
-    # Define a standard log format
-    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s - %(message)s")
-    fh_app.setFormatter(formatter)
     ch.setFormatter(formatter)
 
-    # Attach handlers to the application logger
-    app_logger.addHandler(fh_app)
-    app_logger.addHandler(ch)
-
-    # Create a separate logger for failures
-    failures_logger = logging.getLogger("failures_logger")
-    failures_logger.setLevel(logging.ERROR)
-
     # Create the file handler for failures
-    failures_log_file = os.path.join(LOG_DIR, "failed_files.log")
-    fh_failures = logging.FileHandler(failures_log_file)
+    fh_failures = logging.FileHandler(os.path.join(LOG_DIR, "failed_files.log"))
     fh_failures.setLevel(logging.ERROR)
     fh_failures.setFormatter(formatter)
 
-    # Attach handler to failures logger
-    failures_logger.addHandler(fh_failures)
+    return [fh_app, ch], [fh_failures]
+
+
+class _RoutingHandler(logging.Handler):
+    """
+    Listener-side handler: sends each record to the handlers of the logger
+    it was emitted on, so both loggers can share one queue.
+    """
+
+    def __init__(self, app_handlers, failures_handlers):
+        super().__init__()
+        self._routes = {
+            "app_logger": app_handlers,
+            "failures_logger": failures_handlers,
+        }
+
+    def handle(self, record):
+        for handler in self._routes.get(record.name, self._routes["app_logger"]):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def _attach(logger, level, handlers):
+    logger.setLevel(level)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    # Our handlers are complete; don't also pass records to the root logger
+    logger.propagate = False
+
+
+def setup_loggers():
+    """
+    Configures two loggers:
+      1) app_logger: general application logging
+      2) failures_logger: logs the filenames that fail to process
+    Returns (app_logger, failures_logger) so they can be used in the rest of the app.
+
+    Safe to call more than once: handlers are only created on the first call
+    in each process. With LOG_MODE = "queue" the loggers only put records on
+    a multiprocessing queue and a background listener thread does the file
+    and console I/O; pass get_log_queue() to process pools so their workers
+    log through the same listener (see setup_worker_logging).
+    """
+    global _configured_pid, _log_queue, _listener
+
+    app_logger = logging.getLogger("app_logger")
+    failures_logger = logging.getLogger("failures_logger")
+
+    with _setup_lock:
+        if _configured_pid == os.getpid():
+            return app_logger, failures_logger
+
+        app_handlers, failures_handlers = _make_handlers()
+        if LOG_MODE == "queue":
+            _log_queue = multiprocessing.Queue(-1)
+            _listener = logging.handlers.QueueListener(
+                _log_queue,
+                _RoutingHandler(app_handlers, failures_handlers),
+                respect_handler_level=False,
+            )
+            _listener.start()
+            atexit.register(shutdown_logging)
+            queue_handler = logging.handlers.QueueHandler(_log_queue)
+            _attach(app_logger, logging.INFO, [queue_handler])
+            _attach(failures_logger, logging.ERROR, [queue_handler])
+        else:
+            _attach(app_logger, logging.INFO, app_handlers)
+            _attach(failures_logger, logging.ERROR, failures_handlers)
+        _configured_pid = os.getpid()
 
     # Return both loggers
     return app_logger, failures_logger
+
+
+def get_log_queue():
+    """The queue the listener reads, or None when LOG_MODE is not "queue"."""
+    return _log_queue
+
+
+def setup_worker_logging(log_queue):
+    """
+    Process pool initializer helper. With a queue from get_log_queue() the
+    worker's records go to the parent's listener, so lines from several
+    processes never interleave in the log files. Without one, the worker
+    sets up its own handlers (a forked worker keeps the inherited ones).
+    """
+    global _configured_pid
+
+    if log_queue is None:
+        if not logging.getLogger("app_logger").handlers:
+            setup_loggers()
+        return
+
+    with _setup_lock:
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        _attach(logging.getLogger("app_logger"), logging.INFO, [queue_handler])
+        _attach(logging.getLogger("failures_logger"), logging.ERROR, [queue_handler])
+        _configured_pid = os.getpid()
+
+
+def shutdown_logging():
+    """Stop the listener after it has written every queued record."""
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None and _configured_pid == os.getpid():
+            _listener.stop()
+            _listener = None
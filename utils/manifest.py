@@ -0,0 +1,196 @@
+import os
+import sqlite3
+import threading
+import time
+
+from config import MANIFEST_PATH
+
+# Per-stage job states, one row per (bucket, key, stage)
+STAGE_EXTRACTED = "extracted"
+STAGE_METADATA = "metadata"
+STAGE_TRANSCRIBED = "transcribed"
+STAGE_INDEXED = "indexed"
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def normalize_etag(etag):
+    """S3 returns ETags wrapped in double quotes; store them without."""
+    return (etag or "").strip('"')
+
+
+class JobManifest:
+    """
+    On-disk record of which source objects have been processed by which
+    stage, keyed by bucket + key + ETag. An ETag change (the object was
+    re-uploaded with new content) makes the job pending again.
+
+    Safe to share between threads of one process; SQLite's own locking
+    covers several processes on the same machine.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    output_key TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (bucket, key, stage)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_output_key "
+                "ON jobs (stage, output_key COLLATE NOCASE)"
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    content_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (content_id, kind)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    stage TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (stage, bucket)
+                )
+                """
+            )
+
+    def is_done(self, bucket, key, etag, stage):
+        """True if the stage already completed for this exact object version."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, status FROM jobs WHERE bucket = ? AND key = ? AND stage = ?",
+                (bucket, key, stage),
+            ).fetchone()
+        return row is not None and row[1] == STATUS_DONE and row[0] == normalize_etag(etag)
+
+    def get_output_key(self, bucket, key, stage):
+        """Return the output key recorded for a completed job, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output_key FROM jobs "
+                "WHERE bucket = ? AND key = ? AND stage = ? AND status = ?",
+                (bucket, key, stage, STATUS_DONE),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_source_key(self, bucket, stage, output_key):
+        """
+        Return the source key whose stage output is output_key (compared
+        case-insensitively), or None. Used to detect basename collisions.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key FROM jobs WHERE stage = ? AND bucket = ? "
+                "AND output_key = ? COLLATE NOCASE LIMIT 1",
+                (stage, bucket, output_key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def mark_done(self, bucket, key, etag, stage, output_key=None):
+        self._upsert(bucket, key, etag, stage, STATUS_DONE, output_key, None)
+
+    def mark_failed(self, bucket, key, etag, stage, error=None):
+        self._upsert(bucket, key, etag, stage, STATUS_FAILED, None, error)
+
+    def _upsert(self, bucket, key, etag, stage, status, output_key, error):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (bucket, key, stage, etag, status, output_key, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket, key, stage) DO UPDATE SET
+                    etag = excluded.etag,
+                    status = excluded.status,
+                    output_key = excluded.output_key,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+                """,
+                (bucket, key, stage, normalize_etag(etag), status, output_key, error, time.time()),
+            )
+
+    def get_artifact(self, content_id, kind):
+        """
+        Return (bucket, key) of an artifact already produced from content_id
+        (see utils.content_cache.content_id), or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT bucket, key FROM artifacts WHERE content_id = ? AND kind = ?",
+                (content_id, kind),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put_artifact(self, content_id, kind, bucket, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO artifacts (content_id, kind, bucket, key, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (content_id, kind) DO UPDATE SET
+                    bucket = excluded.bucket,
+                    key = excluded.key,
+                    created_at = excluded.created_at
+                """,
+                (content_id, kind, bucket, key, time.time()),
+            )
+
+    def forget_artifact(self, content_id, kind):
+        """Drop an artifact that turned out to be gone from S3."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM artifacts WHERE content_id = ? AND kind = ?", (content_id, kind)
+            )
+
+    def get_checkpoint(self, stage, bucket):
+        """
+        Return when a full pass of stage over bucket last completed (epoch
+        seconds), or None if it never did.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT completed_at FROM checkpoints WHERE stage = ? AND bucket = ?",
+                (stage, bucket),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, stage, bucket, completed_at=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO checkpoints (stage, bucket, completed_at) VALUES (?, ?, ?)
+                ON CONFLICT (stage, bucket) DO UPDATE SET completed_at = excluded.completed_at
+                """,
+                (stage, bucket, completed_at or time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
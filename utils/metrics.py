@@ -0,0 +1,271 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_DIR, METRICS_FLUSH_SECONDS, METRICS_PROMETHEUS_DIR
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class _Operation:
+    """Handle yielded by Metrics.timed; set bytes and error before it exits."""
+
+    __slots__ = ("bytes", "error", "started")
+
+    def __init__(self):
+        self.bytes = 0
+        self.error = False
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+class _StageStats:
+    __slots__ = ("count", "errors", "bytes", "seconds", "max_seconds", "buckets", "in_flight")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.in_flight = 0
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, or max_seconds."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+
+class Metrics:
+    """
+    Thread-safe per-stage counters, byte totals and latency histograms, plus
+    gauges (queue depths, in-flight jobs) read when a snapshot is taken.
+
+    Stages are free-form names ("download", "extract", "upload", "metadata",
+    "transcribe", ...). A background thread started with start(job) rewrites
+    "<METRICS_DIR>/<job>.json" and, if METRICS_PROMETHEUS_DIR is set, a
+    textfile-collector file there every METRICS_FLUSH_SECONDS.
+    """
+
+    def __init__(self):
+        self.job = None
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._gauges = {}
+        self._started_at = time.time()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def _stage(self, stage):
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = _StageStats()
+        return stats
+
+    def record(self, stage, seconds, num_bytes=0, error=False):
+        """Record one finished operation of a stage."""
+        with self._lock:
+            stats = self._stage(stage)
+            stats.count += 1
+            stats.errors += bool(error)
+            stats.bytes += num_bytes
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Time the enclosed block as one operation of stage and count it as in
+        flight meanwhile. It is recorded as an error if it raises or if the
+        yielded handle's error is set:
+
+            with metrics.timed("download") as op:
+                ...
+                op.bytes = os.path.getsize(path)
+        """
+        operation = _Operation()
+        with self._lock:
+            self._stage(stage).in_flight += 1
+        try:
+            yield operation
+        except BaseException:
+            operation.error = True
+            raise
+        finally:
+            with self._lock:
+                self._stage(stage).in_flight -= 1
+            self.record(stage, operation.elapsed(), operation.bytes, operation.error)
+
+    def register_gauge(self, name, read, **labels):
+        """Sample read() at every snapshot, e.g. a queue's qsize."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = read
+
+    def unregister_gauge(self, name, **labels):
+        with self._lock:
+            self._gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dict."""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "bytes": stats.bytes,
+                    "seconds": round(stats.seconds, 3),
+                    "max_seconds": round(stats.max_seconds, 3),
+                    "p50_seconds": round(stats.quantile(0.5), 3),
+                    "p95_seconds": round(stats.quantile(0.95), 3),
+                    "in_flight": stats.in_flight,
+                    "buckets": list(stats.buckets),
+                }
+                for stage, stats in self._stages.items()
+            }
+            gauges = list(self._gauges.items())
+
+        gauge_values = []
+        for (name, labels), read in gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            gauge_values.append({"name": name, "labels": dict(labels), "value": value})
+
+        return {
+            "job": self.job,
+            "started_at": self._started_at,
+            "updated_at": time.time(),
+            "stages": stages,
+            "gauges": gauge_values,
+        }
+
+    def to_prometheus(self, snapshot=None):
+        """Render a snapshot in the Prometheus text exposition format."""
+        snapshot = snapshot or self.snapshot()
+        lines = [
+            "# TYPE audio_extractor_stage_operations_total counter",
+            "# TYPE audio_extractor_stage_errors_total counter",
+            "# TYPE audio_extractor_stage_bytes_total counter",
+            "# TYPE audio_extractor_stage_in_flight gauge",
+            "# TYPE audio_extractor_stage_duration_seconds histogram",
+        ]
+        job = snapshot["job"] or "unknown"
+        for stage, stats in sorted(snapshot["stages"].items()):
+            label = f'job="{job}",stage="{stage}"'
+            lines.append(f"audio_extractor_stage_operations_total{{{label}}} {stats['count']}")
+            lines.append(f"audio_extractor_stage_errors_total{{{label}}} {stats['errors']}")
+            lines.append(f"audio_extractor_stage_bytes_total{{{label}}} {stats['bytes']}")
+            lines.append(f"audio_extractor_stage_in_flight{{{label}}} {stats['in_flight']}")
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), stats["buckets"]):
+                cumulative += bucket_count
+                lines.append(
+                    f'audio_extractor_stage_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"audio_extractor_stage_duration_seconds_sum{{{label}}} {stats['seconds']}")
+            lines.append(f"audio_extractor_stage_duration_seconds_count{{{label}}} {stats['count']}")
+
+        typed = set()
+        for gauge in sorted(snapshot["gauges"], key=lambda g: g["name"]):
+            name = f"audio_extractor_{gauge['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            labels = ",".join(
+                f'{k}="{v}"' for k, v in sorted(dict(gauge["labels"], job=job).items())
+            )
+            lines.append(f"{name}{{{labels}}} {gauge['value']}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Write the JSON snapshot and Prometheus textfile of the current job."""
+        if self.job is None:
+            return
+        snapshot = self.snapshot()
+        _write_atomically(
+            os.path.join(METRICS_DIR, f"{self.job}.json"), json.dumps(snapshot, indent=2)
+        )
+        if METRICS_PROMETHEUS_DIR:
+            _write_atomically(
+                os.path.join(METRICS_PROMETHEUS_DIR, f"audio_extractor_{self.job}.prom"),
+                self.to_prometheus(snapshot),
+            )
+
+    def start(self, job, interval=METRICS_FLUSH_SECONDS):
+        """
+        Name the job ("extract", "metadata", "transcribe") and flush
+        periodically from a daemon thread until stop().
+        """
+        if self._flusher is not None:
+            return
+        self.job = job
+        self._stop.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, args=(interval,), name="metrics-flush", daemon=True
+        )
+        self._flusher.start()
+
+    def stop(self):
+        """Stop the flusher and write the final snapshot."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def log_summary(self, log):
+        """Write a per-stage summary table through log (e.g. logger.info or print)."""
+        snapshot = self.snapshot()
+        log(
+            f"{'stage':<14}{'ops':>8}{'errors':>8}{'MB':>10}{'total s':>10}"
+            f"{'p50 s':>8}{'p95 s':>8}{'max s':>9}"
+        )
+        for stage, stats in sorted(
+            snapshot["stages"].items(), key=lambda item: -item[1]["seconds"]
+        ):
+            log(
+                f"{stage:<14}{stats['count']:>8}{stats['errors']:>8}"
+                f"{stats['bytes'] / 1e6:>10.1f}{stats['seconds']:>10.1f}"
+                f"{stats['p50_seconds']:>8.2f}{stats['p95_seconds']:>8.2f}{stats['max_seconds']:>9.1f}"
+            )
+
+
+def _write_atomically(path, text):
+    """Write via a temp file and rename, so readers never see a partial file."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,14 @@
+import os
+
+from config import PCM_SIDECAR_EXTENSION
+
+# Format of the PCM sidecar written next to extracted audio: raw
+# little-endian float32, mono, 16 kHz, i.e. exactly what whisperx.load_audio
+# returns, so the transcription stage can memory-map it instead of decoding.
+PCM_SAMPLE_RATE = 16000
+PCM_FFMPEG_OUTPUT_ARGS = {"format": "f32le", "acodec": "pcm_f32le", "ac": 1, "ar": PCM_SAMPLE_RATE}
+
+
+def pcm_sidecar_path(audio_path):
+    """Local path or S3 key of the PCM sidecar for an .m4a path or key."""
+    return os.path.splitext(audio_path)[0] + PCM_SIDECAR_EXTENSION
@@ -0,0 +1,370 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from config import (
+    LIST_DELIMITER,
+    LIST_QUEUE_PAGES,
+    LIST_WORKERS,
+    REGION_NAME,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_MAX_RETRY_ATTEMPTS,
+    S3_PUT_CONCURRENCY,
+    S3_TRANSFER_PROFILES,
+)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Return the process-wide S3 client, creating it on first use.
+    boto3 clients are thread-safe, so every module and worker thread shares
+    this one client and its connection pool. A forked child gets its own
+    client instead of reusing the parent's sockets.
+    """
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # A dedicated session: boto3's default session is not thread-safe
+                session = boto3.session.Session()
+                _client = session.client(
+                    "s3",
+                    region_name=REGION_NAME,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": S3_MAX_RETRY_ATTEMPTS, "mode": "standard"},
+                    ),
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+_transfer_configs = {}
+
+
+def get_transfer_config(profile):
+    """Return the TransferConfig for a profile in S3_TRANSFER_PROFILES."""
+    if profile not in _transfer_configs:
+        _transfer_configs[profile] = TransferConfig(**S3_TRANSFER_PROFILES[profile])
+    return _transfer_configs[profile]
+
+
+class TransferStats:
+    """
+    Thread-safe totals of bytes and seconds per (direction, profile), used to
+    tune the transfer profiles.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, direction, profile, num_bytes, seconds):
+        with self._lock:
+            count, total_bytes, total_seconds = self._totals.get(
+                (direction, profile), (0, 0, 0.0)
+            )
+            self._totals[(direction, profile)] = (
+                count + 1,
+                total_bytes + num_bytes,
+                total_seconds + seconds,
+            )
+
+    def summary(self):
+        """
+        Return a list of dicts with count, bytes, seconds and MB/s for every
+        (direction, profile) seen so far.
+        """
+        with self._lock:
+            totals = dict(self._totals)
+        rows = []
+        for (direction, profile), (count, num_bytes, seconds) in sorted(totals.items()):
+            rows.append(
+                {
+                    "direction": direction,
+                    "profile": profile,
+                    "count": count,
+                    "bytes": num_bytes,
+                    "seconds": round(seconds, 3),
+                    "mb_per_s": round(num_bytes / seconds / 1e6, 2) if seconds else 0.0,
+                }
+            )
+        return rows
+
+    def log_summary(self, log):
+        """Write one line per (direction, profile) through log (e.g. logger.info or print)."""
+        for row in self.summary():
+            log(
+                f"S3 {row['direction']} [{row['profile']}]: {row['count']} transfers, "
+                f"{row['bytes']} bytes in {row['seconds']} s ({row['mb_per_s']} MB/s per transfer)"
+            )
+
+
+transfer_stats = TransferStats()
+
+
+def download_file(bucket_name, object_key, local_path, profile="video"):
+    """Download an object with the shared client and record its throughput."""
+    start = time.monotonic()
+    get_s3_client().download_file(
+        bucket_name, object_key, local_path, Config=get_transfer_config(profile)
+    )
+    transfer_stats.record(
+        "download", profile, os.path.getsize(local_path), time.monotonic() - start
+    )
+
+
+def upload_file(local_path, bucket_name, object_key, profile="audio", extra_args=None):
+    """Upload a local file with the shared client and record its throughput."""
+    start = time.monotonic()
+    get_s3_client().upload_file(
+        local_path,
+        bucket_name,
+        object_key,
+        ExtraArgs=extra_args,
+        Config=get_transfer_config(profile),
+    )
+    transfer_stats.record(
+        "upload", profile, os.path.getsize(local_path), time.monotonic() - start
+    )
+
+
+def copy_object(
+    source_bucket, source_key, bucket_name, object_key, size=0, profile="audio", extra_args=None
+):
+    """
+    Server-side copy with the shared client; nothing passes through this
+    host. size (if known) is recorded as the copied bytes.
+    """
+    start = time.monotonic()
+    get_s3_client().copy(
+        {"Bucket": source_bucket, "Key": source_key},
+        bucket_name,
+        object_key,
+        ExtraArgs=extra_args,
+        Config=get_transfer_config(profile),
+    )
+    transfer_stats.record("copy", profile, size, time.monotonic() - start)
+
+
+def put_object(bucket_name, object_key, body, profile="text", **kwargs):
+    """put_object with the shared client, recording its throughput."""
+    start = time.monotonic()
+    response = get_s3_client().put_object(
+        Bucket=bucket_name, Key=object_key, Body=body, **kwargs
+    )
+    num_bytes = len(body.encode("utf-8")) if isinstance(body, str) else len(body)
+    transfer_stats.record("upload", profile, num_bytes, time.monotonic() - start)
+    return response
+
+
+_put_executor = None
+_put_executor_lock = threading.Lock()
+
+
+def put_objects(bucket_name, objects, profile="text"):
+    """
+    put_object for several small in-memory objects at once, on a shared
+    pool of S3_PUT_CONCURRENCY threads. objects is a list of (key, body,
+    extra put_object kwargs). Waits for all of them and raises the first
+    error, if any.
+    """
+    global _put_executor
+
+    with _put_executor_lock:
+        if _put_executor is None:
+            _put_executor = ThreadPoolExecutor(
+                max_workers=S3_PUT_CONCURRENCY, thread_name_prefix="put-object"
+            )
+    futures = [
+        _put_executor.submit(put_object, bucket_name, key, body, profile, **kwargs)
+        for key, body, kwargs in objects
+    ]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+
+
+def _matches(key, suffixes):
+    return suffixes is None or key.lower().endswith(suffixes)
+
+
+def _iter_pages(bucket_name, prefix, suffixes, delimiter=None):
+    """
+    Yield (objects, common prefixes) per listed page; objects are already
+    filtered by suffix.
+    """
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+    if delimiter:
+        kwargs["Delimiter"] = delimiter
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(**kwargs):
+        objects = [obj for obj in page.get("Contents", []) if _matches(obj["Key"], suffixes)]
+        prefixes = [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+        yield objects, prefixes
+
+
+def _put(out, item, stop):
+    """Put item on out, waiting while it is full unless the listing is stopped."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=1)
+            return
+        except queue.Full:
+            pass
+
+
+def _list_partitions(bucket_name, partitions, suffixes, out, stop):
+    """
+    Thread body: list partitions from a shared queue until it is empty,
+    putting each page on out. None on out marks the end of this thread.
+    """
+    try:
+        while not stop.is_set():
+            try:
+                prefix = partitions.get_nowait()
+            except queue.Empty:
+                break
+            for objects, _ in _iter_pages(bucket_name, prefix, suffixes):
+                # Waits while the consumer is LIST_QUEUE_PAGES pages behind
+                _put(out, objects, stop)
+                if stop.is_set():
+                    return
+    except Exception as e:
+        _put(out, e, stop)
+    finally:
+        _put(out, None, stop)
+
+
+def iter_objects(
+    bucket_name,
+    prefix="",
+    suffixes=None,
+    workers=LIST_WORKERS,
+    delimiter=LIST_DELIMITER,
+):
+    """
+    Yield the object dicts (Key, ETag, Size, ...) under prefix as their
+    listing pages arrive, so work on the first page starts while the rest
+    of the bucket is still being listed. suffixes (a tuple, compared case
+    insensitively) filters keys while streaming.
+
+    With workers > 1 the keyspace is split at the first delimiter below
+    prefix (e.g. one partition per top-level "folder") and the partitions
+    are listed in parallel; the order of keys is then not lexicographic.
+    At most LIST_QUEUE_PAGES pages are buffered, so memory stays flat
+    however large the bucket is.
+    """
+    if suffixes is not None:
+        suffixes = tuple(s.lower() for s in suffixes)
+    if workers <= 1 or not delimiter:
+        for objects, _ in _iter_pages(bucket_name, prefix, suffixes):
+            yield from objects
+        return
+
+    # Objects directly under prefix come with the partition discovery
+    partitions = queue.Queue()
+    for objects, prefixes in _iter_pages(bucket_name, prefix, suffixes, delimiter):
+        yield from objects
+        for partition in prefixes:
+            partitions.put(partition)
+    workers = min(workers, partitions.qsize())
+    if workers == 0:
+        return
+
+    out = queue.Queue(maxsize=LIST_QUEUE_PAGES)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=_list_partitions,
+            args=(bucket_name, partitions, suffixes, out, stop),
+            name=f"list-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        running = workers
+        while running:
+            page = out.get()
+            if page is None:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Also reached when the consumer stops early
+        stop.set()
+
+
+class ListedKeys:
+    """
+    Set-like view of the (lower-cased) keys in a bucket, filled by a
+    listing in a background thread so callers do not wait for the whole
+    bucket to be listed. A key the listing has not reached yet is looked
+    up with a HEAD request for its exact case; other cases only match
+    keys listed so far. If the listing fails, lookups keep using HEAD for
+    the keys it did not reach.
+    """
+
+    def __init__(self, bucket_name, log=print):
+        self.bucket_name = bucket_name
+        self.log = log
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._complete = False
+        self._thread = threading.Thread(target=self._fill, name="listed-keys", daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            for obj in iter_objects(self.bucket_name):
+                with self._lock:
+                    self._keys.add(obj["Key"].lower())
+            self._complete = True
+            self.log(f"Found {len(self._keys)} files already in {self.bucket_name}.")
+        except Exception as e:
+            # ClientError as well as BotoCoreError (connection errors, ...)
+            self.log(
+                f"Error listing objects in {self.bucket_name}: {e}; "
+                "checking keys one by one instead"
+            )
+
+    def add(self, key):
+        with self._lock:
+            self._keys.add(key.lower())
+
+    def _listed(self, key):
+        with self._lock:
+            return key.lower() in self._keys
+
+    def __contains__(self, key):
+        if self._listed(key):
+            return True
+        if self._complete:
+            return False
+        try:
+            get_s3_client().head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                self.log(f"Error checking s3://{self.bucket_name}/{key}: {e}")
+        except BotoCoreError as e:
+            self.log(f"Error checking s3://{self.bucket_name}/{key}: {e}")
+        return False
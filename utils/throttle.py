@@ -0,0 +1,242 @@
+import os
+import random
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+
+from config import (
+    ADAPTIVE_CONCURRENCY_ENABLED,
+    ADAPTIVE_CPU_TARGET,
+    ADAPTIVE_DECREASE_FACTOR,
+    ADAPTIVE_DOWNLOAD_LIMITS,
+    ADAPTIVE_EXTRACT_LIMITS,
+    ADAPTIVE_INTERVAL_SECONDS,
+    ADAPTIVE_MIN_FREE_DISK_BYTES,
+    ADAPTIVE_UPLOAD_LIMITS,
+    LOCAL_TEMP_DIR,
+    PIPELINE_DOWNLOAD_WORKERS,
+    PIPELINE_EXTRACT_WORKERS,
+    PIPELINE_UPLOAD_WORKERS,
+    THROTTLE_BACKOFF_BASE_SECONDS,
+    THROTTLE_BACKOFF_MAX_SECONDS,
+    THROTTLE_MAX_RETRIES,
+)
+from utils.metrics import metrics
+
+# Error codes S3 (and other AWS services) use to ask clients to slow down
+THROTTLE_ERROR_CODES = frozenset((
+    "SlowDown",
+    "503",
+    "ServiceUnavailable",
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequests",
+))
+
+
+def is_throttle_error(error):
+    """
+    True for S3 SlowDown/503 style errors. boto3's transfer manager wraps
+    the ClientError (e.g. in S3UploadFailedError), so the chained
+    exceptions are checked too; only error codes count, never messages.
+    """
+    while error is not None:
+        if isinstance(error, ClientError):
+            return error.response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def cpu_utilisation():
+    """1-minute load average per core; 1.0 means every core is busy."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return 0.0
+
+
+def free_temp_disk():
+    if not os.path.exists(LOCAL_TEMP_DIR):
+        return None
+    return shutil.disk_usage(LOCAL_TEMP_DIR).free
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one kind of work (S3 downloads, uploads, ffmpeg
+    processes), adjusted by additive increase / multiplicative decrease.
+
+    Callers hold a slot while they work. The controller calls adjust()
+    every ADAPTIVE_INTERVAL_SECONDS: the limit is multiplied by
+    ADAPTIVE_DECREASE_FACTOR after a throttle error or when the host is
+    overloaded, and grows by one when every slot was in use and throughput
+    did not drop since the last increase. Disabled limiters never block.
+    """
+
+    def __init__(self, name, initial, minimum, maximum, enabled=ADAPTIVE_CONCURRENCY_ENABLED):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = min(max(initial, minimum), self.maximum)
+        self.enabled = enabled
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        # Since the last adjust()
+        self._throttled = 0
+        self._bytes = 0
+        self._saturated = False
+        self._last_throughput = None
+
+    @contextmanager
+    def slot(self):
+        """Hold one unit of concurrency for the enclosed block."""
+        with self._condition:
+            if self.enabled:
+                self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, num_bytes):
+        """Count bytes moved (or produced) by a finished job."""
+        with self._condition:
+            self._bytes += num_bytes
+
+    def throttled(self):
+        with self._condition:
+            self._throttled += 1
+
+    def adjust(self, seconds, overloaded=False):
+        """
+        One AIMD step from what was observed over the last `seconds`.
+        Returns the new limit.
+        """
+        with self._condition:
+            throughput = self._bytes / seconds if seconds > 0 else 0.0
+            if self._throttled or overloaded:
+                self.limit = max(self.minimum, int(self.limit * ADAPTIVE_DECREASE_FACTOR))
+                self._last_throughput = None
+            elif self._saturated and self.limit < self.maximum:
+                if self._last_throughput is not None and throughput < self._last_throughput * 0.9:
+                    # The last increase made things slower: step back and hold
+                    self.limit -= 1
+                    self._last_throughput = None
+                else:
+                    self.limit += 1
+                    self._last_throughput = throughput
+            self._throttled = 0
+            self._bytes = 0
+            self._saturated = self.in_flight >= self.limit
+            self._condition.notify_all()
+            return self.limit
+
+
+class ConcurrencyController:
+    """
+    Background thread that re-tunes a set of limiters every
+    ADAPTIVE_INTERVAL_SECONDS from throttle errors, throughput, CPU
+    utilisation (load average per core against ADAPTIVE_CPU_TARGET) and free
+    space in LOCAL_TEMP_DIR (against ADAPTIVE_MIN_FREE_DISK_BYTES).
+
+    CPU pressure backs off ffmpeg ("cpu_bound" limiters); low temp disk
+    backs off everything that fills it (downloads and ffmpeg).
+    """
+
+    def __init__(self, limiters, cpu_bound=(), disk_bound=(), logger=None):
+        self.limiters = limiters
+        self.cpu_bound = set(cpu_bound)
+        self.disk_bound = set(disk_bound)
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for limiter in self.limiters:
+            metrics.register_gauge(
+                "concurrency_limit", lambda limiter=limiter: limiter.limit, kind=limiter.name
+            )
+        if any(limiter.enabled for limiter in self.limiters):
+            self._thread = threading.Thread(target=self._loop, name="concurrency", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for limiter in self.limiters:
+            metrics.unregister_gauge("concurrency_limit", kind=limiter.name)
+
+    def _loop(self):
+        last = time.monotonic()
+        while not self._stop.wait(ADAPTIVE_INTERVAL_SECONDS):
+            now = time.monotonic()
+            self.tick(now - last)
+            last = now
+
+    def tick(self, seconds):
+        cpu = cpu_utilisation()
+        free_disk = free_temp_disk()
+        disk_low = free_disk is not None and free_disk < ADAPTIVE_MIN_FREE_DISK_BYTES
+        for limiter in self.limiters:
+            if not limiter.enabled:
+                continue
+            overloaded = (limiter.name in self.cpu_bound and cpu > ADAPTIVE_CPU_TARGET) or (
+                limiter.name in self.disk_bound and disk_low
+            )
+            previous = limiter.limit
+            limit = limiter.adjust(seconds, overloaded)
+            if limit != previous and self.logger is not None:
+                self.logger.info(
+                    "Concurrency of %s: %s -> %s (cpu %.2f, free temp disk %s MB)",
+                    limiter.name,
+                    previous,
+                    limit,
+                    cpu,
+                    free_disk // 2 ** 20 if free_disk is not None else "?",
+                )
+
+
+def call_with_throttle_retry(fn, limiter=None, logger=None, description="request"):
+    """
+    Call fn(), retrying S3 throttle errors (SlowDown, 503, ...) up to
+    THROTTLE_MAX_RETRIES times with full-jitter exponential backoff. Each
+    attempt holds a slot of limiter, which is free during the backoff, and
+    each throttle is reported to it. Other errors, and a throttle after the
+    last retry, are raised as usual.
+    """
+    for attempt in range(THROTTLE_MAX_RETRIES + 1):
+        try:
+            if limiter is None:
+                return fn()
+            with limiter.slot():
+                return fn()
+        except Exception as e:
+            if not is_throttle_error(e) or attempt == THROTTLE_MAX_RETRIES:
+                raise
+            if limiter is not None:
+                limiter.throttled()
+            metrics.record("throttled", 0, error=True)
+            delay = random.uniform(
+                0, min(THROTTLE_BACKOFF_MAX_SECONDS, THROTTLE_BACKOFF_BASE_SECONDS * 2 ** attempt)
+            )
+            if logger is not None:
+                logger.warning(
+                    "S3 throttled %s (%s); retrying in %.1f s", description, e, delay
+                )
+            time.sleep(delay)
+
+
+# Shared by every downloader, uploader and ffmpeg job in this process
+download_limiter = AdaptiveLimiter("download", PIPELINE_DOWNLOAD_WORKERS, *ADAPTIVE_DOWNLOAD_LIMITS)
+upload_limiter = AdaptiveLimiter("upload", PIPELINE_UPLOAD_WORKERS, *ADAPTIVE_UPLOAD_LIMITS)
+extract_limiter = AdaptiveLimiter("extract", PIPELINE_EXTRACT_WORKERS, *ADAPTIVE_EXTRACT_LIMITS)
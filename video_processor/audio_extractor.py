@@ -1,30 +1,53 @@
 import os
 import subprocess
+import threading
+import time
 
 import ffmpeg
 
+from utils.logger import log_fields
+from utils.pcm import PCM_FFMPEG_OUTPUT_ARGS
 
-def extract_audio(input_file_path, output_file_path, logger):
+# Fragment length for streamed output, in microseconds. An m4a written to a
+# non-seekable pipe must be fragmented (moov up front, moof+mdat per fragment).
+STREAM_FRAGMENT_DURATION_US = 10 * 1000 * 1000
+STREAM_READ_SIZE = 1024 * 1024
+
+
+def extract_audio(input_file_path, output_file_path, logger, pcm_output_path=None):
     """
     Extract the audio stream from input_file_path and save to output_file_path.
+    With pcm_output_path, the same ffmpeg run also decodes the first audio
+    stream to raw 16 kHz mono float32 there (see utils/pcm.py).
     If you prefer using the subprocess approach, uncomment the subprocess example and comment out ffmpeg-python lines.
     """
 
-    logger.info(f"Extracting audio from {input_file_path}...")
+    logger.info("Extracting audio from %s...", input_file_path)
+    start = time.monotonic()
 
     # Example using ffmpeg-python:
     try:
-        (
-            ffmpeg.input(input_file_path)
-            .output(
-                output_file_path, vn=None, acodec="copy"
-            )  # "vn" to disable video, "acodec=copy" to avoid re-encoding
-            .overwrite_output()
-            .run()
+        source = ffmpeg.input(input_file_path)
+        # "vn" to disable video, "acodec=copy" to avoid re-encoding
+        output = source.output(output_file_path, vn=None, acodec="copy")
+        if pcm_output_path is not None:
+            # One demux feeds both outputs; the file is only read once
+            output = ffmpeg.merge_outputs(
+                output, source["a:0"].output(pcm_output_path, **PCM_FFMPEG_OUTPUT_ARGS)
+            )
+        output.overwrite_output().run()
+        logger.info(
+            "Audio extracted successfully: %s",
+            output_file_path,
+            extra=log_fields(
+                os.path.basename(input_file_path),
+                "extract",
+                time.monotonic() - start,
+                os.path.getsize(output_file_path),
+            ),
         )
-        logger.info(f"Audio extracted successfully: {output_file_path}")
     except ffmpeg.Error as e:
-        logger.error(f"ffmpeg-python error: {e.stderr.decode()}")
+        logger.error("ffmpeg-python error: %s", e.stderr.decode())
         raise
 
     # Alternatively, using subprocess:
@@ -36,12 +59,94 @@ def extract_audio(input_file_path, output_file_path, logger):
     # ]
     # try:
     #     subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    #     logger.info(f"Audio extracted successfully: {output_file_path}")
+    #     logger.info("Audio extracted successfully: %s", output_file_path)
     # except subprocess.CalledProcessError as e:
-    #     logger.error(f"Failed to run ffmpeg: {e.stderr}")
+    #     logger.error("Failed to run ffmpeg: %s", e.stderr)
     #     raise
 
     # You can pick which approach (subprocess or ffmpeg-python) you prefer.
 
     # Finally, return the path for further use if needed
     return output_file_path
+
+
+def extract_audio_stream(input_stream, output_stream, logger, read_size=STREAM_READ_SIZE):
+    """
+    Streaming variant of extract_audio: read the video from the file-like
+    input_stream (e.g. an S3 StreamingBody), pipe it through ffmpeg and write
+    the audio as fragmented MP4 to output_stream.write as it is produced.
+    Nothing touches the local disk. The input must have its moov atom before
+    the media data (see video_processor.mp4.moov_precedes_mdat).
+    Returns the number of audio bytes written.
+    """
+
+    logger.info("Extracting audio from stream...")
+
+    process = (
+        ffmpeg.input("pipe:0")
+        .output(
+            "pipe:1",
+            format="mp4",
+            vn=None,
+            acodec="copy",
+            movflags="empty_moov+default_base_moof",
+            frag_duration=STREAM_FRAGMENT_DURATION_US,
+        )
+        .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+    )
+
+    feed_errors = []
+    stderr_chunks = []
+
+    def feed_stdin():
+        try:
+            while True:
+                chunk = input_stream.read(read_size)
+                if not chunk:
+                    break
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg exited early; its exit code and stderr tell us why
+            pass
+        except Exception as e:
+            feed_errors.append(e)
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def drain_stderr():
+        stderr_chunks.append(process.stderr.read())
+
+    feeder = threading.Thread(target=feed_stdin, daemon=True)
+    stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+    feeder.start()
+    stderr_reader.start()
+
+    bytes_written = 0
+    try:
+        while True:
+            chunk = process.stdout.read(read_size)
+            if not chunk:
+                break
+            output_stream.write(chunk)
+            bytes_written += len(chunk)
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        feeder.join()
+        process.wait()
+        stderr_reader.join()
+
+    if feed_errors:
+        raise feed_errors[0]
+    if process.returncode != 0:
+        stderr = b"".join(stderr_chunks)
+        logger.error("ffmpeg-python error: %s", stderr.decode(errors='replace'))
+        raise ffmpeg.Error("ffmpeg", None, stderr)
+
+    logger.info("Audio extracted successfully from stream (%s bytes)", bytes_written)
+    return bytes_written
@@ -0,0 +1,303 @@
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from config import (
+    AUDIO_FETCH_CONCURRENCY,
+    AUDIO_FETCH_MAX_FRACTION,
+    AUDIO_FETCH_MAX_GAP,
+    AUDIO_FETCH_MAX_REQUESTS,
+)
+from utils.metrics import metrics
+from utils.storage import get_s3_client
+from video_processor.downloader import make_range_reader
+from video_processor.mp4 import (
+    find_box_path,
+    find_child_box,
+    iter_child_boxes,
+    iter_top_level_boxes,
+    parse_box_header,
+)
+
+# Same brands ffmpeg writes for an .m4a
+M4A_FTYP = struct.pack(">I4s4sI", 32, b"ftyp", b"M4A ", 512) + b"M4A isomiso2mp41"
+
+
+class UnsupportedLayoutError(ValueError):
+    """The MP4 cannot be handled by the ranged fetcher (fragmented, no audio, ...)."""
+
+
+def _box_payload(data, span, box_type):
+    """Return the (start, end) payload span of a required child box."""
+    found = find_child_box(data, span[0], span[1], box_type)
+    if found is None:
+        raise UnsupportedLayoutError(f"Missing {box_type.decode()} box")
+    box_offset, box_size, header_size = found
+    return box_offset + header_size, box_offset + box_size
+
+
+def read_moov(read_range, object_size):
+    """
+    Locate the top-level moov box with ranged reads and return its bytes.
+    """
+    for box_type, offset, box_size, _ in iter_top_level_boxes(read_range, object_size):
+        if box_type == b"moov":
+            return read_range(offset, offset + box_size - 1)
+        if box_type == b"moof":
+            raise UnsupportedLayoutError("Fragmented MP4 input")
+    raise UnsupportedLayoutError("No moov box found")
+
+
+def find_audio_trak(moov):
+    """
+    Return (offset, box_size) of the first trak in moov whose handler is 'soun'.
+    """
+    moov_header_size = parse_box_header(moov)[2]
+    for box_type, offset, box_size, header_size in iter_child_boxes(
+        moov, moov_header_size, len(moov)
+    ):
+        if box_type == b"mvex":
+            raise UnsupportedLayoutError("Fragmented MP4 input")
+        if box_type != b"trak":
+            continue
+        hdlr = find_box_path(
+            moov, offset + header_size, offset + box_size, [b"mdia", b"hdlr"]
+        )
+        if hdlr is None:
+            continue
+        hdlr_offset, _, hdlr_header_size = hdlr
+        # hdlr payload: version/flags (4), pre_defined (4), handler_type (4)
+        payload = hdlr_offset + hdlr_header_size
+        if moov[payload + 8:payload + 12] == b"soun":
+            return offset, box_size
+    raise UnsupportedLayoutError("No audio track found")
+
+
+def read_chunk_table(trak):
+    """
+    Parse the sample tables of a trak.
+    Returns (chunk_offsets, chunk_sizes, offsets_position, offset_width) where
+    offsets_position is the index in trak of the first stco/co64 entry and
+    offset_width is 4 (stco) or 8 (co64).
+    """
+    _, _, trak_header_size = parse_box_header(trak)
+    stbl = find_box_path(
+        trak, trak_header_size, len(trak), [b"mdia", b"minf", b"stbl"]
+    )
+    if stbl is None:
+        raise UnsupportedLayoutError("Audio track has no sample table")
+    stbl_span = (stbl[0] + stbl[2], stbl[0] + stbl[1])
+
+    # stsz: version/flags, sample_size, sample_count, [entry_size...]
+    start, _ = _box_payload(trak, stbl_span, b"stsz")
+    constant_size, sample_count = struct.unpack_from(">II", trak, start + 4)
+    if constant_size:
+        sample_sizes = None
+    else:
+        sample_sizes = struct.unpack_from(f">{sample_count}I", trak, start + 12)
+
+    # stsc: version/flags, entry_count, [first_chunk, samples_per_chunk, sdi]
+    start, _ = _box_payload(trak, stbl_span, b"stsc")
+    (entry_count,) = struct.unpack_from(">I", trak, start + 4)
+    stsc = [
+        struct.unpack_from(">III", trak, start + 8 + 12 * i) for i in range(entry_count)
+    ]
+
+    # stco / co64: version/flags, entry_count, [chunk_offset...]
+    if find_child_box(trak, stbl_span[0], stbl_span[1], b"stco") is not None:
+        start, _ = _box_payload(trak, stbl_span, b"stco")
+        offset_width, offset_format = 4, "I"
+    else:
+        start, _ = _box_payload(trak, stbl_span, b"co64")
+        offset_width, offset_format = 8, "Q"
+    (chunk_count,) = struct.unpack_from(">I", trak, start + 4)
+    chunk_offsets = list(
+        struct.unpack_from(f">{chunk_count}{offset_format}", trak, start + 8)
+    )
+
+    chunk_sizes = []
+    sample_index = 0
+    for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+        next_first_chunk = stsc[i + 1][0] if i + 1 < len(stsc) else chunk_count + 1
+        for _ in range(first_chunk, min(next_first_chunk, chunk_count + 1)):
+            if sample_sizes is None:
+                chunk_sizes.append(constant_size * samples_per_chunk)
+            else:
+                chunk_sizes.append(
+                    sum(sample_sizes[sample_index:sample_index + samples_per_chunk])
+                )
+            sample_index += samples_per_chunk
+    if len(chunk_sizes) != chunk_count or sample_index != sample_count:
+        raise UnsupportedLayoutError("Inconsistent sample-to-chunk table")
+
+    return chunk_offsets, chunk_sizes, start + 8, offset_width
+
+
+def merge_ranges(spans, max_gap=AUDIO_FETCH_MAX_GAP, max_requests=AUDIO_FETCH_MAX_REQUESTS):
+    """
+    Merge (offset, size) spans sorted by offset into (start, end) byte ranges
+    (end exclusive). Spans closer than max_gap are merged; if that still leaves
+    more than max_requests ranges, the smallest remaining gaps are merged too.
+    """
+    if not spans:
+        return []
+    gaps = [
+        spans[i + 1][0] - (spans[i][0] + spans[i][1]) for i in range(len(spans) - 1)
+    ]
+    threshold = max_gap
+    excess = len(gaps) + 1 - max_requests
+    if excess > 0:
+        threshold = max(threshold, sorted(gaps)[excess - 1])
+
+    ranges = [[spans[0][0], spans[0][0] + spans[0][1]]]
+    for (offset, size), gap in zip(spans[1:], gaps):
+        if gap <= threshold:
+            ranges[-1][1] = max(ranges[-1][1], offset + size)
+        else:
+            ranges.append([offset, offset + size])
+    return [tuple(r) for r in ranges]
+
+
+def rewrite_chunk_offsets(moov, entries_start, offset_width, order, chunk_sizes, position):
+    """
+    Point the stco/co64 entries (starting at entries_start in moov, 4 or 8
+    bytes wide) at the chunks laid out back to back from position, in the
+    given order of chunk indices. Rewrites moov in place.
+    """
+    offset_format = ">I" if offset_width == 4 else ">Q"
+    for i in order:
+        if position >= 2 ** (8 * offset_width):
+            raise UnsupportedLayoutError("Chunk offset does not fit in stco")
+        struct.pack_into(offset_format, moov, entries_start + offset_width * i, position)
+        position += chunk_sizes[i]
+
+
+def _build_moov(moov, trak_offset, trak):
+    """
+    Copy moov keeping only the audio trak. Returns (new_moov, trak_position)
+    where trak_position is the index of the trak inside new_moov.
+    """
+    moov_header_size = parse_box_header(moov)[2]
+    body = bytearray()
+    trak_position = None
+    for box_type, offset, box_size, _ in iter_child_boxes(moov, moov_header_size, len(moov)):
+        if box_type == b"trak":
+            if offset != trak_offset:
+                continue
+            trak_position = 8 + len(body)
+            body.extend(trak)
+        else:
+            body.extend(moov[offset:offset + box_size])
+    new_moov = bytearray(struct.pack(">I4s", 8 + len(body), b"moov")) + body
+    return new_moov, trak_position
+
+
+def _patch_movie_duration(new_moov, trak):
+    """Set the mvhd duration to the audio track's tkhd duration."""
+    mvhd = find_child_box(new_moov, 8, len(new_moov), b"mvhd")
+    tkhd = find_child_box(trak, parse_box_header(trak)[2], len(trak), b"tkhd")
+    if mvhd is None or tkhd is None:
+        return
+    tkhd_start = tkhd[0] + tkhd[2]
+    if trak[tkhd_start] == 1:
+        (duration,) = struct.unpack_from(">Q", trak, tkhd_start + 28)
+    else:
+        (duration,) = struct.unpack_from(">I", trak, tkhd_start + 20)
+    mvhd_start = mvhd[0] + mvhd[2]
+    if new_moov[mvhd_start] == 1:
+        struct.pack_into(">Q", new_moov, mvhd_start + 24, duration)
+    elif duration < 2 ** 32:
+        struct.pack_into(">I", new_moov, mvhd_start + 16, duration)
+
+
+def fetch_audio_track(bucket_name, object_key, output_file_path, logger):
+    """
+    Build the audio-only .m4a for an MP4 in S3 by downloading just the moov box
+    and the audio sample chunks with ranged GETs.
+    Returns output_file_path on success, None if the caller should fall back
+    to a full download.
+    """
+    s3_client = get_s3_client()
+    read_range = make_range_reader(s3_client, bucket_name, object_key)
+    started = time.monotonic()
+
+    try:
+        logger.info("Fetching audio track of %s from bucket %s...", object_key, bucket_name)
+        object_size = s3_client.head_object(Bucket=bucket_name, Key=object_key)[
+            "ContentLength"
+        ]
+        moov = read_moov(read_range, object_size)
+        trak_offset, trak_size = find_audio_trak(moov)
+        trak = bytearray(moov[trak_offset:trak_offset + trak_size])
+        chunk_offsets, chunk_sizes, offsets_position, offset_width = read_chunk_table(trak)
+
+        # Lay the chunks out in the new mdat in their original file order
+        order = sorted(range(len(chunk_offsets)), key=chunk_offsets.__getitem__)
+        spans = [(chunk_offsets[i], chunk_sizes[i]) for i in order if chunk_sizes[i]]
+        ranges = merge_ranges(spans)
+
+        new_moov, trak_position = _build_moov(moov, trak_offset, trak)
+        _patch_movie_duration(new_moov, trak)
+        mdat_size = sum(size for _, size in spans)
+        mdat_header = (
+            struct.pack(">I4s", 8 + mdat_size, b"mdat")
+            if 8 + mdat_size < 2 ** 32
+            else struct.pack(">I4sQ", 1, b"mdat", 16 + mdat_size)
+        )
+
+        fetched = sum(end - start for start, end in ranges)
+        if fetched > object_size * AUDIO_FETCH_MAX_FRACTION:
+            # Interleaving left little video to skip; one full GET is cheaper
+            raise UnsupportedLayoutError(
+                f"audio ranges cover {fetched} of {object_size} bytes"
+            )
+
+        # Point every chunk offset at its position in the new file
+        rewrite_chunk_offsets(
+            new_moov,
+            trak_position + offsets_position,
+            offset_width,
+            order,
+            chunk_sizes,
+            len(M4A_FTYP) + len(new_moov) + len(mdat_header),
+        )
+
+        logger.info(
+            "Fetching %s audio bytes of %s in %s ranged GETs (%s of %s bytes)...",
+            mdat_size,
+            object_key,
+            len(ranges),
+            fetched,
+            object_size,
+        )
+        with open(output_file_path, "wb") as f, ThreadPoolExecutor(
+            max_workers=AUDIO_FETCH_CONCURRENCY
+        ) as executor:
+            f.write(M4A_FTYP)
+            f.write(new_moov)
+            f.write(mdat_header)
+
+            span_index = 0
+            for (start, end), data in zip(
+                ranges, executor.map(lambda r: read_range(r[0], r[1] - 1), ranges)
+            ):
+                while span_index < len(spans) and spans[span_index][0] < end:
+                    offset, size = spans[span_index]
+                    f.write(data[offset - start:offset - start + size])
+                    span_index += 1
+
+        logger.info("Audio track of %s written to %s", object_key, output_file_path)
+        metrics.record("fetch_audio", time.monotonic() - started, fetched)
+        return output_file_path
+    except UnsupportedLayoutError as e:
+        logger.info("Cannot fetch audio track of %s directly: %s", object_key, e)
+        return None
+    except (ClientError, ValueError, struct.error, OSError) as e:
+        logger.error("Failed to fetch audio track of %s: %s", object_key, e)
+        metrics.record("fetch_audio", time.monotonic() - started, error=True)
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        return None
@@ -1,24 +1,61 @@
 import os
+import time
 
-import boto3
 from botocore.exceptions import ClientError
 
-from config import LOCAL_TEMP_DIR, REGION_NAME
+from config import LOCAL_TEMP_DIR
+from utils.logger import log_fields
+from utils.metrics import metrics
+from utils.storage import download_file, transfer_stats
+from utils.throttle import call_with_throttle_retry, download_limiter
 
 
 def download_video_from_s3(bucket_name, object_key, logger):
     """
     Download a video file from S3 to LOCAL_TEMP_DIR.
-    Return the local file path if successful, None if failed.
+    Return the local file path if successful, None if failed (a throttled
+    download only after its retries).
     """
-    s3_client = boto3.client("s3", region_name=REGION_NAME)
     local_path = os.path.join(LOCAL_TEMP_DIR, os.path.basename(object_key))
 
-    try:
-        logger.info(f"Downloading {object_key} from bucket {bucket_name}...")
-        s3_client.download_file(bucket_name, object_key, local_path)
-        logger.info(f"Successfully downloaded {object_key} to {local_path}")
-        return local_path
-    except ClientError as e:
-        logger.error(f"Failed to download {object_key}: {e}")
-        return None
+    with metrics.timed("download") as op:
+        try:
+            logger.info("Downloading %s from bucket %s...", object_key, bucket_name)
+            # SlowDown/503 is retried with backoff instead of failing the job
+            call_with_throttle_retry(
+                lambda: download_file(bucket_name, object_key, local_path, profile="video"),
+                download_limiter,
+                logger,
+                f"download of {object_key}",
+            )
+            op.bytes = os.path.getsize(local_path)
+            download_limiter.record(op.bytes)
+            logger.info(
+                "Successfully downloaded %s to %s",
+                object_key,
+                local_path,
+                extra=log_fields(object_key, "download", op.elapsed(), op.bytes),
+            )
+            return local_path
+        except ClientError as e:
+            op.error = True
+            logger.error("Failed to download %s: %s", object_key, e)
+            return None
+
+
+def make_range_reader(s3_client, bucket_name, object_key):
+    """
+    Return read_range(start, end) that fetches the inclusive byte range
+    start..end of the object with a ranged GET.
+    """
+
+    def read_range(start, end):
+        started = time.monotonic()
+        response = s3_client.get_object(
+            Bucket=bucket_name, Key=object_key, Range=f"bytes={start}-{end}"
+        )
+        data = response["Body"].read()
+        transfer_stats.record("download", "range", len(data), time.monotonic() - started)
+        return data
+
+    return read_range
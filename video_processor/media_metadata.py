@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+
+import ffmpeg
+
+from config import (
+    BUCKET_INPUT,
+    LOCAL_TEMP_DIR,
+    METADATA_BUCKET,
+    METADATA_PROBE_HEAD_BYTES,
+    METADATA_PROBE_TAIL_BYTES,
+    METADATA_TOOL,
+)
+from utils.manifest import STAGE_METADATA
+from utils.metrics import metrics
+from utils.storage import get_s3_client, put_object
+from video_processor.downloader import make_range_reader
+from video_processor.mp4 import HEADER_PROBE_SIZE, iter_top_level_boxes
+
+try:
+    from pymediainfo import MediaInfo
+except ImportError:  # only needed with METADATA_TOOL = "mediainfo"
+    MediaInfo = None
+
+# Top-level boxes whose bodies hold samples or padding, not metadata
+_SKIPPED_BOX_BODIES = (b"mdat", b"free", b"skip", b"wide")
+# More top-level boxes than this means a fragmented file; probe head/tail
+_MAX_PROBED_BOXES = 64
+
+
+def extract_metadata(source, tool=METADATA_TOOL):
+    """
+    Extract metadata from a local video file (or URL, for ffprobe).
+    Returns a JSON-serializable dictionary.
+    """
+    if tool == "ffprobe":
+        return ffmpeg.probe(source)
+    if MediaInfo is None:
+        raise RuntimeError("pymediainfo is not installed; set METADATA_TOOL = 'ffprobe'")
+    media_info = MediaInfo.parse(source)
+    return media_info.to_data()
+
+
+def _caching_reader(read_range, object_size):
+    """
+    Wrap read_range so ranges inside the first HEADER_PROBE_SIZE bytes are
+    served from one up-front request; small boxes then cost no extra GET.
+    """
+    head = read_range(0, min(HEADER_PROBE_SIZE, object_size) - 1)
+
+    def read(start, end):
+        if end < len(head):
+            return head[start:end + 1]
+        return read_range(start, end)
+
+    return read
+
+
+def probe_ranges(read_range, object_size):
+    """
+    Return the (start, end) inclusive byte ranges a metadata tool needs: every
+    top-level MP4 box except sample data and padding, whose headers are
+    enough. Files that are not plain ISO-BMFF get their head and tail.
+    """
+    ranges = []
+    try:
+        for box_type, offset, box_size, header_size in iter_top_level_boxes(
+            read_range, object_size
+        ):
+            if not ranges and box_type != b"ftyp":
+                raise ValueError("Not an ISO-BMFF file")
+            if len(ranges) >= _MAX_PROBED_BOXES:
+                raise ValueError("Too many top-level boxes")
+            end = min(offset + box_size, object_size)
+            if box_type in _SKIPPED_BOX_BODIES:
+                end = min(offset + header_size, end)
+            ranges.append((offset, end - 1))
+        return ranges
+    except ValueError:
+        head_end = min(METADATA_PROBE_HEAD_BYTES, object_size)
+        tail_start = max(head_end, object_size - METADATA_PROBE_TAIL_BYTES)
+        ranges = [(0, head_end - 1)]
+        if tail_start < object_size:
+            ranges.append((tail_start, object_size - 1))
+        return ranges
+
+
+def extract_remote_metadata(bucket_name, object_key, object_size=None, tool=METADATA_TOOL):
+    """
+    Extract metadata without downloading the video. The header boxes (and
+    moov, wherever it sits) are fetched with ranged GETs and written at their
+    offsets into a sparse temp file of the object's size, which MediaInfo or
+    ffprobe then read as if it were the whole file. Sample data is never
+    transferred, so a probe costs a few MB at most.
+    """
+    s3_client = get_s3_client()
+    if object_size is None:
+        object_size = s3_client.head_object(Bucket=bucket_name, Key=object_key)[
+            "ContentLength"
+        ]
+    read_range = _caching_reader(
+        make_range_reader(s3_client, bucket_name, object_key), object_size
+    )
+
+    suffix = os.path.splitext(object_key)[1]
+    fd, sparse_path = tempfile.mkstemp(suffix=suffix, dir=LOCAL_TEMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as sparse_file:
+            # Unwritten regions read back as zeros and take no disk space
+            sparse_file.truncate(object_size)
+            for start, end in probe_ranges(read_range, object_size):
+                sparse_file.seek(start)
+                sparse_file.write(read_range(start, end))
+        return extract_metadata(sparse_path, tool=tool)
+    finally:
+        os.remove(sparse_path)
+
+
+def metadata_key_for(object_key):
+    file_base_name = os.path.splitext(os.path.basename(object_key))[0]
+    return f"{file_base_name}_metadata.json"
+
+
+def upload_metadata(video_metadata, object_key, logger, bucket_name=METADATA_BUCKET):
+    """
+    Upload the metadata JSON for object_key. Returns the metadata key.
+    """
+    metadata_key = metadata_key_for(object_key)
+    serialized_metadata = json.dumps(video_metadata, indent=2, ensure_ascii=False)
+    put_object(
+        bucket_name,
+        metadata_key,
+        serialized_metadata,
+        ContentType="application/json",
+    )
+    logger.info("Metadata uploaded to s3://%s/%s", bucket_name, metadata_key)
+    return metadata_key
+
+
+def run_metadata_stage(
+    object_key,
+    etag,
+    local_video_path,
+    manifest,
+    logger,
+    failures_logger,
+    object_size=None,
+    index_writer=None,
+):
+    """
+    Extract and upload the metadata of one video from BUCKET_INPUT, unless
+    the manifest already has it for this ETag. local_video_path may be None
+    when the video was never downloaded; it is then probed remotely.
+    With an index_writer (METADATA_OUTPUT = "index") the record goes into the
+    shared index instead, and the writer marks it done once its shard is up.
+    Failures are logged but never raised, so they don't fail the extraction.
+    Returns False if the metadata could not be extracted or uploaded.
+    """
+    if manifest.is_done(BUCKET_INPUT, object_key, etag, STAGE_METADATA):
+        return True
+
+    try:
+        logger.info("Extracting metadata for %s...", object_key)
+        with metrics.timed("metadata"):
+            if local_video_path:
+                video_metadata = extract_metadata(local_video_path)
+            else:
+                video_metadata = extract_remote_metadata(BUCKET_INPUT, object_key, object_size)
+        if index_writer is not None:
+            index_writer.add(object_key, etag, video_metadata)
+            return True
+        metadata_key = upload_metadata(video_metadata, object_key, logger)
+    except Exception as e:
+        logger.error("ERROR extracting or uploading metadata for %s: %s", object_key, e)
+        failures_logger.error("METADATA_FAILED: %s", object_key)
+        manifest.mark_failed(BUCKET_INPUT, object_key, etag, STAGE_METADATA, str(e))
+        return False
+
+    manifest.mark_done(BUCKET_INPUT, object_key, etag, STAGE_METADATA, metadata_key)
+    return True
@@ -0,0 +1,134 @@
+import gzip
+import json
+import threading
+import time
+import uuid
+
+from config import (
+    BUCKET_INPUT,
+    METADATA_BUCKET,
+    METADATA_INDEX_PREFIX,
+    METADATA_INDEX_SHARD_RECORDS,
+)
+from utils.manifest import STAGE_METADATA, normalize_etag
+from utils.storage import get_s3_client, iter_objects, put_object
+
+
+class MetadataIndexWriter:
+    """
+    Collects metadata records and uploads them as gzipped JSONL shards of up
+    to shard_records lines, one compact record per video:
+
+        {"key": ..., "etag": ..., "probed_at": ..., "metadata": {...}}
+
+    Shards are never rewritten. Every run writes new ones, named
+    "<prefix>shard-<run>-<seq>.jsonl.gz" with a time-ordered run id, so the
+    index grows incrementally. A video is marked done in the manifest only
+    once the shard holding it is uploaded. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        manifest,
+        logger,
+        failures_logger,
+        bucket_name=METADATA_BUCKET,
+        prefix=METADATA_INDEX_PREFIX,
+        shard_records=METADATA_INDEX_SHARD_RECORDS,
+    ):
+        self.manifest = manifest
+        self.logger = logger
+        self.failures_logger = failures_logger
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.shard_records = shard_records
+        self.run_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + "-" + uuid.uuid4().hex[:8]
+
+        self._lock = threading.Lock()
+        self._records = []
+        self._shard_count = 0
+
+    def add(self, object_key, etag, video_metadata):
+        record = json.dumps(
+            {
+                "key": object_key,
+                "etag": normalize_etag(etag),
+                "probed_at": round(time.time(), 3),
+                "metadata": video_metadata,
+            },
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        with self._lock:
+            self._records.append((object_key, etag, record))
+            if len(self._records) < self.shard_records:
+                return
+            records, self._records = self._records, []
+            shard_key = self._next_shard_key()
+        self._upload(shard_key, records)
+
+    def flush(self):
+        """Upload whatever is buffered as a (possibly short) shard."""
+        with self._lock:
+            if not self._records:
+                return
+            records, self._records = self._records, []
+            shard_key = self._next_shard_key()
+        self._upload(shard_key, records)
+
+    close = flush
+
+    def _next_shard_key(self):
+        self._shard_count += 1
+        return f"{self.prefix}shard-{self.run_id}-{self._shard_count:05d}.jsonl.gz"
+
+    def _upload(self, shard_key, records):
+        body = gzip.compress(
+            ("\n".join(record for _, _, record in records) + "\n").encode("utf-8")
+        )
+        try:
+            put_object(
+                self.bucket_name,
+                shard_key,
+                body,
+                ContentType="application/x-ndjson",
+                ContentEncoding="gzip",
+            )
+        except Exception as e:
+            self.logger.error("ERROR uploading metadata index shard %s: %s", shard_key, e)
+            for object_key, etag, _ in records:
+                self.failures_logger.error("METADATA_FAILED: %s", object_key)
+                self.manifest.mark_failed(
+                    BUCKET_INPUT, object_key, etag, STAGE_METADATA, str(e)
+                )
+            return
+
+        for object_key, etag, _ in records:
+            self.manifest.mark_done(
+                BUCKET_INPUT, object_key, etag, STAGE_METADATA, shard_key
+            )
+        self.logger.info(
+            "Metadata index shard with %s records uploaded to s3://%s/%s",
+            len(records),
+            self.bucket_name,
+            shard_key,
+        )
+
+
+def iter_index_records(bucket_name=METADATA_BUCKET, prefix=METADATA_INDEX_PREFIX):
+    """
+    Yield every record of the index, oldest shard first. A video probed in
+    several runs appears once per run; the last record is the current one.
+    """
+    s3_client = get_s3_client()
+    shard_keys = [item["Key"] for item in iter_objects(bucket_name, prefix + "shard-")]
+    for shard_key in sorted(shard_keys):
+        response = s3_client.get_object(Bucket=bucket_name, Key=shard_key)
+        for line in gzip.decompress(response["Body"].read()).splitlines():
+            if line:
+                yield json.loads(line)
+
+
+def load_index(bucket_name=METADATA_BUCKET, prefix=METADATA_INDEX_PREFIX):
+    """Return {object_key: record} with the latest record of every video."""
+    return {record["key"]: record for record in iter_index_records(bucket_name, prefix)}
@@ -0,0 +1,97 @@
+import struct
+
+# How much of the start of the file to fetch in one request when walking the
+# top-level boxes. Covers ftyp plus a faststart moov for most lecture videos.
+HEADER_PROBE_SIZE = 64 * 1024
+
+
+def parse_box_header(data, offset=0):
+    """
+    Parse the ISO-BMFF box header at data[offset:].
+    Returns (box_type, box_size, header_size). A box_size of 0 means the box
+    runs to the end of the file.
+    """
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header_size = 8
+    if size == 1:
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header_size = 16
+    return box_type, size, header_size
+
+
+def iter_top_level_boxes(read_range, object_size, probe_size=HEADER_PROBE_SIZE):
+    """
+    Yield (box_type, offset, box_size, header_size) for each top-level box.
+
+    read_range(start, end) must return the bytes start..end inclusive, e.g. a
+    ranged S3 GET. Only box headers are read; box bodies are skipped.
+    """
+    probe = read_range(0, min(probe_size, object_size) - 1)
+    offset = 0
+    while offset + 8 <= object_size:
+        if offset + 16 <= len(probe):
+            header = probe[offset:offset + 16]
+        else:
+            header = read_range(offset, min(offset + 16, object_size) - 1)
+        box_type, box_size, header_size = parse_box_header(header)
+        if box_size == 0:
+            box_size = object_size - offset
+        if box_size < header_size:
+            raise ValueError(f"Corrupt MP4 box {box_type!r} at offset {offset}")
+        yield box_type, offset, box_size, header_size
+        offset += box_size
+
+
+def moov_precedes_mdat(read_range, object_size):
+    """
+    True if the moov box comes before mdat ("faststart" layout). Only then can
+    ffmpeg demux the file from a non-seekable pipe.
+    """
+    for box_type, _, _, _ in iter_top_level_boxes(read_range, object_size):
+        if box_type == b"moov":
+            return True
+        if box_type == b"mdat":
+            return False
+    return False
+
+
+def iter_child_boxes(data, start, end):
+    """
+    Yield (box_type, offset, box_size, header_size) for the boxes stored in
+    data[start:end], e.g. the children of a container box already in memory.
+    """
+    offset = start
+    while offset + 8 <= end:
+        box_type, box_size, header_size = parse_box_header(data, offset)
+        if box_size == 0:
+            box_size = end - offset
+        if box_size < header_size or offset + box_size > end:
+            raise ValueError(f"Corrupt MP4 box {box_type!r} at offset {offset}")
+        yield box_type, offset, box_size, header_size
+        offset += box_size
+
+
+def find_child_box(data, start, end, box_type):
+    """
+    Return (offset, box_size, header_size) of the first child box of the given
+    type in data[start:end], or None.
+    """
+    for child_type, offset, box_size, header_size in iter_child_boxes(data, start, end):
+        if child_type == box_type:
+            return offset, box_size, header_size
+    return None
+
+
+def find_box_path(data, start, end, path):
+    """
+    Follow a path of box types (e.g. [b"mdia", b"minf", b"stbl"]) down from
+    data[start:end]. Returns (offset, box_size, header_size) or None.
+    """
+    found = None
+    for box_type in path:
+        found = find_child_box(data, start, end, box_type)
+        if found is None:
+            return None
+        offset, box_size, header_size = found
+        start, end = offset + header_size, offset + box_size
+    return found
@@ -0,0 +1,515 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from config import (
+    ADAPTIVE_CONCURRENCY_ENABLED,
+    AUDIO_ONLY_FETCH_ENABLED,
+    BUCKET_INPUT,
+    BUCKET_OUTPUT,
+    DEDUP_ENABLED,
+    EXTRACT_METADATA,
+    LOCAL_TEMP_DIR,
+    PCM_SIDECAR_ENABLED,
+    PIPELINE_DOWNLOAD_WORKERS,
+    PIPELINE_EXTRACT_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_UPLOAD_WORKERS,
+    STREAMING_ENABLED,
+    TRANSCRIBE_QUEUE_SUBMIT,
+)
+from utils.content_cache import (
+    KIND_AUDIO,
+    KIND_PCM,
+    cache_local_file,
+    content_id,
+    content_id_metadata,
+    reuse_artifact,
+)
+from utils.job_queue import submit_transcription
+from utils.leases import job_id
+from utils.logger import get_log_queue, setup_worker_logging
+from utils.manifest import STAGE_EXTRACTED
+from utils.metrics import metrics
+from utils.pcm import pcm_sidecar_path
+from utils.throttle import (
+    ConcurrencyController,
+    download_limiter,
+    extract_limiter,
+    upload_limiter,
+)
+from video_processor.audio_extractor import extract_audio
+from video_processor.audio_fetcher import fetch_audio_track
+from video_processor.downloader import download_video_from_s3
+from video_processor.media_metadata import run_metadata_stage
+from video_processor.scheduler import (
+    PATH_AUDIO_ONLY,
+    PATH_DOWNLOAD,
+    PATH_STREAM,
+    ResourceBudget,
+    estimate_job_usage,
+)
+from video_processor.streaming import try_stream_audio_to_s3
+from video_processor.uploader import upload_audio_to_s3, upload_pcm_sidecar
+
+# Marks the end of a stage's input queue
+_STOP = None
+
+
+def _init_extract_worker(log_queue):
+    """
+    Pool initializer. With LOG_MODE = "queue" workers log through the
+    parent's listener. Otherwise forked workers inherit the parent's
+    handlers and spawned workers (the macOS default) set up their own.
+    """
+    setup_worker_logging(log_queue)
+
+
+def _extract_in_worker(local_video_path, local_audio_path, local_pcm_path=None):
+    """Runs extract_audio inside a pool process."""
+    return extract_audio(
+        local_video_path,
+        local_audio_path,
+        logging.getLogger("app_logger"),
+        pcm_output_path=local_pcm_path,
+    )
+
+
+def _remove_if_exists(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class _Stage:
+    """
+    A group of worker threads reading from one bounded queue. When the last
+    worker of a stage exits, it closes the next stage's queue.
+    """
+
+    def __init__(self, name, workers, handler, logger, next_stage=None, on_error=None):
+        self.name = name
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self._handler = handler
+        self._logger = logger
+        self._next_stage = next_stage
+        self._on_error = on_error
+        self._alive = workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        metrics.register_gauge("queue_depth", self.queue.qsize, stage=self.name)
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"{self.name}-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        for _ in range(self.workers):
+            self.queue.put(_STOP)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+        metrics.unregister_gauge("queue_depth", stage=self.name)
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _STOP:
+                    break
+                try:
+                    self._handler(*item)
+                except Exception:
+                    # Handlers log their own failures; never let one job
+                    # take a worker down and stall the queue.
+                    self._logger.exception("Unexpected error in %s stage", self.name)
+                    if self._on_error is not None:
+                        self._on_error(*item)
+        finally:
+            with self._lock:
+                self._alive -= 1
+                last_worker = self._alive == 0
+            if last_worker and self._next_stage is not None:
+                self._next_stage.close()
+
+
+class ExtractionPipeline:
+    """
+    Runs download -> extract -> upload as three concurrent stages.
+
+    Downloads and uploads use thread pools, ffmpeg runs in a process pool.
+    Stages are connected by bounded queues, so a slow stage applies
+    back-pressure instead of letting temp files pile up. A download thread
+    starts a job only while its projected temp-disk and memory use, for
+    the path it takes (stream, audio-only fetch or download), fits the
+    budget (see video_processor/scheduler.py). With
+    ADAPTIVE_CONCURRENCY_ENABLED the number of jobs each stage runs at once
+    is tuned at run time (see utils/throttle.py). Skip, failure-logging and
+    cleanup behave the same as the sequential loop in main.py.
+    """
+
+    def __init__(
+        self,
+        app_logger,
+        failures_logger,
+        manifest,
+        processed_audio_keys,
+        coordinator,
+        download_workers=PIPELINE_DOWNLOAD_WORKERS,
+        extract_workers=PIPELINE_EXTRACT_WORKERS,
+        upload_workers=PIPELINE_UPLOAD_WORKERS,
+        metadata_index=None,
+        budget=None,
+    ):
+        self.app_logger = app_logger
+        self.failures_logger = failures_logger
+        self.manifest = manifest
+        self.processed_audio_keys = processed_audio_keys
+        self.coordinator = coordinator
+        self.metadata_index = metadata_index
+        self.budget = budget or ResourceBudget()
+        if ADAPTIVE_CONCURRENCY_ENABLED:
+            # Enough threads for the highest limits; the limiters decide how
+            # many of them actually work at a time
+            download_workers = download_limiter.maximum
+            extract_workers = extract_limiter.maximum
+            upload_workers = upload_limiter.maximum
+        self.extract_workers = extract_workers
+        self._controller = ConcurrencyController(
+            [download_limiter, extract_limiter, upload_limiter],
+            cpu_bound=["extract"],
+            disk_bound=["download", "extract"],
+            logger=app_logger,
+        )
+
+        self._keys_lock = threading.Lock()
+        # Audio keys that are queued or in flight; guards against two input
+        # videos with the same basename being processed at the same time.
+        self._claimed_audio_keys = set()
+        # Jobs handed to the stages and not yet recorded as done or failed
+        self._open_jobs = set()
+        # object_key -> [disk, memory, video bytes] still reserved in the budget
+        self._reservations = {}
+        self._executor = None
+
+        self._upload_stage = _Stage(
+            "upload",
+            upload_workers,
+            self._upload,
+            app_logger,
+            on_error=self._on_stage_error,
+        )
+        self._extract_stage = _Stage(
+            "extract",
+            extract_workers,
+            self._extract,
+            app_logger,
+            self._upload_stage,
+            on_error=self._on_stage_error,
+        )
+        self._download_stage = _Stage(
+            "download",
+            download_workers,
+            self._download,
+            app_logger,
+            self._extract_stage,
+            on_error=self._on_stage_error,
+        )
+
+    def run(self, jobs):
+        """
+        Process every (object_key, audio_object_key, etag, size) yielded by jobs.
+        Blocks until all stages have drained.
+        """
+        stages = [self._download_stage, self._extract_stage, self._upload_stage]
+        with ProcessPoolExecutor(
+            max_workers=self.extract_workers,
+            initializer=_init_extract_worker,
+            initargs=(get_log_queue(),),
+        ) as executor:
+            self._executor = executor
+            for stage in stages:
+                stage.start()
+            self._controller.start()
+            metrics.register_gauge(
+                "budget_bytes_in_use", lambda: self.budget.disk_in_use, resource="disk"
+            )
+            metrics.register_gauge(
+                "budget_bytes_in_use", lambda: self.budget.memory_in_use, resource="memory"
+            )
+
+            try:
+                for object_key, audio_object_key, etag, size in jobs:
+                    audio_key_lower = audio_object_key.lower()
+                    with self._keys_lock:
+                        if audio_key_lower in self._claimed_audio_keys:
+                            self.app_logger.info(
+                                "Audio for %s (would be '%s') is already being processed. "
+                                "Skipping...",
+                                object_key,
+                                audio_object_key,
+                            )
+                            continue
+                        self._claimed_audio_keys.add(audio_key_lower)
+                    if not self.coordinator.claim(
+                        job_id(STAGE_EXTRACTED, BUCKET_INPUT, object_key, etag)
+                    ):
+                        self.app_logger.info(
+                            "%s is handled by another worker. Skipping...", object_key
+                        )
+                        with self._keys_lock:
+                            self._claimed_audio_keys.discard(audio_key_lower)
+                        continue
+                    with self._keys_lock:
+                        self._open_jobs.add(object_key)
+                    self._download_stage.queue.put(
+                        (object_key, audio_object_key, etag, content_id(etag, size), size)
+                    )
+            finally:
+                self._download_stage.close()
+                for stage in stages:
+                    stage.join()
+                self._controller.stop()
+                metrics.unregister_gauge("budget_bytes_in_use", resource="disk")
+                metrics.unregister_gauge("budget_bytes_in_use", resource="memory")
+            self._executor = None
+
+    # ------------------------------------------------------------------
+    # Resource budget
+    # ------------------------------------------------------------------
+    def _reserve(self, object_key, size, path):
+        """
+        Block until the job's projected disk and memory use for path fits
+        the budget. _download calls it before each path it tries, so a
+        streamed job never holds disk for a download it does not make.
+
+        A job needing more than it holds gives its reservation back and
+        waits as a new admission: a waiting download thread then holds
+        nothing, and the jobs that do all make progress without it.
+        """
+        disk, memory = estimate_job_usage(size, path)
+        with self._keys_lock:
+            reservation = self._reservations.get(object_key)
+        if reservation is not None:
+            if disk <= reservation[0]:
+                return
+            self._finish(object_key)
+        if self.budget.oversized(disk, memory):
+            self.app_logger.warning(
+                "%s needs ~%d MB of temp disk and %d MB of memory, more than the "
+                "budget; it will run on its own",
+                object_key,
+                disk // 2 ** 20,
+                memory // 2 ** 20,
+            )
+        self.budget.acquire(disk, memory)
+        video_bytes = size if path == PATH_DOWNLOAD else 0
+        with self._keys_lock:
+            self._reservations[object_key] = [disk, memory, video_bytes]
+
+    def _release_video(self, object_key):
+        """The downloaded video is deleted; give its disk space back early."""
+        with self._keys_lock:
+            reservation = self._reservations.get(object_key)
+            if reservation is None or not reservation[2]:
+                return
+            video_bytes = reservation[2]
+            reservation[0] -= video_bytes
+            reservation[2] = 0
+        self.budget.release(video_bytes, 0, finished=False)
+
+    def _finish(self, object_key):
+        with self._keys_lock:
+            reservation = self._reservations.pop(object_key, None)
+        if reservation is not None:
+            self.budget.release(reservation[0], reservation[1])
+
+    def _on_stage_error(self, object_key, audio_object_key, etag, *_):
+        # A handler died before recording the job: log it as failed and give
+        # back its lease and reservation, as its own failure path would
+        with self._keys_lock:
+            recorded = object_key not in self._open_jobs
+        if recorded:
+            self._finish(object_key)
+        else:
+            self._record_failure(object_key, etag, "UNEXPECTED_ERROR")
+
+    def _record_success(self, object_key, audio_object_key, etag, cid):
+        with self._keys_lock:
+            self._open_jobs.discard(object_key)
+        self.manifest.mark_done(
+            BUCKET_INPUT, object_key, etag, STAGE_EXTRACTED, audio_object_key
+        )
+        self.manifest.put_artifact(cid, KIND_AUDIO, BUCKET_OUTPUT, audio_object_key)
+        if TRANSCRIBE_QUEUE_SUBMIT:
+            submit_transcription(BUCKET_OUTPUT, audio_object_key)
+        with self._keys_lock:
+            self.processed_audio_keys.add(audio_object_key.lower())
+        self.coordinator.release(
+            job_id(STAGE_EXTRACTED, BUCKET_INPUT, object_key, etag), True
+        )
+        self._finish(object_key)
+
+    def _record_failure(self, object_key, etag, reason):
+        with self._keys_lock:
+            self._open_jobs.discard(object_key)
+        self.failures_logger.error("%s: %s", reason, object_key)
+        self.manifest.mark_failed(BUCKET_INPUT, object_key, etag, STAGE_EXTRACTED, reason)
+        self.coordinator.release(
+            job_id(STAGE_EXTRACTED, BUCKET_INPUT, object_key, etag), False
+        )
+        self._finish(object_key)
+
+    def _metadata(self, object_key, etag, local_video_path):
+        if EXTRACT_METADATA:
+            run_metadata_stage(
+                object_key,
+                etag,
+                local_video_path,
+                self.manifest,
+                self.app_logger,
+                self.failures_logger,
+                index_writer=self.metadata_index,
+            )
+
+    # ------------------------------------------------------------------
+    # Stage handlers
+    # ------------------------------------------------------------------
+    def _download(self, object_key, audio_object_key, etag, cid, size):
+        self.app_logger.info("Processing video file: %s", object_key)
+
+        # A copy of a video that was already extracted: reuse its audio
+        if DEDUP_ENABLED and reuse_artifact(
+            self.manifest,
+            cid,
+            KIND_AUDIO,
+            BUCKET_OUTPUT,
+            audio_object_key,
+            self.app_logger,
+            extra_args=content_id_metadata(cid, copy=True),
+        ):
+            self._metadata(object_key, etag, None)
+            self._record_success(object_key, audio_object_key, etag, cid)
+            return
+
+        if STREAMING_ENABLED:
+            # ffmpeg runs as a subprocess fed from this thread, so streamed
+            # jobs skip the extract and upload stages entirely.
+            self._reserve(object_key, size, PATH_STREAM)
+            streamed = try_stream_audio_to_s3(
+                BUCKET_INPUT,
+                object_key,
+                BUCKET_OUTPUT,
+                audio_object_key,
+                self.app_logger,
+                metadata=content_id_metadata(cid)["Metadata"],
+            )
+            if streamed is not None:
+                self._metadata(object_key, etag, None)
+                if streamed:
+                    self._record_success(object_key, audio_object_key, etag, cid)
+                else:
+                    self._record_failure(object_key, etag, "STREAMING_FAILED")
+                return
+
+        if AUDIO_ONLY_FETCH_ENABLED:
+            self._reserve(object_key, size, PATH_AUDIO_ONLY)
+            local_audio_path = fetch_audio_track(
+                BUCKET_INPUT,
+                object_key,
+                os.path.join(LOCAL_TEMP_DIR, audio_object_key),
+                self.app_logger,
+            )
+            if local_audio_path:
+                self._metadata(object_key, etag, None)
+                # Already remuxed from the audio chunks; ffmpeg is not needed
+                self._upload_stage.queue.put(
+                    (object_key, audio_object_key, etag, cid, local_audio_path)
+                )
+                return
+
+        self._reserve(object_key, size, PATH_DOWNLOAD)
+        try:
+            local_video_path = download_video_from_s3(
+                BUCKET_INPUT, object_key, self.app_logger
+            )
+        except Exception:
+            self.app_logger.exception("Download failed for %s", object_key)
+            local_video_path = None
+
+        if not local_video_path:
+            self._record_failure(object_key, etag, "DOWNLOAD_FAILED")
+            return
+
+        # Probe the local copy before it is handed to ffmpeg and deleted
+        self._metadata(object_key, etag, local_video_path)
+        self._extract_stage.queue.put(
+            (object_key, audio_object_key, etag, cid, local_video_path)
+        )
+
+    def _extract(self, object_key, audio_object_key, etag, cid, local_video_path):
+        local_audio_path = os.path.join(LOCAL_TEMP_DIR, audio_object_key)
+        try:
+            # Timed here, not in the pool process, so it lands in this
+            # process's metrics; includes the wait for a free worker.
+            with metrics.timed("extract") as op, extract_limiter.slot():
+                future = self._executor.submit(
+                    _extract_in_worker,
+                    local_video_path,
+                    local_audio_path,
+                    pcm_sidecar_path(local_audio_path) if PCM_SIDECAR_ENABLED else None,
+                )
+                future.result()
+                op.bytes = os.path.getsize(local_audio_path)
+            extract_limiter.record(op.bytes)
+        except Exception:
+            self.app_logger.exception("Audio extraction failed for %s", object_key)
+            self._record_failure(object_key, etag, "EXTRACTION_FAILED")
+            _remove_if_exists(local_audio_path)
+            _remove_if_exists(pcm_sidecar_path(local_audio_path))
+            return
+        finally:
+            # The video is not needed past this point; free the disk early.
+            _remove_if_exists(local_video_path)
+            self._release_video(object_key)
+
+        self._upload_stage.queue.put(
+            (object_key, audio_object_key, etag, cid, local_audio_path)
+        )
+
+    def _upload(self, object_key, audio_object_key, etag, cid, local_audio_path):
+        try:
+            uploaded = upload_audio_to_s3(
+                local_audio_path,
+                BUCKET_OUTPUT,
+                audio_object_key,
+                self.app_logger,
+                extra_args=content_id_metadata(cid),
+            )
+        except Exception:
+            self.app_logger.exception("Upload failed for %s", object_key)
+            uploaded = False
+
+        if not uploaded:
+            self._record_failure(object_key, etag, "UPLOAD_FAILED")
+        else:
+            upload_pcm_sidecar(
+                local_audio_path,
+                BUCKET_OUTPUT,
+                audio_object_key,
+                self.app_logger,
+                extra_args=content_id_metadata(cid),
+            )
+            self._record_success(object_key, audio_object_key, etag, cid)
+            cache_local_file(cid, KIND_AUDIO, local_audio_path)
+            cache_local_file(cid, KIND_PCM, pcm_sidecar_path(local_audio_path))
+
+        _remove_if_exists(local_audio_path)
+        _remove_if_exists(pcm_sidecar_path(local_audio_path))
@@ -0,0 +1,140 @@
+import heapq
+import os
+import shutil
+import threading
+
+from config import (
+    AUDIO_TO_VIDEO_SIZE_RATIO,
+    EXTRACT_MEMORY_PER_JOB_BYTES,
+    LOCAL_TEMP_DIR,
+    MEMORY_BUDGET_BYTES,
+    PCM_SIDECAR_ENABLED,
+    SCHEDULE_ORDER,
+    SCHEDULE_WINDOW,
+    TEMP_DISK_BUDGET_BYTES,
+    TEMP_DISK_BUDGET_FRACTION,
+)
+
+
+def order_jobs(jobs, size_of, order=SCHEDULE_ORDER, window=SCHEDULE_WINDOW):
+    """
+    Reorder a stream of jobs by size.
+
+    "largest_first" starts the biggest files early, so under concurrency a
+    huge file overlaps with many small ones instead of running alone at the
+    end of the run. "smallest_first" gets the most files done soonest.
+    "listing" keeps the input order. Only `window` jobs are buffered at a
+    time, so a listing of millions of keys is never held in memory and work
+    starts before the listing ends.
+    """
+    if order == "listing":
+        yield from jobs
+        return
+
+    sign = -1 if order == "largest_first" else 1
+    heap = []
+    # The counter keeps equal sizes in listing order and avoids comparing jobs
+    for seq, job in enumerate(jobs):
+        heapq.heappush(heap, (sign * size_of(job), seq, job))
+        if len(heap) >= window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+# Ways _download can produce the audio, in the order it tries them
+PATH_STREAM = "stream"
+PATH_AUDIO_ONLY = "audio_only"
+PATH_DOWNLOAD = "download"
+
+
+def estimate_job_usage(video_size, path=PATH_DOWNLOAD):
+    """
+    Projected peak (temp disk, memory) bytes of one extraction job taking
+    path: a full download holds the video plus the audio (and PCM sidecar)
+    written next to it, the audio-only fetch just the remuxed audio, and a
+    streamed job nothing. Each runs one ffmpeg process (or its share of
+    ranged reads) in memory.
+    """
+    audio_size = int(video_size * AUDIO_TO_VIDEO_SIZE_RATIO)
+    if path == PATH_STREAM:
+        disk = 0
+    elif path == PATH_AUDIO_ONLY:
+        disk = audio_size
+    else:
+        disk = video_size + audio_size
+        if PCM_SIDECAR_ENABLED:
+            # 512 kbit/s of float32 PCM against a typical 128 kbit/s AAC track
+            disk += 4 * audio_size
+    return disk, EXTRACT_MEMORY_PER_JOB_BYTES
+
+
+def _default_disk_budget():
+    if TEMP_DISK_BUDGET_BYTES is not None:
+        return TEMP_DISK_BUDGET_BYTES
+    if not os.path.exists(LOCAL_TEMP_DIR):
+        os.makedirs(LOCAL_TEMP_DIR)
+    return int(shutil.disk_usage(LOCAL_TEMP_DIR).free * TEMP_DISK_BUDGET_FRACTION)
+
+
+def _default_memory_budget():
+    if MEMORY_BUDGET_BYTES is not None:
+        return MEMORY_BUDGET_BYTES
+    try:
+        # Half of physical memory; the rest is left to the OS page cache
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class ResourceBudget:
+    """
+    Admission control for jobs with a projected temp-disk and memory peak.
+    acquire() blocks until the job fits next to those already admitted. A
+    job larger than a whole budget is admitted once nothing else is running,
+    so it still gets processed (alone) instead of waiting forever.
+
+    A budget of None is unlimited.
+    """
+
+    def __init__(self, disk_bytes=None, memory_bytes=None):
+        self.disk_bytes = _default_disk_budget() if disk_bytes is None else disk_bytes
+        self.memory_bytes = _default_memory_budget() if memory_bytes is None else memory_bytes
+        self.disk_in_use = 0
+        self.memory_in_use = 0
+        self.jobs = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, disk, memory):
+        if self.jobs == 0:
+            return True
+        if self.disk_bytes is not None and self.disk_in_use + disk > self.disk_bytes:
+            return False
+        if self.memory_bytes is not None and self.memory_in_use + memory > self.memory_bytes:
+            return False
+        return True
+
+    def oversized(self, disk, memory):
+        """True if the job exceeds a whole budget and will run alone."""
+        return (self.disk_bytes is not None and disk > self.disk_bytes) or (
+            self.memory_bytes is not None and memory > self.memory_bytes
+        )
+
+    def acquire(self, disk, memory):
+        with self._condition:
+            self._condition.wait_for(lambda: self._fits(disk, memory))
+            self.disk_in_use += disk
+            self.memory_in_use += memory
+            self.jobs += 1
+
+    def release(self, disk, memory, finished=True):
+        """
+        Give back part of a job's reservation (e.g. the video once ffmpeg
+        is done with it), or the rest of it with finished=True.
+        """
+        with self._condition:
+            self.disk_in_use -= disk
+            self.memory_in_use -= memory
+            if finished:
+                self.jobs -= 1
+            self._condition.notify_all()
@@ -0,0 +1,110 @@
+import struct
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from config import STREAMING_PART_SIZE
+from utils.logger import log_fields
+from utils.metrics import metrics
+from utils.storage import get_s3_client, transfer_stats
+from video_processor.audio_extractor import extract_audio_stream
+from video_processor.downloader import make_range_reader
+from video_processor.mp4 import moov_precedes_mdat
+from video_processor.uploader import MultipartUploadWriter
+
+
+def is_streamable_video(bucket_name, object_key, logger):
+    """
+    Check with a few ranged GETs whether the video's moov atom precedes its
+    media data, which is required to demux it from a pipe.
+    """
+    s3_client = get_s3_client()
+    try:
+        object_size = s3_client.head_object(Bucket=bucket_name, Key=object_key)[
+            "ContentLength"
+        ]
+        read_range = make_range_reader(s3_client, bucket_name, object_key)
+        return moov_precedes_mdat(read_range, object_size)
+    except (ClientError, BotoCoreError, ValueError, struct.error) as e:
+        logger.error("Could not inspect MP4 layout of %s: %s", object_key, e)
+        return False
+
+
+def stream_audio_to_s3(
+    input_bucket, object_key, output_bucket, audio_object_key, logger, metadata=None
+):
+    """
+    Stream the video from S3 through ffmpeg into a multipart upload of the
+    audio, without any local temp files. metadata is stored on the audio.
+    Returns True if the audio was uploaded, False otherwise.
+    """
+    s3_client = get_s3_client()
+    writer = None
+    start = time.monotonic()
+
+    try:
+        logger.info(
+            "Streaming %s from bucket %s to s3://%s/%s...",
+            object_key,
+            input_bucket,
+            output_bucket,
+            audio_object_key,
+        )
+        body = s3_client.get_object(Bucket=input_bucket, Key=object_key)["Body"]
+        writer = MultipartUploadWriter(
+            s3_client,
+            output_bucket,
+            audio_object_key,
+            STREAMING_PART_SIZE,
+            content_type="audio/mp4",
+            metadata=metadata,
+        )
+        extract_audio_stream(body, writer, logger)
+        writer.close()
+        transfer_stats.record(
+            "upload", "stream", writer.bytes_written, time.monotonic() - start
+        )
+        metrics.record("stream", time.monotonic() - start, writer.bytes_written)
+        logger.info(
+            "Successfully streamed audio of %s to s3://%s/%s",
+            object_key,
+            output_bucket,
+            audio_object_key,
+            extra=log_fields(
+                object_key, "stream", time.monotonic() - start, writer.bytes_written
+            ),
+        )
+        return True
+    except Exception as e:
+        # S3 (ClientError, BotoCoreError read timeouts, ...) or ffmpeg: either
+        # way the multipart upload must not be left behind
+        logger.error("Failed to stream audio for %s: %s", object_key, e)
+        metrics.record("stream", time.monotonic() - start, error=True)
+        if writer is not None:
+            try:
+                writer.abort()
+            except (ClientError, BotoCoreError) as abort_error:
+                logger.error(
+                    "Failed to abort multipart upload for %s: %s", audio_object_key, abort_error
+                )
+        return False
+
+
+def try_stream_audio_to_s3(
+    input_bucket, object_key, output_bucket, audio_object_key, logger, metadata=None
+):
+    """
+    Stream the audio if the video layout allows it.
+    Returns None if the video must go through the download/extract/upload
+    path instead, otherwise the result of stream_audio_to_s3.
+    """
+    if not is_streamable_video(input_bucket, object_key, logger):
+        logger.info(
+            "moov atom of %s is not at the start of the file; "
+            "falling back to a local download.",
+            object_key,
+        )
+        return None
+    return stream_audio_to_s3(
+        input_bucket, object_key, output_bucket, audio_object_key, logger, metadata
+    )
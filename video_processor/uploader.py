@@ -1,25 +1,133 @@
-import boto3
+import os
+
+from boto3.exceptions import S3UploadFailedError
 from botocore.exceptions import ClientError
 
-from config import REGION_NAME
+from utils.logger import log_fields
+from utils.metrics import metrics
+from utils.pcm import pcm_sidecar_path
+from utils.storage import upload_file
+from utils.throttle import call_with_throttle_retry, upload_limiter
 
 
-def upload_audio_to_s3(local_file_path, bucket_name, object_key, logger):
+def upload_audio_to_s3(local_file_path, bucket_name, object_key, logger, extra_args=None):
     """
     Upload the local extracted audio file to S3.
     object_key should be the desired key (filename) in the destination bucket.
+    extra_args are passed to the upload (e.g. Metadata).
+    """
+    with metrics.timed("upload") as op:
+        try:
+            logger.info(
+                "Uploading %s to bucket %s (key: %s)...", local_file_path, bucket_name, object_key
+            )
+            # SlowDown/503 is retried with backoff instead of failing the job
+            call_with_throttle_retry(
+                lambda: upload_file(
+                    local_file_path,
+                    bucket_name,
+                    object_key,
+                    profile="audio",
+                    extra_args=extra_args,
+                ),
+                upload_limiter,
+                logger,
+                f"upload of {object_key}",
+            )
+            op.bytes = os.path.getsize(local_file_path)
+            upload_limiter.record(op.bytes)
+            logger.info(
+                "Successfully uploaded %s to s3://%s/%s",
+                local_file_path,
+                bucket_name,
+                object_key,
+                extra=log_fields(object_key, "upload", op.elapsed(), op.bytes),
+            )
+            return True
+        except (ClientError, S3UploadFailedError) as e:
+            op.error = True
+            logger.error("Failed to upload %s: %s", local_file_path, e)
+            return False
+
+
+def upload_pcm_sidecar(local_audio_path, bucket_name, audio_object_key, logger, extra_args=None):
+    """
+    Upload the PCM sidecar written next to local_audio_path, if there is one,
+    under the sidecar key of audio_object_key. A failed upload is only a
+    warning: transcription then decodes the .m4a as usual.
+    """
+    local_pcm_path = pcm_sidecar_path(local_audio_path)
+    if not os.path.exists(local_pcm_path):
+        return False
+    uploaded = upload_audio_to_s3(
+        local_pcm_path,
+        bucket_name,
+        pcm_sidecar_path(audio_object_key),
+        logger,
+        extra_args=extra_args,
+    )
+    if not uploaded:
+        logger.warning("PCM sidecar of %s not uploaded; transcription will decode it", audio_object_key)
+    return uploaded
+
+
+class MultipartUploadWriter:
     """
-    s3_client = boto3.client("s3", region_name=REGION_NAME)
+    File-like sink that streams bytes into an S3 multipart upload.
+    Data is buffered until part_size bytes are available, then sent as one
+    part. Call close() to complete the upload or abort() to discard it.
+    """
+
+    def __init__(
+        self, s3_client, bucket_name, object_key, part_size, content_type=None, metadata=None
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.part_size = part_size
+        self.bytes_written = 0
 
-    try:
-        logger.info(
-            f"Uploading {local_file_path} to bucket {bucket_name} (key: {object_key})..."
+        extra_args = {"ContentType": content_type} if content_type else {}
+        if metadata:
+            extra_args["Metadata"] = metadata
+        response = s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=object_key, **extra_args
         )
-        s3_client.upload_file(local_file_path, bucket_name, object_key)
-        logger.info(
-            f"Successfully uploaded {local_file_path} to s3://{bucket_name}/{object_key}"
+        self.upload_id = response["UploadId"]
+        self._buffer = bytearray()
+        self._parts = []
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def close(self):
+        # The last part may be smaller than the S3 minimum part size
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self._parts},
         )
-        return True
-    except ClientError as e:
-        logger.error(f"Failed to upload {local_file_path}: {e}")
-        return False
+
+    def abort(self):
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self.object_key, UploadId=self.upload_id
+        )
+
+    def _upload_part(self, data):
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
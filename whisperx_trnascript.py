@@ -1,12 +1,70 @@
 
+import gzip
+import io
 import os
+import tarfile
 import time
 import torch
 import whisperx
-import boto3
 import math
 
-s3_client = boto3.client("s3")
+import numpy as np
+
+from botocore.exceptions import ClientError
+from whisperx.audio import SAMPLE_RATE
+
+from config import (
+    ARTIFACT_CACHE_DIR,
+    CHECKPOINT_ENABLED,
+    CHECKPOINT_MIN_AUDIO_SECONDS,
+    CHECKPOINT_SPAN_SECONDS,
+    DEDUP_ENABLED,
+    PARALLEL_MIN_AUDIO_SECONDS,
+    PCM_SIDECAR_ENABLED,
+    PREFETCH_DEPTH,
+    TRANSCRIBE_BATCH_FILES,
+    TRANSCRIBE_BATCH_SIZE,
+    TRANSCRIBE_DEVICE,
+    TRANSCRIBE_LANGUAGE,
+    TRANSCRIBE_MODEL,
+    TRANSCRIPT_BUCKET,
+    TRANSCRIPT_BUNDLE,
+    TRANSCRIPT_CHUNK_SIZES,
+    TRANSCRIPT_GZIP,
+    TRANSCRIPT_PREFIX,
+)
+from transcriber.align_cache import AlignModelCache
+from transcriber.batching import load_audios, transcribe_batch
+from transcriber.checkpoint import SpanCheckpoint, discard_checkpoint, run_spans
+from transcriber.cpu_profile import load_cpu_model, load_cpu_profile
+from transcriber.parallel import ParallelTranscriber, find_split_points, merge_span_results
+from transcriber.prefetch import AudioPrefetcher, BackgroundUploader
+from transcriber.word_store import WordStore
+from utils.content_cache import (
+    KIND_AUDIO,
+    KIND_PCM,
+    KIND_TRANSCRIPTS,
+    get_local_cache,
+    read_content_id,
+)
+from utils.leases import WorkCoordinator, job_id
+from utils.manifest import STAGE_TRANSCRIBED, JobManifest
+from utils.metrics import metrics
+from utils.pcm import pcm_sidecar_path
+from utils.storage import (
+    copy_object,
+    download_file,
+    get_s3_client,
+    iter_objects,
+    put_objects,
+    transfer_stats,
+)
+
+align_model_cache = AlignModelCache()
+# Set by load_transcription_model() on CPU nodes whose profile has workers
+parallel_transcriber = None
+# model.transcribe settings; the CPU profile replaces the batch size
+transcribe_options = {"batch_size": TRANSCRIBE_BATCH_SIZE}
 
 def merge_missing_timestamps(word_segments):
     merged_segments = []
@@ -43,57 +101,327 @@ def chunk_word_segments(word_segments, chunk_size):
         lines.append(f"{start:.2f} --> {end:.2f}: {text}")
     return "\n".join(lines)
 
-def list_all_s3_objects(bucket, prefix=None):
+def download_audio(source_bucket, source_key, local_audio_dir, cid=None):
     """
-    Returns a list of all objects under 'prefix' in 'bucket' using S3 pagination.
+    Download one audio file into local_audio_dir and return its local path.
+    With PCM_SIDECAR_ENABLED its PCM sidecar is fetched instead when the
+    extraction stage wrote one, so the file needs no decoding. With
+    ARTIFACT_CACHE_DIR set, files extracted on this node (or downloaded
+    before) are taken from the local cache instead.
     """
-    continuation_token = None
-    all_objects = []
-    while True:
-        if continuation_token:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
-                Prefix=prefix,
-                ContinuationToken=continuation_token
+    os.makedirs(local_audio_dir, exist_ok=True)
+    local_audio_path = os.path.join(local_audio_dir, os.path.basename(source_key))
+
+    if PCM_SIDECAR_ENABLED:
+        try:
+            return fetch_file(
+                source_bucket,
+                pcm_sidecar_path(source_key),
+                pcm_sidecar_path(local_audio_path),
+                cid,
+                KIND_PCM,
             )
-        else:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
-                Prefix=prefix
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404", "NotFound"):
+                raise
+    return fetch_file(source_bucket, source_key, local_audio_path, cid, KIND_AUDIO)
+
+def fetched_size(source_bucket, pending):
+    """
+    Bytes download_audio puts on disk for a pending file: with
+    PCM_SIDECAR_ENABLED that is its sidecar (about 4x the .m4a) when the
+    extraction stage wrote one, otherwise the listed .m4a size.
+    """
+    key, _, _, _, size, _ = pending
+    if PCM_SIDECAR_ENABLED:
+        try:
+            response = get_s3_client().head_object(
+                Bucket=source_bucket, Key=pcm_sidecar_path(key)
             )
-        contents = response.get("Contents", [])
-        all_objects.extend(contents)
+            return response["ContentLength"]
+        except ClientError:
+            # No sidecar (or no answer): the download will tell
+            pass
+    return size
+
+def fetch_file(source_bucket, source_key, local_path, cid, kind):
+    """Download one object to local_path, going through the local cache."""
+    local_cache = get_local_cache() if cid is not None else None
+    if local_cache is not None and local_cache.get(cid, kind, local_path):
+        print(f"\nUsing cached copy of s3://{source_bucket}/{source_key}")
+        return local_path
+
+    print(f"\nDownloading s3://{source_bucket}/{source_key} to {local_path} ...")
+    with metrics.timed("download") as op:
+        download_file(source_bucket, source_key, local_path, profile="audio")
+        op.bytes = os.path.getsize(local_path)
+    if local_cache is not None:
+        local_cache.put(cid, kind, local_path)
+    return local_path
+
+def align_result(result, audio, device="cuda"):
+    """
+    Align the transcription segments of one file, reusing the cached
+    alignment model for its language.
+    """
+    model_a, metadata = align_model_cache.get(result["language"], device)
+    return whisperx.align(
+        result["segments"],
+        model_a,
+        metadata,
+        audio,
+        device=device,
+        return_char_alignments=False
+    )
 
-        if response.get("IsTruncated"):
-            continuation_token = response.get("NextContinuationToken")
-        else:
-            break
-    return all_objects
+def transcript_filenames(base_name):
+    """Names of the objects upload_transcripts stores for base_name."""
+    if TRANSCRIPT_BUNDLE:
+        return [f"{base_name}_transcripts.tar"]
+    return (
+        [f"{base_name}_transcript.txt", f"{base_name}_word_timestamps.txt"]
+        + [f"{base_name}_{chunk_size}sec_timestamps.txt" for chunk_size in TRANSCRIPT_CHUNK_SIZES]
+        + [f"{base_name}_words.npz"]
+    )
 
-def list_all_s3_objects_noprefix(bucket):
+def reuse_transcripts(manifest, cid, base_name, target_bucket, transcripts_subfolder):
     """
-    Returns a list of all objects under 'prefix' in 'bucket' using S3 pagination.
+    If audio with the same content was transcribed before, server-side copy
+    its transcript files to base_name's names and return True. The manifest
+    stores the transcripts of a content id as "<subfolder>/<base name>".
     """
-    continuation_token = None
-    all_objects = []
-    while True:
-        if continuation_token:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
-                ContinuationToken=continuation_token
+    artifact = manifest.get_artifact(cid, KIND_TRANSCRIPTS)
+    if artifact is None:
+        return False
+    source_bucket, source_prefix = artifact
+    source_base_name = os.path.basename(source_prefix)
+    if (source_bucket, source_prefix) == (
+        target_bucket, os.path.join(transcripts_subfolder, base_name)
+    ):
+        return False
+
+    print(f"Transcripts for {base_name} already exist as s3://{source_bucket}/{source_prefix}*; copying")
+    try:
+        for source_name, target_name in zip(
+            transcript_filenames(source_base_name), transcript_filenames(base_name)
+        ):
+            copy_object(
+                source_bucket,
+                os.path.join(os.path.dirname(source_prefix), source_name),
+                target_bucket,
+                os.path.join(transcripts_subfolder, target_name),
+                profile="text",
             )
-        else:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404", "NotFound"):
+            raise
+        print(f"Cached transcripts s3://{source_bucket}/{source_prefix}* are incomplete")
+        manifest.forget_artifact(cid, KIND_TRANSCRIPTS)
+        return False
+    return True
+
+def record_transcribed(manifest, source_bucket, pending, target_bucket):
+    """Mark a file done and remember its transcripts for its content id."""
+    key, etag, job, transcript_key, _, cid = pending
+    manifest.mark_done(source_bucket, key, etag, STAGE_TRANSCRIBED, transcript_key)
+    if CHECKPOINT_ENABLED:
+        # The transcripts are stored; partial results are no longer needed
+        discard_checkpoint(job)
+    if cid is not None:
+        manifest.put_artifact(
+            cid,
+            KIND_TRANSCRIPTS,
+            target_bucket,
+            transcript_key[: -len("_transcript.txt")],
+        )
+
+def _render(write):
+    """Bytes that write(f) produces on a UTF-8 text stream, kept in memory."""
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+    write(text)
+    text.flush()
+    text.detach()
+    return buffer.getvalue()
+
+def render_transcripts(aligned_result, base_name):
+    """
+    Render the transcript, word timestamps, chunk files (one per
+    TRANSCRIPT_CHUNK_SIZES entry) and the columnar word sidecar for one file
+    in memory. Returns [(filename, bytes), ...].
+    """
+    word_segments = aligned_result.get("word_segments", [])
+    word_segments = merge_missing_timestamps(word_segments)
+    word_store = WordStore.from_segments(word_segments)
+    # Format every word once and reuse the lines for all chunk sizes
+    word_lines = word_store.word_lines()
+
+    def write_transcript(f):
+        for i, segment in enumerate(aligned_result["segments"]):
+            if i:
+                f.write(" ")
+            f.write(segment["text"])
+
+    def write_word_timestamps(f):
+        for line in word_lines:
+            f.write(line)
+            f.write("\n")
+
+    artifacts = [
+        (f"{base_name}_transcript.txt", _render(write_transcript)),
+        (f"{base_name}_word_timestamps.txt", _render(write_word_timestamps)),
+    ]
+    for chunk_size in TRANSCRIPT_CHUNK_SIZES:
+        artifacts.append((
+            f"{base_name}_{chunk_size}sec_timestamps.txt",
+            _render(lambda f, chunk_size=chunk_size: word_store.write_chunks(f, chunk_size, word_lines)),
+        ))
+
+    # The columnar word timestamps, for later re-chunking and the search index
+    sidecar = io.BytesIO()
+    word_store.save(sidecar)
+    artifacts.append((f"{base_name}_words.npz", sidecar.getvalue()))
+    return artifacts
+
+def write_transcripts(aligned_result, base_name, local_audio_dir):
+    """
+    Write the rendered transcript files for one file into local_audio_dir.
+    Returns the list of written paths.
+    """
+    local_paths = []
+    for filename, body in render_transcripts(aligned_result, base_name):
+        local_path = os.path.join(local_audio_dir, filename)
+        with open(local_path, "wb") as f:
+            f.write(body)
+        local_paths.append(local_path)
+    return local_paths
+
+def bundle_transcripts(base_name, artifacts):
+    """All artifacts of one file as a single uncompressed tar archive."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for filename, body in artifacts:
+            info = tarfile.TarInfo(filename)
+            info.size = len(body)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(body))
+    return f"{base_name}_transcripts.tar", buffer.getvalue()
+
+def upload_transcripts(artifacts, target_bucket, target_prefix, base_name):
+    """
+    Upload rendered artifacts ([(filename, bytes), ...]) to S3 with
+    concurrent put_object calls, as one tar with TRANSCRIPT_BUNDLE and gzip
+    encoded with TRANSCRIPT_GZIP.
+    """
+    if TRANSCRIPT_BUNDLE:
+        artifacts = [bundle_transcripts(base_name, artifacts)]
+    objects = []
+    for filename, body in artifacts:
+        s3_key = os.path.join(target_prefix, "transcripts", filename)
+        kwargs = {}
+        if not filename.endswith(".npz"):
+            kwargs["ContentType"] = (
+                "application/x-tar" if filename.endswith(".tar") else "text/plain; charset=utf-8"
             )
-        contents = response.get("Contents", [])
-        all_objects.extend(contents)
+            # The .npz sidecar stays plain so it can be read with np.load
+            if TRANSCRIPT_GZIP:
+                body = gzip.compress(body, mtime=0)
+                kwargs["ContentEncoding"] = "gzip"
+        objects.append((s3_key, body, kwargs))
+    print(f"Uploading {len(objects)} transcript file(s) for {base_name} to s3://{target_bucket}/{target_prefix}/transcripts/ ...")
+    with metrics.timed("upload") as op:
+        put_objects(target_bucket, objects)
+        op.bytes = sum(len(body) for _, body, _ in objects)
+
+def save_and_upload_transcripts(
+    aligned_result,
+    base_name,
+    target_bucket,
+    target_prefix
+):
+    """Render the transcript files for one file and upload them to S3."""
+    artifacts = render_transcripts(aligned_result, base_name)
+    upload_transcripts(artifacts, target_bucket, target_prefix, base_name)
+
+def transcribe_span(model, audio, start, end, device="cuda"):
+    """
+    Transcribe and align audio[start:end]; timestamps are relative to start.
+    """
+    span_audio = np.asarray(audio[start:end], dtype=np.float32)
+    with metrics.timed("transcribe") as op:
+        result = model.transcribe(span_audio, batch_size=transcribe_options["batch_size"])
+        op.bytes = span_audio.nbytes
+    if not result["segments"]:
+        return {"segments": [], "word_segments": [], "language": result["language"]}
+    with metrics.timed("align"):
+        aligned = align_result(result, span_audio, device=device)
+    aligned["language"] = result["language"]
+    return aligned
+
+def transcribe_with_checkpoints(model, audio, checkpoint, device="cuda"):
+    """
+    Transcribe a long file span by span, so a killed run resumes after the
+    last span recorded in checkpoint.
+    """
+    spans = find_split_points(audio, CHECKPOINT_SPAN_SECONDS)
+    results = run_spans(
+        spans,
+        lambda start, end: transcribe_span(model, audio, start, end, device=device),
+        checkpoint,
+    )
+    return merge_span_results(results, [start / SAMPLE_RATE for start, _ in spans])
 
-        if response.get("IsTruncated"):
-            continuation_token = response.get("NextContinuationToken")
+def transcribe_and_align(model, local_audio_paths, device="cuda", job_ids=None):
+    """
+    Transcribe and align local audio files. A single file is transcribed on
+    its own; several files share one batched model.transcribe call. Long
+    files go to the parallel transcriber when there is one, and are
+    checkpointed per span under their job id with CHECKPOINT_ENABLED.
+    Returns one aligned result per path.
+    """
+    with metrics.timed("decode") as op:
+        audios = load_audios(local_audio_paths)
+        # float32 samples, so bytes / 64000 is the audio duration in seconds
+        op.bytes = sum(audio.nbytes for audio in audios)
+
+    aligned = [None] * len(audios)
+    for i, audio in enumerate(audios):
+        checkpoint = None
+        if CHECKPOINT_ENABLED and job_ids is not None:
+            checkpoint = SpanCheckpoint(job_ids[i], len(audio))
+        seconds = len(audio) / SAMPLE_RATE
+        if parallel_transcriber is not None and seconds >= PARALLEL_MIN_AUDIO_SECONDS:
+            # Transcription and alignment both run in the workers
+            with metrics.timed("transcribe") as op:
+                aligned[i] = parallel_transcriber.transcribe(
+                    local_audio_paths[i], audio, checkpoint=checkpoint
+                )
+                op.bytes = audio.nbytes
+        elif checkpoint is not None and seconds >= CHECKPOINT_MIN_AUDIO_SECONDS:
+            aligned[i] = transcribe_with_checkpoints(model, audio, checkpoint, device=device)
+    rest = [i for i, result in enumerate(aligned) if result is None]
+    if not rest:
+        return aligned
+    audios = [audios[i] for i in rest]
+
+    with metrics.timed("transcribe") as op:
+        if len(audios) == 1:
+            results = [model.transcribe(audios[0], batch_size=transcribe_options["batch_size"])]
         else:
-            break
-    return all_objects
+            results = transcribe_batch(
+                model, audios, transcribe_options["batch_size"], language=TRANSCRIBE_LANGUAGE
+            )
+        op.bytes = sum(audio.nbytes for audio in audios)
+    for i, result, audio in zip(rest, results, audios):
+        with metrics.timed("align"):
+            aligned[i] = align_result(result, audio, device=device)
+    return aligned
+
+def remove_local_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
 def process_single_file(
     model,
@@ -102,165 +430,378 @@ def process_single_file(
     target_bucket,
     target_prefix,
     local_audio_dir,
-    device="cuda"
+    device="cuda",
+    job_id=None,
+    cid=None
 ):
-    os.makedirs(local_audio_dir, exist_ok=True)
+    process_file_batch(
+        model,
+        source_bucket,
+        [source_key],
+        target_bucket,
+        target_prefix,
+        local_audio_dir,
+        device=device,
+        job_ids=[job_id] if job_id is not None else None,
+        cids=[cid]
+    )
 
-    audio_filename = os.path.basename(source_key)
-    base_name, _ = os.path.splitext(audio_filename)
-    local_audio_path = os.path.join(local_audio_dir, audio_filename)
+def process_file_batch(
+    model,
+    source_bucket,
+    source_keys,
+    target_bucket,
+    target_prefix,
+    local_audio_dir,
+    device="cuda",
+    job_ids=None,
+    cids=None
+):
+    """
+    Download, transcribe, align and upload several files. With more than one
+    key they are decoded together and transcribed in one batched
+    model.transcribe call. job_ids name the checkpoints of long files; cids
+    (content ids) let downloads go through the local artifact cache.
+    """
+    cids = cids or [None] * len(source_keys)
+    local_audio_paths = []
+    try:
+        for source_key, cid in zip(source_keys, cids):
+            local_audio_paths.append(
+                download_audio(source_bucket, source_key, local_audio_dir, cid=cid)
+            )
 
-    print(f"\nDownloading s3://{source_bucket}/{source_key} to {local_audio_path} ...")
-    s3_client.download_file(source_bucket, source_key, local_audio_path)
+        print(f"Transcribing {', '.join(local_audio_paths)} ...")
+        total_start_time = time.time()
 
-    print(f"Transcribing {local_audio_path} ...")
-    total_start_time = time.time()
+        aligned_results = transcribe_and_align(
+            model, local_audio_paths, device=device, job_ids=job_ids
+        )
 
-    result = model.transcribe(local_audio_path)
-    detected_language = result["language"]
+        total_end_time = time.time()
+        print(f"Total transcription + alignment time: {total_end_time - total_start_time:.2f} s")
 
-    model_a, metadata = whisperx.load_align_model(
-        language_code=detected_language,
-        device=device
-    )
+        for source_key, aligned in zip(source_keys, aligned_results):
+            base_name, _ = os.path.splitext(os.path.basename(source_key))
+            save_and_upload_transcripts(
+                aligned, base_name, target_bucket, target_prefix
+            )
+    finally:
+        # Clean up local files
+        for local_audio_path in local_audio_paths:
+            remove_local_file(local_audio_path)
 
-    aligned_result = whisperx.align(
-        result["segments"],
-        model_a,
-        metadata,
-        local_audio_path,
-        device=device,
-        return_char_alignments=False
+def run_prefetched(
+    model,
+    pending_files,
+    source_bucket,
+    target_bucket,
+    target_prefix,
+    local_audio_dir,
+    manifest,
+    coordinator,
+    device="cuda"
+):
+    """
+    Transcription driver that keeps the model busy: the next PREFETCH_DEPTH
+    files download while the current batch transcribes, and transcript
+    uploads plus local cleanup run in background threads. A file is marked
+    done in the manifest only after all its uploads succeeded.
+    Returns the number of failed files.
+    """
+    prefetcher = AudioPrefetcher(
+        pending_files,
+        fetch=lambda pending: download_audio(
+            source_bucket, pending[0], local_audio_dir, cid=pending[5]
+        ),
+        size_of=lambda pending: fetched_size(source_bucket, pending),
     )
+    uploader = BackgroundUploader()
+    metrics.register_gauge("prefetch_bytes_on_disk", lambda: prefetcher.bytes_on_disk)
+    metrics.register_gauge("queue_depth", lambda: prefetcher.queued, stage="prefetch")
+    metrics.register_gauge("queue_depth", lambda: uploader.pending, stage="upload")
+    failures = 0
+
+    def mark_failed(pending, error):
+        key, etag, job, _, _, _ = pending
+        print(f"FAILED {key}: {error}")
+        manifest.mark_failed(source_bucket, key, etag, STAGE_TRANSCRIBED, str(error))
+        coordinator.release(job, False)
+
+    def mark_done(pending):
+        record_transcribed(manifest, source_bucket, pending, target_bucket)
+        coordinator.release(pending[2], True)
+
+    def transcribe_batch_and_queue_uploads(batch):
+        pendings = [pending for pending, _ in batch]
+        local_audio_paths = [path for _, path in batch]
+        try:
+            print(f"Transcribing {', '.join(local_audio_paths)} ...")
+            total_start_time = time.time()
+            aligned_results = transcribe_and_align(
+                model,
+                local_audio_paths,
+                device=device,
+                job_ids=[pending[2] for pending in pendings]
+            )
+            print(f"Total transcription + alignment time: {time.time() - total_start_time:.2f} s")
+            base_names = [os.path.splitext(os.path.basename(pending[0]))[0] for pending in pendings]
+            artifacts_per_file = [
+                render_transcripts(aligned, base_name)
+                for base_name, aligned in zip(base_names, aligned_results)
+            ]
+        except Exception as e:
+            for pending in pendings:
+                mark_failed(pending, e)
+            return len(pendings)
+        finally:
+            for pending, local_audio_path in batch:
+                remove_local_file(local_audio_path)
+                prefetcher.release(pending)
+
+        for pending, base_name, artifacts in zip(pendings, base_names, artifacts_per_file):
+            uploader.submit(
+                lambda artifacts=artifacts, base_name=base_name: upload_transcripts(
+                    artifacts, target_bucket, target_prefix, base_name
+                ),
+                on_success=lambda pending=pending: mark_done(pending),
+                on_failure=lambda error, pending=pending: mark_failed(pending, error),
+            )
+        return 0
+
+    batch = []
+    for pending, local_audio_path, error in prefetcher:
+        if error is not None:
+            mark_failed(pending, error)
+            failures += 1
+            continue
+        batch.append((pending, local_audio_path))
+        if len(batch) >= TRANSCRIBE_BATCH_FILES:
+            failures += transcribe_batch_and_queue_uploads(batch)
+            batch = []
+    if batch:
+        failures += transcribe_batch_and_queue_uploads(batch)
+
+    failures += uploader.wait()
+    metrics.unregister_gauge("prefetch_bytes_on_disk")
+    metrics.unregister_gauge("queue_depth", stage="prefetch")
+    metrics.unregister_gauge("queue_depth", stage="upload")
+    return failures
+
+def iter_pending_files(
+    source_objs,
+    extension,
+    source_bucket,
+    target_bucket,
+    transcripts_subfolder,
+    existing_base_names,
+    manifest,
+    coordinator
+):
+    """
+    Yield (key, etag, job, transcript_key, size, cid) for every audio file
+    that still needs a transcript and that this worker has claimed. Files
+    whose content was already transcribed under another name get copies of
+    those transcripts instead. cid is None unless DEDUP_ENABLED or
+    ARTIFACT_CACHE_DIR is set.
+    """
+    for item in source_objs:
+        key = item["Key"]
+        etag = item["ETag"]
+        if not key.endswith(extension):
+            continue
+
+        audio_filename = os.path.basename(key)
+        base_name, _ = os.path.splitext(audio_filename)
+
+        if manifest.is_done(source_bucket, key, etag, STAGE_TRANSCRIBED):
+            print(f"SKIPPING {key} because it is already transcribed.")
+            continue
+
+        transcript_key = os.path.join(transcripts_subfolder, f"{base_name}_transcript.txt")
+        if base_name in existing_base_names:
+            print(f"SKIPPING {key} because {base_name}_transcript.txt already exists.")
+            manifest.mark_done(source_bucket, key, etag, STAGE_TRANSCRIBED, transcript_key)
+            continue
+
+        job = job_id(STAGE_TRANSCRIBED, source_bucket, key, etag)
+        if not coordinator.claim(job):
+            print(f"SKIPPING {key} because another worker is handling it.")
+            continue
+
+        # A HEAD request; only dedup and the local cache use the content id
+        cid = None
+        if DEDUP_ENABLED or ARTIFACT_CACHE_DIR is not None:
+            cid = read_content_id(source_bucket, key, etag, item["Size"])
+        pending = (key, etag, job, transcript_key, item["Size"], cid)
+        if DEDUP_ENABLED and reuse_transcripts(
+            manifest, cid, base_name, target_bucket, transcripts_subfolder
+        ):
+            record_transcribed(manifest, source_bucket, pending, target_bucket)
+            coordinator.release(job, True)
+            continue
+
+        yield pending
+
+def iter_batches(items, batch_files):
+    """Group items into lists of up to batch_files."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_files:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def load_transcription_model(model_name=TRANSCRIBE_MODEL, device=TRANSCRIBE_DEVICE):
+    """
+    Load the WhisperX model (and start the parallel transcriber on CPU
+    nodes that use one). Returns (model, device).
+    """
+    global parallel_transcriber
 
-    total_end_time = time.time()
-    print(f"Total transcription + alignment time: {total_end_time - total_start_time:.2f} s")
-
-    transcript_text = " ".join(segment["text"] for segment in aligned_result["segments"])
-    transcript_filename = f"{base_name}_transcript.txt"
-    transcript_path = os.path.join(local_audio_dir, transcript_filename)
-
-    word_timestamps_filename = f"{base_name}_word_timestamps.txt"
-    word_timestamps_path = os.path.join(local_audio_dir, word_timestamps_filename)
-
-    chunked_30s_filename = f"{base_name}_30sec_timestamps.txt"
-    chunked_30s_path = os.path.join(local_audio_dir, chunked_30s_filename)
-
-    chunked_60s_filename = f"{base_name}_60sec_timestamps.txt"
-    chunked_60s_path = os.path.join(local_audio_dir, chunked_60s_filename)
+    if device == "cuda" and not torch.cuda.is_available():
+        print("CUDA not available, using CPU instead.")
+        device = "cpu"
 
-    word_segments = aligned_result.get("word_segments", [])
-    word_segments = merge_missing_timestamps(word_segments)
+    if device != "cpu":
+        print(f"Loading WhisperX model '{model_name}' on device '{device}' ...")
+        return whisperx.load_model(model_name, device=device), device
 
-    # Save full transcript
-    with open(transcript_path, "w", encoding="utf-8") as f:
-        f.write(transcript_text)
-
-    # Save all word timestamps
-    with open(word_timestamps_path, "w", encoding="utf-8") as f:
-        for wseg in word_segments:
-            wstart = wseg["start"]
-            wend = wseg["end"]
-            wtext = wseg.get("text") or wseg.get("word") or "<NO_TEXT_FIELD>"
-            line = f"{wstart:.2f} --> {wend:.2f}: {wtext}"
-            f.write(line + "\n")
-
-    # Save chunked by 30s
-    chunked_30s_text = chunk_word_segments(word_segments, chunk_size=30)
-    with open(chunked_30s_path, "w", encoding="utf-8") as f:
-        f.write(chunked_30s_text)
-
-    # Save chunked by 60s
-    chunked_60s_text = chunk_word_segments(word_segments, chunk_size=60)
-    with open(chunked_60s_path, "w", encoding="utf-8") as f:
-        f.write(chunked_60s_text)
-
-    # Upload files back to S3
-    for local_txt_path in [
-        transcript_path,
-        word_timestamps_path,
-        chunked_30s_path,
-        chunked_60s_path
-    ]:
-        fname = os.path.basename(local_txt_path)
-        s3_key = os.path.join(target_prefix, "transcripts", fname)
-        print(f"Uploading {local_txt_path} to s3://{target_bucket}/{s3_key} ...")
-        s3_client.upload_file(local_txt_path, target_bucket, s3_key)
-
-    # Clean up local files
-    try:
-        os.remove(local_audio_path)
-    except OSError:
-        pass
-    for fpath in [
-        transcript_path,
-        word_timestamps_path,
-        chunked_30s_path,
-        chunked_60s_path
-    ]:
-        try:
-            os.remove(fpath)
-        except OSError:
-            pass
+    # Tuned by tune_cpu_profile.py, or the CPU_* defaults
+    profile = load_cpu_profile(model_name)
+    print(
+        f"Loading WhisperX model '{model_name}' on CPU ({profile['compute_type']}, "
+        f"{profile['threads'] or os.cpu_count()} threads, batch size {profile['batch_size']}) ..."
+    )
+    model = load_cpu_model(profile)
+    transcribe_options["batch_size"] = profile["batch_size"]
+
+    if profile["workers"] > 0:
+        # Long files are split across worker processes instead of using `model`
+        parallel_transcriber = ParallelTranscriber(
+            model_name,
+            workers=profile["workers"],
+            compute_type=profile["compute_type"],
+            threads_per_worker=profile["threads_per_worker"],
+            batch_size=profile["batch_size"],
+            vad_options={"vad_onset": profile["vad_onset"], "vad_offset": profile["vad_offset"]},
+        )
+    return model, device
 
 def main():
     # Buckets and prefixes
     source_bucket = "demodaran-all-audio"
     source_prefix = "audio"
-    target_bucket = "transcript-demodaran-all"
-    target_prefix = "output"
+    target_bucket = TRANSCRIPT_BUCKET
+    target_prefix = TRANSCRIPT_PREFIX
 
     # Local dir and file extension
     local_audio_dir = "audio"
     extension = ".m4a"
 
     # Load WhisperX model
-    device = "cuda"
-    model_name = "base.en"
-    if device == "cuda" and not torch.cuda.is_available():
-        print("CUDA not available, using CPU instead.")
-        device = "cpu"
-
-    print(f"Loading WhisperX model '{model_name}' on device '{device}' ...")
-    model = whisperx.load_model(model_name, device=device)
+    model, device = load_transcription_model()
 
-    # Gather all existing transcript files from target bucket (pagination handled)
-    existing_base_names = set()
-    transcripts_subfolder = os.path.join(target_prefix, "transcripts")
+    metrics.start("transcribe")
+    manifest = JobManifest()
+    # Decides which files this node transcribes when several nodes share the bucket
+    coordinator = WorkCoordinator()
+    coordinator.start()
 
-    all_transcript_objs = list_all_s3_objects(bucket=target_bucket, prefix=transcripts_subfolder)
-    for item in all_transcript_objs:
-        key = item["Key"]
-        if key.endswith("_transcript.txt"):
-            filename = os.path.basename(key)
-            if filename.endswith("_transcript.txt"):
-                base_name_done = filename.replace("_transcript.txt", "")
-                existing_base_names.add(base_name_done)
-
-    # Gather all audio files from source bucket (pagination handled)
-    all_source_objs = list_all_s3_objects_noprefix(bucket=source_bucket)
-
-    # Process each file unless it's already transcribed
-    for item in all_source_objs:
-        key = item["Key"]
-        if key.endswith(extension):
-            audio_filename = os.path.basename(key)
-            base_name, _ = os.path.splitext(audio_filename)
-            
-            if base_name in existing_base_names:
-                print(f"SKIPPING {key} because {base_name}_transcript.txt already exists.")
-                continue
-            
-            print(f"Processing {key} ...")
-            process_single_file(
+    try:
+        # Gather all existing transcript files from target bucket.
+        # Only needed until the manifest has seen one complete pass.
+        existing_base_names = set()
+        transcripts_subfolder = os.path.join(target_prefix, "transcripts")
+
+        if manifest.get_checkpoint(STAGE_TRANSCRIBED, source_bucket) is None:
+            # A transcript file, or the bundle of a TRANSCRIPT_BUNDLE run
+            suffixes = ("_transcript.txt", "_transcripts.tar")
+            for item in iter_objects(target_bucket, transcripts_subfolder, suffixes=suffixes):
+                filename = os.path.basename(item["Key"])
+                for suffix in suffixes:
+                    if filename.endswith(suffix):
+                        existing_base_names.add(filename[:-len(suffix)])
+
+        # Audio files from the source bucket, streamed as the listing pages arrive
+        source_objs = iter_objects(source_bucket, suffixes=(extension,))
+
+        pending_files = iter_pending_files(
+            source_objs,
+            extension,
+            source_bucket,
+            target_bucket,
+            transcripts_subfolder,
+            existing_base_names,
+            manifest,
+            coordinator
+        )
+
+        if PREFETCH_DEPTH > 0:
+            # Downloads and uploads overlap with transcription
+            failures = run_prefetched(
                 model=model,
+                pending_files=pending_files,
                 source_bucket=source_bucket,
-                source_key=key,
                 target_bucket=target_bucket,
                 target_prefix=target_prefix,
                 local_audio_dir=local_audio_dir,
+                manifest=manifest,
+                coordinator=coordinator,
                 device=device
             )
+            if failures:
+                raise RuntimeError(f"{failures} file(s) failed to transcribe or upload")
+        else:
+            # Process each file (or batch of files) unless it's already transcribed
+            for batch in iter_batches(pending_files, TRANSCRIBE_BATCH_FILES):
+                keys = [pending[0] for pending in batch]
+                print(f"Processing {', '.join(keys)} ...")
+                try:
+                    if len(batch) == 1:
+                        process_single_file(
+                            model=model,
+                            source_bucket=source_bucket,
+                            source_key=keys[0],
+                            target_bucket=target_bucket,
+                            target_prefix=target_prefix,
+                            local_audio_dir=local_audio_dir,
+                            device=device,
+                            job_id=batch[0][2],
+                            cid=batch[0][5]
+                        )
+                    else:
+                        process_file_batch(
+                            model=model,
+                            source_bucket=source_bucket,
+                            source_keys=keys,
+                            target_bucket=target_bucket,
+                            target_prefix=target_prefix,
+                            local_audio_dir=local_audio_dir,
+                            device=device,
+                            job_ids=[pending[2] for pending in batch],
+                            cids=[pending[5] for pending in batch]
+                        )
+                except Exception as e:
+                    for key, etag, job, _, _, _ in batch:
+                        manifest.mark_failed(source_bucket, key, etag, STAGE_TRANSCRIBED, str(e))
+                        coordinator.release(job, False)
+                    raise
+                for pending in batch:
+                    record_transcribed(manifest, source_bucket, pending, target_bucket)
+                    coordinator.release(pending[2], True)
+        manifest.set_checkpoint(STAGE_TRANSCRIBED, source_bucket)
+    finally:
+        # Also runs when a file fails, so no worker process or SQLite handle leaks
+        if parallel_transcriber is not None:
+            parallel_transcriber.close()
+        coordinator.stop()
+        manifest.close()
+        metrics.stop()
+        transfer_stats.log_summary(print)
+        metrics.log_summary(print)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file